@@ -13,12 +13,10 @@ import glob
 import json
 import os
 import platform
-import select
 import serial
 import shlex
 import signal
 import socket
-import struct
 import sys
 import threading
 import time
@@ -32,6 +30,9 @@ except NameError:
     except ImportError:
         from imp import reload
 
+# first, so --startup-profile includes the time taken by the other imports
+from MAVProxy.modules.lib import mp_startup
+
 from pymavlink import mavutil
 
 from MAVProxy.modules.lib import textconsole
@@ -40,15 +41,27 @@ from MAVProxy.modules.lib import rline
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_substitute
 from MAVProxy.modules.lib import multiproc
+from MAVProxy.modules.lib import mp_linkopen
+from MAVProxy.modules.lib import mp_perf
+from MAVProxy.modules.lib import mp_select
+from MAVProxy.modules.lib import mp_scheduler
+from MAVProxy.modules.lib import mp_dedup
+from MAVProxy.modules.lib import mp_outqueue
+from MAVProxy.modules.lib import mp_routing
+from MAVProxy.modules.lib import mp_tlog
+from MAVProxy.modules.lib import mp_tlogindex
+from MAVProxy.modules.lib import mp_tseries
 from MAVProxy.modules.mavproxy_link import preferred_ports
 
 # adding all this allows pyinstaller to build a working windows executable
 # note that using --hidden-import does not work for these modules
 try:
     multiproc.freeze_support()
-    from pymavlink import mavwp  # noqa
-    import matplotlib  # noqa
-    import HTMLParser  # noqa
+    if getattr(sys, 'frozen', False):
+        # only needed to make them part of the build, they are slow to import
+        from pymavlink import mavwp  # noqa
+        import matplotlib  # noqa
+        import HTMLParser  # noqa
 except Exception:
     pass
 
@@ -83,6 +96,8 @@ class MPStatus(object):
         self.msg_count = {}
         self.counters = {'MasterIn' : [], 'MasterOut' : 0, 'FGearIn' : 0, 'FGearOut' : 0, 'Slave' : 0}
         self.bytecounters = {'MasterIn': []}
+        # link quality statistics by link number, updated once a second
+        self.link_stats = []
         self.setup_mode = opts.setup
         self.mav_error = 0
         self.altitude = 0
@@ -256,6 +271,12 @@ class MPState(object):
             MPSetting('mavfwd_disarmed', bool, True, 'Allow forwarded control when disarmed'),
             MPSetting('mavfwd_rate', bool, False, 'Allow forwarded rate control'),
             MPSetting('mavfwd_link', int, -1, 'Forward to a specific link'),
+            MPSetting('dedup', bool, True, 'Only process the first copy of messages received on several links'),
+            MPSetting('dedup_window', float, mp_dedup.WINDOW, 'Time a message is remembered for dedup (s)',
+                      range=(0, 10), increment=0.05),
+            MPSetting('outqueue_size', int, 256, 'Send queue size for each output (kB)', range=(1, 65536), increment=1),
+            MPSetting('outqueue_policy', str, 'drop-oldest', 'What to drop when an output send queue is full',
+                      choice=mp_outqueue.POLICIES),
             MPSetting('shownoise', bool, True, 'Show non-MAVLink data'),
             MPSetting('baudrate', int, opts.baudrate, 'baudrate for new links', range=(0, 10000000), increment=1),
             MPSetting('rtscts', bool, opts.rtscts, 'enable flow control'),
@@ -269,6 +290,19 @@ class MPState(object):
             MPSetting('script_fatal', bool, False, 'fatal error on bad script', tab='Debug'),
             MPSetting('compdebug', int, 0, 'Computation Debug Mask', range=(0, 3), tab='Debug'),
             MPSetting('flushlogs', bool, False, 'Flush logs on every packet'),
+            MPSetting('tlog_flush_period', float, 10, 'Maximum time telemetry log data is buffered (seconds)',
+                      range=(0, 3600), increment=1),
+            MPSetting('tlog_rotate_size', int, 0, 'Start a new telemetry log after this many MB (0 to disable)',
+                      range=(0, 1000000), increment=1),
+            MPSetting('tlog_rotate_time', int, 0, 'Start a new telemetry log after this many seconds (0 to disable)',
+                      range=(0, 10000000), increment=1),
+            MPSetting('tlog_fsync', str, 'none', 'When to fsync telemetry logs', choice=mp_tlog.FSYNC_POLICIES),
+            MPSetting('tlog_compress', bool, False, 'gzip new telemetry log segments'),
+            MPSetting('perfstats', bool, False, 'Collect main loop and module timing statistics'),
+            MPSetting('perfstats_dump', int, 0, 'Interval to save timing statistics to the log directory (seconds)',
+                      range=(0, 86400), increment=1),
+            MPSetting('history', float, mp_tseries.HORIZON, 'Seconds of telemetry history kept (0 to disable)',
+                      range=(0, 86400), increment=10),
             MPSetting('requireexit', bool, False, 'Require exit command'),
             MPSetting('wpupdates', bool, True, 'Announce waypoint updates'),
             MPSetting('wpterrainadjust', bool, True, 'Adjust alt of moved wp using terrain'),
@@ -297,6 +331,7 @@ class MPState(object):
             MPSetting('flytoframe', str, 'AboveHome', 'frame for FlyTo', choice=['AboveHome', 'AGL', 'AMSL']),
 
             MPSetting('fwdpos', bool, False, 'Forward GLOBAL_POSITION_INT on all links'),
+            MPSetting('fastfwd', bool, False, 'Forward messages no module uses without decoding them'),
             MPSetting('checkdelay', bool, True, 'check for link delay'),
             MPSetting('param_ftp', bool, True, 'try ftp for parameter download'),
             MPSetting('param_docs', bool, True, 'show help for parameters'),
@@ -315,12 +350,16 @@ class MPState(object):
             "set"            : ["(SETTING)"],
             "status"         : ["(VARIABLE)"],
             "module"    : ["list",
+                           "stats <reset|json>",
                            "load (AVAILMODULES)",
                            "<unload|reload> (LOADEDMODULES)"]
         }
 
         self.status = MPStatus()
 
+        # main loop and module timing statistics
+        self.perf = mp_perf.PerfStats()
+
         # master mavlink device
         self.mav_master = None
 
@@ -333,15 +372,35 @@ class MPState(object):
         # Dict of self.vehicle_link_map[linknumber] = set([(sysid1,compid1), (sysid2,compid2), ...])
         self.vehicle_link_map = {}
 
+        # best link to send to each sysid on
+        self.routing = mp_routing.RoutingTable()
+
+        # recent history of received telemetry
+        self.tseries = mp_tseries.TelemetryStore()
+
+        # set by --startup-profile
+        self.startup_profile = None
+        # module paths which have been loaded, so need a reload to load again
+        self.loaded_modpaths = set()
+
         # SITL output
         self.sitl_output = None
 
         self.mav_param_by_sysid = {}
         self.mav_param_by_sysid[(self.settings.target_system, self.settings.target_component)] = mavparm.MAVParmDict()
         self.modules = []
+        # cache of modules interested in each message type, see packet_modules()
+        self.packet_dispatch = {}
+        # cache of modules with an idle_task(), see idle_task_modules()
+        self.idle_modules = None
+        # periodic tasks run from the main loop, see MPModule.add_periodic_task()
+        self.scheduler = mp_scheduler.MPScheduler()
+        self.scheduler.error_callback = self.periodic_task_error
         self.public_modules = {}
         self.functions = MAVFunctions()
         self.select_extra = {}
+        # persistent registry of fds for the main loop, see select_sync()
+        self.selector = mp_select.MPSelector()
         self.continue_mode = False
         self.aliases = {}
         import platform
@@ -370,6 +429,32 @@ class MPState(object):
             return self.public_modules[name]
         return None
 
+    def packet_dispatch_changed(self):
+        '''called when the loaded modules or their packet subscriptions change'''
+        self.packet_dispatch = {}
+        self.idle_modules = None
+
+    def idle_task_modules(self):
+        '''return the list of modules which have an idle_task()'''
+        if self.idle_modules is None:
+            self.idle_modules = [m for (m, pm) in self.modules if m.wants_idle_task()]
+        return self.idle_modules
+
+    def periodic_task_error(self, task, ex):
+        '''report an exception from a periodic task'''
+        if self.settings.moddebug == 1:
+            print("%s: %s" % (task.name, ex))
+        elif self.settings.moddebug > 1:
+            print(get_exception_stacktrace(ex))
+
+    def packet_modules(self, mtype):
+        '''return the list of modules which want mavlink_packet() calls for mtype'''
+        ret = self.packet_dispatch.get(mtype, None)
+        if ret is None:
+            ret = [m for (m, pm) in self.modules if m.wants_packet_type(mtype)]
+            self.packet_dispatch[mtype] = ret
+        return ret
+
     def load_module(self, modname, quiet=False, **kwargs):
         '''load a module'''
         modpaths = ['MAVProxy.modules.mavproxy_%s' % modname, modname]
@@ -382,11 +467,19 @@ class MPState(object):
         ex = None
         for modpath in modpaths:
             try:
+                t0 = mp_startup.clock()
                 m = import_package(modpath)
-                reload(m)
+                if modpath in self.loaded_modpaths:
+                    # pick up changes since it was last loaded
+                    reload(m)
+                t1 = mp_startup.clock()
                 module = m.init(mpstate, **kwargs)
+                if self.startup_profile is not None:
+                    self.startup_profile.module(modname, t1 - t0, mp_startup.clock() - t1)
                 if isinstance(module, mp_module.MPModule):
+                    self.loaded_modpaths.add(modpath)
                     mpstate.modules.append((module, m))
+                    mpstate.packet_dispatch_changed()
                     if not quiet:
                         if kwargs:
                             print("Loaded module %s with kwargs = %s" % (modname, kwargs))
@@ -417,8 +510,12 @@ class MPState(object):
                     if t.is_alive():
                         print("unload on module %s did not complete" % m.name)
                         mpstate.modules.remove((m, pm))
+                        mpstate.packet_dispatch_changed()
+                        mpstate.scheduler.remove_owner(m)
                         return False
                 mpstate.modules.remove((m, pm))
+                mpstate.packet_dispatch_changed()
+                mpstate.scheduler.remove_owner(m)
                 if modname in mpstate.public_modules:
                     del mpstate.public_modules[modname]
                 print("Unloaded module %s" % modname)
@@ -434,18 +531,9 @@ class MPState(object):
             self.settings.link = 1
 
         if target_sysid != -1:
-            # if we're looking for a specific system ID then try to find best
-            # link for that
-            best_link = None
-            best_timestamp = 0
-            for m in self.mav_master:
-                try:
-                    tstamp = m.sysid_state[target_sysid].messages['HEARTBEAT']._timestamp
-                except Exception:
-                    continue
-                if tstamp > best_timestamp:
-                    best_link = m
-                    best_timestamp = tstamp
+            # if we're looking for a specific system ID then use the
+            # best link for that
+            best_link = self.routing.route(target_sysid)
             if best_link is not None:
                 return best_link
 
@@ -530,6 +618,33 @@ def cmd_status(args):
             mpstate.status.show(sys.stdout, pattern=pattern, verbose=verbose)
 
 
+def cmd_history(args):
+    '''show telemetry history'''
+    store = mpstate.tseries
+    if len(args) == 0:
+        for mtype in store.types():
+            s = store.series[mtype]
+            print("%-30s %6u samples %s" % (mtype, s.count, " ".join(s.fields)))
+        print("%u message types, %.1f MB" % (len(store.types()), store.memory() / (1024.0 * 1024)))
+        return
+    (mtype, dot, field) = args[0].partition('.')
+    seconds = float(args[1]) if len(args) > 1 else store.horizon
+    data = store.last(mtype.upper(), field, seconds)
+    if data is None:
+        # try it as an expression
+        data = store.evaluate(args[0], seconds)
+    if data is None:
+        print("No history for %s" % args[0])
+        return
+    (times, values) = data
+    if len(values) == 0:
+        print("%s: no samples in the last %.1fs" % (args[0], seconds))
+        return
+    print("%s: %u samples over %.1fs min %s max %s mean %s last %s" % (
+        args[0], len(values), times[-1] - times[0],
+        values.min(), values.max(), values.mean(), values[-1]))
+
+
 def cmd_setup(args):
     mpstate.status.setup_mode = True
     mpstate.rl.set_prompt("")
@@ -603,7 +718,7 @@ def get_exception_stacktrace(e):
 
 def cmd_module(args):
     '''module commands'''
-    usage = "usage: module <list|load|reload|unload>"
+    usage = "usage: module <list|load|reload|unload|stats>"
     if len(args) < 1:
         print(usage)
         return
@@ -614,6 +729,8 @@ def cmd_module(args):
         mods = sorted(mods, key=lambda m : m.name)
         for m in mods:
             print("%s: %s" % (m.name, m.description))
+    elif args[0] == "stats":
+        cmd_module_stats(args[1:])
     elif args[0] == "load":
         if len(args) < 2:
             print("usage: module load <name>")
@@ -658,6 +775,29 @@ def cmd_module(args):
         print(usage)
 
 
+def cmd_module_stats(args):
+    '''show or save module and main loop timing statistics'''
+    if len(args) == 0:
+        if not mpstate.settings.perfstats:
+            print("Note: use 'set perfstats 1' to collect statistics")
+        mpstate.perf.show(sys.stdout)
+    elif args[0] == "reset":
+        mpstate.perf.reset()
+    elif args[0] == "json":
+        if len(args) > 1:
+            filename = args[1]
+        elif mpstate.status.logdir is not None:
+            filename = os.path.join(mpstate.status.logdir, "perfstats.json")
+        else:
+            filename = "perfstats.json"
+        mpstate.perf.dump_json(filename)
+        print("Saved timing statistics to %s" % filename)
+    elif args[0] in mpstate.perf.categories():
+        mpstate.perf.show(sys.stdout, category=args[0])
+    else:
+        print("usage: module stats <reset|json [FILENAME]|CATEGORY>")
+
+
 def cmd_alias(args):
     '''alias commands'''
     usage = "usage: alias <add|remove|list>"
@@ -728,6 +868,7 @@ command_map = {
     'reset'   : (cmd_reset,    'reopen the connection to the MAVLink master'), # noqa:E241
     'click'   : (cmd_click,    'set click location'), # noqa:E241
     'status'  : (cmd_status,   'show status'), # noqa:E241
+    'history' : (cmd_history,  'show telemetry history'), # noqa:E241
     'set'     : (cmd_set,      'mavproxy settings'), # noqa:E241
     'watch'   : (cmd_watch,    'watch a MAVLink pattern'), # noqa:E241
     'module'  : (cmd_module,   'module commands'), # noqa:E241
@@ -831,16 +972,24 @@ def process_stdin(line):
 
 def process_master(m):
     '''process packets from the MAVLink master'''
-    try:
-        s = m.recv(16*1024)
-    except Exception:
-        time.sleep(0.1)
-        return
-    # prevent a dead serial port from causing the CPU to spin. The user hitting enter will
-    # cause it to try and reconnect
-    if len(s) == 0:
-        time.sleep(0.1)
-        return
+    frames = None
+    if m.link_reader is not None:
+        # data has already been read and split into frames by a worker
+        frames = m.link_reader.read()
+        if len(frames) == 0:
+            return
+        s = b''.join([f[4] for f in frames])
+    else:
+        try:
+            s = m.recv(16*1024)
+        except Exception:
+            time.sleep(0.1)
+            return
+        # prevent a dead serial port from causing the CPU to spin. The user hitting enter will
+        # cause it to try and reconnect
+        if len(s) == 0:
+            time.sleep(0.1)
+            return
 
     mpstate.status.bytecounters['MasterIn'][m.linknum].update(len(s))
 
@@ -848,7 +997,7 @@ def process_master(m):
         return
 
     if mpstate.logqueue_raw:
-        mpstate.logqueue_raw.put(bytearray(s))
+        mpstate.logqueue_raw.write(s)
 
     if mpstate.status.setup_mode:
         if mpstate.system == 'Windows':
@@ -863,7 +1012,14 @@ def process_master(m):
 
     if m.first_byte and mavversion is None:
         m.auto_mavlink_version(s)
-    msgs = m.mav.parse_buffer(s)
+    if mpstate.settings.fastfwd and m.mav.signing.secret_key is None:
+        # route on frame headers, only decoding messages we need
+        if frames is not None:
+            msgs = mpstate.module('link').fastfwd_frames(m, frames)
+        else:
+            msgs = mpstate.module('link').fastfwd_buffer(m, s)
+    else:
+        msgs = m.mav.parse_buffer(s)
     if msgs:
         for msg in msgs:
             sysid = msg.get_srcSystem()
@@ -909,8 +1065,7 @@ def process_mavlink(slave):
                 # find best link by sysid
                 mpstate.master(target_sysid).write(mbuf)
             if mpstate.logqueue:
-                usec = int(time.time() * 1.0e6)
-                mpstate.logqueue.put(bytearray(struct.pack('>Q', usec) + m.get_msgbuf()))
+                mpstate.logqueue.log(mbuf)
             if mpstate.status.watch:
                 for msg_type in mpstate.status.watch:
                     if fnmatch.fnmatch(m.get_type().upper(), msg_type.upper()):
@@ -932,18 +1087,29 @@ def mkdir_p(dir):
     os.mkdir(dir)
 
 
-def log_writer():
-    '''log writing thread'''
-    while not mpstate.status.exit:
-        mpstate.logfile_raw.write(bytearray(mpstate.logqueue_raw.get()))
-        timeout = time.time() + 10
-        while not mpstate.logqueue_raw.empty() and time.time() < timeout:
-            mpstate.logfile_raw.write(mpstate.logqueue_raw.get())
-        while not mpstate.logqueue.empty() and time.time() < timeout:
-            mpstate.logfile.write(mpstate.logqueue.get())
-        if mpstate.settings.flushlogs or time.time() >= timeout:
-            mpstate.logfile.flush()
-            mpstate.logfile_raw.flush()
+def update_log_policy():
+    '''pass the telemetry log settings to the log writers'''
+    for w in [mpstate.logqueue, mpstate.logqueue_raw]:
+        if w is None:
+            continue
+        if mpstate.settings.flushlogs:
+            flush_period = 0
+        else:
+            flush_period = mpstate.settings.tlog_flush_period
+        w.set_policy(flush_period,
+                     mpstate.settings.tlog_rotate_size * 1024 * 1024,
+                     mpstate.settings.tlog_rotate_time,
+                     mpstate.settings.tlog_fsync,
+                     mpstate.settings.tlog_compress)
+
+
+def update_history_policy():
+    '''pass the history setting to the telemetry store'''
+    horizon = mpstate.settings.history
+    if horizon != mpstate.tseries.horizon:
+        mpstate.tseries.set_horizon(horizon)
+        if horizon <= 0:
+            mpstate.tseries.clear()
 
 
 # If state_basedir is NOT set then paths for logs and aircraft
@@ -988,16 +1154,39 @@ def log_paths():
             os.path.join(logdir, logname + '.raw'))
 
 
+def show_log_resume(logpath_telem):
+    '''show what a continued log already holds, using its index'''
+    if not os.path.exists(logpath_telem):
+        return
+    index = mp_tlogindex.TLogIndex.load(logpath_telem)
+    if index is None or index.time_range() is None:
+        print("Continuing unindexed log %s" % logpath_telem)
+        return
+    counts = index.counts()
+    (first, last) = index.time_range()
+    print("Continuing log with %u messages from %s to %s" % (
+        sum(counts.values()),
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(first)),
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last))))
+    unindexed = index.file_size - index.indexed_bytes()
+    if unindexed > 0:
+        print("%u bytes of the log are not indexed" % unindexed)
+
+
 def open_telemetry_logs(logpath_telem, logpath_telem_raw):
     '''open log files'''
-    if opts.append_log or opts.continue_mode:
-        mode = 'ab'
-    else:
-        mode = 'wb'
+    append = opts.append_log or opts.continue_mode
+    if mpstate.continue_mode:
+        show_log_resume(logpath_telem)
 
     try:
-        mpstate.logfile = open(logpath_telem, mode=mode)
-        mpstate.logfile_raw = open(logpath_telem_raw, mode=mode)
+        # the writers use their own threads for writing to the logfile to
+        # prevent delays during disk writes (important as delays can be
+        # long if camera app is running)
+        compress = mpstate.settings.tlog_compress
+        mpstate.logqueue = mp_tlog.TLogWriter(logpath_telem, append=append, compress=compress, index=True)
+        mpstate.logqueue_raw = mp_tlog.TLogWriter(logpath_telem_raw, append=append, compress=compress)
+        update_log_policy()
         print("Log Directory: %s" % mpstate.status.logdir)
         print("Telemetry log: %s" % logpath_telem)
 
@@ -1009,22 +1198,15 @@ def open_telemetry_logs(logpath_telem, logpath_telem_raw):
                 print("ERROR: Not enough free disk space for logfile")
                 mpstate.status.exit = True
                 return
-
-        # use a separate thread for writing to the logfile to prevent
-        # delays during disk writes (important as delays can be long if camera
-        # app is running)
-        t = threading.Thread(target=log_writer, name='log_writer')
-        t.daemon = True
-        t.start()
     except Exception as e:
         print("ERROR: opening log file for writing: %s" % e)
         mpstate.status.exit = True
         return
 
 
-def set_stream_rates():
-    '''set mavlink stream rates'''
-    if (not msg_period.trigger() and
+def set_stream_rates(force=False):
+    '''set mavlink stream rates if they have changed, or always if force is True'''
+    if (not force and
         mpstate.status.last_streamrate1 == mpstate.settings.streamrate and
             mpstate.status.last_streamrate2 == mpstate.settings.streamrate2):
         return
@@ -1065,6 +1247,30 @@ def send_heartbeat(master):
         master.mav.heartbeat_send(MAV_GROUND, MAV_AUTOPILOT_NONE)
 
 
+def send_heartbeats():
+    '''periodic task sending our heartbeat on all links'''
+    if mpstate.settings.heartbeat <= 0:
+        # check again in a second in case heartbeats are enabled
+        heartbeat_task.set_frequency(1)
+        return
+    heartbeat_task.set_frequency(mpstate.settings.heartbeat)
+    mpstate.status.counters['MasterOut'] += 1
+    for master in mpstate.mav_master:
+        send_heartbeat(master)
+
+
+def add_periodic_tasks():
+    '''add the core periodic tasks to the scheduler'''
+    global heartbeat_task
+    scheduler = mpstate.scheduler
+    heartbeat_task = scheduler.add(send_heartbeats, 1, name='heartbeat')
+    scheduler.add(check_link_status, 0.33, name='check_link_status')
+    scheduler.add(lambda: set_stream_rates(force=True), 1.0/15, name='stream_rates')
+    scheduler.add(mpstate.status.update_bytecounters, 1, name='bytecounters')
+    scheduler.add(update_log_policy, 1, name='log_policy')
+    scheduler.add(update_history_policy, 1, name='history_policy')
+
+
 def periodic_tasks():
     '''run periodic checks'''
     if mpstate.status.setup_mode:
@@ -1073,33 +1279,33 @@ def periodic_tasks():
     if (mpstate.settings.compdebug & 2) != 0:
         return
 
-    if mpstate.settings.heartbeat != 0:
-        heartbeat_period.frequency = mpstate.settings.heartbeat
-
-    if heartbeat_period.trigger() and mpstate.settings.heartbeat != 0:
-        mpstate.status.counters['MasterOut'] += 1
-        for master in mpstate.mav_master:
-            send_heartbeat(master)
-
-    if heartbeat_check_period.trigger():
-        check_link_status()
+    perf = mpstate.perf
+    mpstate.scheduler.run(perf)
 
     set_stream_rates()
 
-    mpstate.status.update_bytecounters()
+    perf.enabled = mpstate.settings.perfstats
+    if (perf.enabled and mpstate.settings.perfstats_dump > 0 and mpstate.status.logdir is not None and
+            time.time() - perf.last_dump >= mpstate.settings.perfstats_dump):
+        perf.dump_json(os.path.join(mpstate.status.logdir, "perfstats.json"))
 
     # call optional module idle tasks. These are called at several hundred Hz
-    for (m, pm) in mpstate.modules:
-        if hasattr(m, 'idle_task'):
-            try:
+    for m in mpstate.idle_task_modules():
+        try:
+            if perf.enabled:
+                t0 = mp_perf.clock()
+                m.idle_task()
+                perf.add('idle_task', m.name, mp_perf.clock() - t0)
+            else:
                 m.idle_task()
-            except Exception as msg:
-                if mpstate.settings.moddebug == 1:
-                    print(msg)
-                elif mpstate.settings.moddebug > 1:
-                    print(get_exception_stacktrace(msg))
+        except Exception as msg:
+            if mpstate.settings.moddebug == 1:
+                print(msg)
+            elif mpstate.settings.moddebug > 1:
+                print(get_exception_stacktrace(msg))
 
-        # also see if the module should be unloaded:
+    # see if any module should be unloaded:
+    for (m, pm) in mpstate.modules:
         if m.needs_unloading:
             mpstate.unload_module(m.name)
 
@@ -1110,18 +1316,34 @@ def main_loop():
     global screensaver_cookie
 
     if not mpstate.status.setup_mode and not opts.nowait:
+        # let every link know we are here, then wait briefly for the
+        # first of them to answer
         for master in mpstate.mav_master:
-            if master.linknum != 0:
-                break
             print("Waiting for heartbeat from %s" % master.address)
             send_heartbeat(master)
-            master.wait_heartbeat(timeout=0.1)
-        set_stream_rates()
+        # links with a reader worker must only be read by the worker
+        wait_list = [m for m in mpstate.mav_master if m.link_reader is None]
+        deadline = time.time() + 0.1
+        while len(wait_list) > 0 and time.time() < deadline:
+            if any([m.recv_match(type='HEARTBEAT', blocking=False) is not None for m in wait_list]):
+                break
+            time.sleep(0.005)
+        set_stream_rates(force=True)
 
+    perf = mpstate.perf
+    loop_start = None
     while True:
         if mpstate is None or mpstate.status.exit:
             return
 
+        if perf.enabled:
+            now = mp_perf.clock()
+            if loop_start is not None:
+                perf.add('main_loop', 'iteration', now - loop_start)
+            loop_start = now
+        else:
+            loop_start = None
+
         # enable or disable screensaver:
         if (mpstate.settings.inhibit_screensaver_when_armed and
                 screensaver_interface is not None):
@@ -1143,75 +1365,124 @@ def main_loop():
             for c in cmds:
                 process_stdin(c)
 
+        fdless = False
         for master in mpstate.mav_master:
-            if master.fd is None:
+            if master.fd is None and master.link_reader is None:
+                fdless = True
                 try:
                     if master.port.inWaiting() > 0:
                         process_master(master)
                 except serial.SerialException:
                     pass
 
-        periodic_tasks()
-
-        rin = []
-        for master in mpstate.mav_master:
-            if master.fd is not None and not master.portdead:
-                rin.append(master.fd)
-        for m in mpstate.mav_outputs:
-            rin.append(m.fd)
-        for sysid in mpstate.sysid_outputs:
-            m = mpstate.sysid_outputs[sysid]
-            rin.append(m.fd)
-        if rin == []:
-            time.sleep(0.0001)
-            continue
+        if perf.enabled:
+            t0 = mp_perf.clock()
+            periodic_tasks()
+            perf.add('main_loop', 'periodic_tasks', mp_perf.clock() - t0)
+        else:
+            periodic_tasks()
 
-        for fd in mpstate.select_extra:
-            rin.append(fd)
+        if perf.enabled:
+            t0 = mp_perf.clock()
+            outputs_pending = process_outputs()
+            perf.add('main_loop', 'outputs', mp_perf.clock() - t0)
+        else:
+            outputs_pending = process_outputs()
+
+        select_sync()
+
+        # sleep no longer than the next periodic task deadline
+        timeout = min(mpstate.settings.select_timeout, mpstate.scheduler.time_to_next())
+        if fdless:
+            # links without a fd or reader are polled, don't wait too long for them
+            timeout = min(timeout, 0.001)
+        if outputs_pending:
+            # retry outputs which could not take all their data soon
+            timeout = min(timeout, 0.01)
         try:
-            (rin, win, xin) = select.select(rin, [], [], mpstate.settings.select_timeout)
-        except select.error:
+            if perf.enabled:
+                t0 = mp_perf.clock()
+                events = mpstate.selector.select(timeout)
+                perf.add('main_loop', 'select', mp_perf.clock() - t0)
+            else:
+                events = mpstate.selector.select(timeout)
+        except (OSError, ValueError):
+            # probably a registered fd has been closed, register them all again
+            mpstate.selector.prune(set())
             continue
 
-        if mpstate is None:
-            return
-
-        for fd in rin:
+        for (fd, handler, arg) in events:
             if mpstate is None:
                 return
-            for master in mpstate.mav_master:
-                if fd == master.fd:
-                    process_master(master)
-                    if mpstate is None:
-                        return
-                    continue
-            for m in mpstate.mav_outputs:
-                if fd == m.fd:
-                    process_mavlink(m)
-                    if mpstate is None:
-                        return
-                    continue
-
-            for sysid in mpstate.sysid_outputs:
-                m = mpstate.sysid_outputs[sysid]
-                if fd == m.fd:
-                    process_mavlink(m)
-                    if mpstate is None:
-                        return
-                    continue
-
-            # this allow modules to register their own file descriptors
-            # for the main select loop
-            if fd in mpstate.select_extra:
-                try:
-                    # call the registered read function
-                    (fn, args) = mpstate.select_extra[fd]
-                    fn(args)
-                except Exception as msg:
-                    if mpstate.settings.moddebug == 1:
-                        print(msg)
-                    # on an exception, remove it from the select list
-                    mpstate.select_extra.pop(fd)
+            handler(arg)
+
+
+def process_outputs():
+    '''write queued messages to outputs. Returns True if any output
+    still has data waiting'''
+    pending = False
+    for m in mpstate.mav_outputs + list(mpstate.sysid_outputs.values()):
+        q = getattr(m, 'out_queue', None)
+        if q is not None and not q.drain():
+            pending = True
+    return pending
+
+
+def select_sync():
+    '''make sure all links, outputs and module file descriptors are
+    registered with the main loop selector. Registrations persist between
+    calls, so this only touches the selector when something has changed'''
+    sel = mpstate.selector
+    count = 0
+    for master in mpstate.mav_master:
+        if master.link_reader is not None:
+            # wait on the reader worker rather than the link itself
+            if sel.want(master.link_reader.notify_fd, process_master, master, master.link_reader):
+                count += 1
+                continue
+            # go back to waiting on or polling the link
+            print("Can't wait on reader for %s, stopping it" % master.address)
+            master.link_reader.close()
+            master.link_reader = None
+        if master.fd is not None and not master.portdead:
+            if sel.want(master.fd, process_master, master, master.port):
+                count += 1
+    for m in mpstate.mav_outputs:
+        if m.fd is not None and sel.want(m.fd, process_mavlink, m, getattr(m, 'port', None)):
+            count += 1
+    for m in mpstate.sysid_outputs.values():
+        if m.fd is not None and sel.want(m.fd, process_mavlink, m, getattr(m, 'port', None)):
+            count += 1
+    for fd in mpstate.select_extra:
+        # this allows modules to register their own file descriptors
+        # for the main select loop
+        if sel.want(fd, process_select_extra, fd):
+            count += 1
+    if count != len(sel.handlers):
+        # something has been removed
+        wanted = set(mpstate.select_extra.keys())
+        for master in mpstate.mav_master:
+            if master.link_reader is not None:
+                wanted.add(master.link_reader.notify_fd)
+            elif master.fd is not None and not master.portdead:
+                wanted.add(master.fd)
+        for m in mpstate.mav_outputs + list(mpstate.sysid_outputs.values()):
+            wanted.add(m.fd)
+        sel.prune(wanted)
+
+
+def process_select_extra(fd):
+    '''call the read function a module registered in select_extra for fd'''
+    if fd not in mpstate.select_extra:
+        return
+    try:
+        (fn, args) = mpstate.select_extra[fd]
+        fn(args)
+    except Exception as msg:
+        if mpstate.settings.moddebug == 1:
+            print(msg)
+        # on an exception, remove it from the select list
+        mpstate.select_extra.pop(fd)
 
 
 def input_loop():
@@ -1366,12 +1637,17 @@ if __name__ == '__main__':
     parser.add_option("--daemon", action='store_true', help="run in daemon mode, do not start interactive shell")
     parser.add_option("--non-interactive", action='store_true', help="do not start interactive shell")
     parser.add_option("--profile", action='store_true', help="run the Yappi python profiler")
+    parser.add_option("--startup-profile", action='store_true', help="show the time taken by each part of startup")
+    parser.add_option("--parallel-load", action='store_true',
+                      help="import modules in parallel threads while connecting")
     parser.add_option("--state-basedir", default=None, help="base directory for logs and aircraft directories")
     parser.add_option("--no-state", action='store_true', default=False, help="Don't save logs and other state to disk. Useful for read-only filesystems or long-running systems.")  # noqa:E501
     parser.add_option("--version", action='store_true', help="version information")
     parser.add_option("--default-modules", default="log,signing,wp,rally,fence,ftp,param,relay,tuneopt,arm,mode,calibration,rc,auxopt,misc,cmdlong,battery,terrain,output,adsb,layout", help='default module list')  # noqa:E501
     parser.add_option("--udp-timeout", dest="udp_timeout", default=0.0, type='float', help="Timeout for udp clients in seconds")  # noqa:E501
     parser.add_option("--retries", type=int, help="number of times to retry connection", default=3)
+    parser.add_option("--link-timeout", type=float, default=mp_linkopen.OPEN_TIMEOUT,
+                      help="seconds to wait for all master links to open, once one is open")
 
     (opts, args) = parser.parse_args()
     if len(args) != 0:
@@ -1408,14 +1684,22 @@ if __name__ == '__main__':
     mpstate.status.exit = False
     mpstate.command_map = command_map
     mpstate.continue_mode = opts.continue_mode
-    # queues for logging
-
-    if not opts.no_state:
-        mpstate.logqueue = multiproc.Queue()
-        mpstate.logqueue_raw = multiproc.Queue()
-    else:
-        mpstate.logqueue = None
-        mpstate.logqueue_raw = None
+    # telemetry log writers, created by open_telemetry_logs()
+    mpstate.logqueue = None
+    mpstate.logqueue_raw = None
+    if opts.startup_profile:
+        mpstate.startup_profile = mp_startup.StartupProfile()
+        mpstate.startup_profile.phase('imports and options')
+
+    if opts.parallel_load:
+        prefetch = []
+        for mods in opts.load_module + [opts.default_modules]:
+            prefetch.extend([m for m in mods.split(',') if m])
+        if opts.console:
+            prefetch.append('console')
+        if opts.map:
+            prefetch.append('map')
+        mp_startup.prefetch_modules(['MAVProxy.modules.mavproxy_%s' % m for m in prefetch])
 
     if opts.speech:
         # start the speech-dispatcher early, so it doesn't inherit any ports from
@@ -1469,13 +1753,20 @@ if __name__ == '__main__':
     mpstate.settings.source_system = opts.SOURCE_SYSTEM
     mpstate.settings.source_component = opts.SOURCE_COMPONENT
 
-    # open master link
+    # open master links, all at once so a slow link doesn't hold up the others
+    master_list = []
     for mdev in opts.master:
-        if mdev.find('?') != -1 or mdev.find('*') != -1:
-            for m in glob.glob(mdev):
-                if not mpstate.module('link').link_add(m, force_connected=opts.force_connected, retries=opts.retries):
-                    sys.exit(1)
-        elif not mpstate.module('link').link_add(mdev, force_connected=opts.force_connected, retries=opts.retries):
+        if not mdev.startswith('replay:') and (mdev.find('?') != -1 or mdev.find('*') != -1):
+            master_list.extend(glob.glob(mdev))
+        else:
+            master_list.append(mdev)
+    if len(master_list) == 1:
+        if not mpstate.module('link').link_add(master_list[0], force_connected=opts.force_connected,
+                                               retries=opts.retries):
+            sys.exit(1)
+    elif len(master_list) > 1:
+        if mpstate.module('link').link_add_parallel(master_list, force_connected=opts.force_connected,
+                                                    retries=opts.retries, timeout=opts.link_timeout) == 0:
             sys.exit(1)
 
     if not opts.master and len(serial_list) == 1:
@@ -1490,6 +1781,9 @@ if __name__ == '__main__':
         wifi_device = '0.0.0.0:14550'
         mpstate.module('link').link_add(wifi_device)
 
+    if mpstate.startup_profile is not None:
+        mpstate.startup_profile.phase('links')
+
     # open any mavlink output ports
     for port in opts.output:
         # cope with older pymavlink
@@ -1516,9 +1810,9 @@ if __name__ == '__main__':
     if opts.state_basedir is not None:
         mpstate.settings.state_basedir = opts.state_basedir
 
-    msg_period = mavutil.periodic_event(1.0/15)
-    heartbeat_period = mavutil.periodic_event(1)
-    heartbeat_check_period = mavutil.periodic_event(0.33)
+    add_periodic_tasks()
+    if mpstate.startup_profile is not None:
+        mpstate.startup_profile.phase('outputs')
 
     mpstate.input_queue = multiproc.Queue()
     mpstate.input_count = 0
@@ -1559,6 +1853,9 @@ if __name__ == '__main__':
     elif opts.aircraft is not None:
         mpstate.aircraft_dir = opts.aircraft
 
+    if mpstate.startup_profile is not None:
+        mpstate.startup_profile.phase('modules')
+
     run_startup_scripts()
 
     if opts.cmd is not None:
@@ -1577,6 +1874,11 @@ if __name__ == '__main__':
     else:
         print("Note: Not saving telemetry logs")
 
+    if mpstate.startup_profile is not None:
+        mpstate.startup_profile.phase('scripts and logs')
+        mpstate.startup_profile.report(sys.stdout)
+        mpstate.startup_profile.report_heartbeat(sys.stdout)
+
     # run main loop as a thread
     mpstate.status.thread = threading.Thread(target=main_loop, name='main_loop')
     mpstate.status.thread.daemon = True
@@ -1619,4 +1921,8 @@ if __name__ == '__main__':
             print("Unloading module %s" % m.name)
             m.unload()
 
+    for w in [mpstate.logqueue, mpstate.logqueue_raw]:
+        if w is not None:
+            w.close()
+
     sys.exit(1)
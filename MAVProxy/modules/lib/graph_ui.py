@@ -33,6 +33,7 @@ class Graph_UI(object):
             self.mg.set_title(graphdef.name)
         if self.mestate.settings.max_rate > 0:
             self.mg.set_max_message_rate(self.mestate.settings.max_rate)
+        self.mg.set_decimate(self.mestate.settings.decimate)
         self.mg.set_marker(self.mestate.settings.marker)
         self.mg.set_condition(self.mestate.settings.condition)
         self.mg.set_xaxis(self.mestate.settings.xaxis)
@@ -40,6 +41,7 @@ class Graph_UI(object):
         self.mg.set_show_flightmode(self.mestate.settings.show_flightmode)
         self.mg.set_legend(self.mestate.settings.legend)
         self.mg.add_mav(copy.copy(self.mestate.mlog))
+        self.mg.set_log_cache(getattr(self.mestate, 'logcache', None))
         for f in graphdef.expression.split():
             self.mg.add_field(f)
         self.mg.process(self.mestate.flightmode_selections, self.mestate.mlog._flightmodes)
@@ -48,6 +50,7 @@ class Graph_UI(object):
         #To avoid slowdowns in Windows (which copies the vars to the new process)
         #We need to empty this var when we're finished with it
         self.mg.mav_list = []
+        self.mg.log_cache = None
         child = multiproc.Process(target=self.mg.show, args=[self.lenmavlist,], kwargs={"xlim_pipe" : self.xlim_pipe})
         child.start()
         self.xlim_pipe[1].close()
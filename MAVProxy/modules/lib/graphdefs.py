@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+'''
+graph definitions from MAVExplorer graph files
+
+The graphs are defined in XML files: mavgraphs.xml in the current
+directory, XML files under ~/.mavproxy and the built in tools/graphs
+files. A graph may be defined more than once, in one file or in
+several, with a list of expressions for each definition. The graph
+used for a log is the first definition with an expression the messages
+of the log can evaluate.
+
+This has no wx dependency, so tools without a display can use the same
+graphs as MAVExplorer.
+
+AP_FLAKE8_CLEAN
+'''
+
+import os
+
+from lxml import objectify
+
+from MAVProxy.modules.lib import mp_expression
+from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib.graphdefinition import GraphDefinition
+
+# files in ~/.mavproxy which are parameter documentation, not graphs.
+# They specify an encoding, which leads to a warning from etree
+PARAM_XML_FILES = ["ArduSub.xml", "ArduPlane.xml", "APMrover2.xml", "ArduCopter.xml",
+                   "AntennaTracker.xml", "Blimp.xml", "Rover.xml", "Heli.xml"]
+
+# the built in graph files, for when they can't be listed
+BUILTIN_GRAPH_FILES = ["ekf3Graphs.xml", "ekfGraphs.xml", "mavgraphs.xml", "mavgraphs2.xml"]
+
+
+def xml_unescape(e):
+    '''unescape < and >'''
+    e = e.replace('&gt;', '>')
+    e = e.replace('&lt;', '<')
+    return e
+
+
+def xml_escape(e):
+    '''escape < and >'''
+    e = e.replace('>', '&gt;')
+    e = e.replace('<', '&lt;')
+    return e
+
+
+def expression_ok(expression, msgs):
+    '''return True if all fields of an expression can be evaluated with
+    the last messages of a log in msgs'''
+    if expression is None:
+        return False
+    for f in expression.split():
+        if f.endswith(">"):
+            a2 = f.rfind("<")
+            if a2 != -1:
+                f = f[:a2]
+        if f.endswith(':2'):
+            f = f[:-2]
+        try:
+            if mp_expression.evaluate_expression(f, msgs, nocondition=True) is None:
+                return False
+        except Exception:
+            return False
+    return True
+
+
+def load_graph_xml(xml, filename):
+    '''return list of GraphDefinition for the graphs in an XML string, in
+    file order, with the first expression of each'''
+    try:
+        root = objectify.fromstring(xml)
+    except Exception as ex:
+        print(filename, ex)
+        return []
+    if root.tag != 'graphs':
+        return []
+    if not hasattr(root, 'graph'):
+        return []
+    ret = []
+    for g in root.graph:
+        expressions = [e.text for e in getattr(g, 'expression', []) if e.text is not None]
+        if len(expressions) == 0:
+            continue
+        if hasattr(g, 'description'):
+            description = g.description.text
+        else:
+            description = ''
+        ret.append(GraphDefinition(g.attrib['name'], expressions[0], description, expressions, filename))
+    return ret
+
+
+def choose_graphs(definitions, msgs, loaded=[]):
+    '''return a GraphDefinition for each graph name in definitions, from
+    the first definition with an expression msgs can evaluate, with that
+    expression. Graphs named in loaded are skipped'''
+    names = set(loaded)
+    ret = []
+    for g in definitions:
+        if g.name in names:
+            continue
+        for e in g.expressions:
+            e = xml_unescape(e)
+            if expression_ok(e, msgs):
+                ret.append(GraphDefinition(g.name, e, g.description, g.expressions, g.filename))
+                names.add(g.name)
+                break
+    return ret
+
+
+def graph_xml(extra_files=[]):
+    '''return list of (name, filename, xml) for the graph files, in the
+    order MAVExplorer loads them, so earlier definitions of a graph take
+    precedence. The filename of the built in files is None'''
+    files = list(extra_files) + ['mavgraphs.xml']
+    for dirname, dirnames, filenames in os.walk(mp_util.dot_mavproxy()):
+        # Skip XML files in the LogMessages subfolder
+        if os.path.basename(dirname) == "LogMessages":
+            continue
+        for filename in sorted(filenames):
+            if filename.lower().endswith('.xml') and filename not in PARAM_XML_FILES:
+                files.append(os.path.join(dirname, filename))
+    ret = []
+    for filename in files:
+        if not os.path.exists(filename):
+            continue
+        try:
+            with open(filename, 'rb') as f:
+                ret.append((filename, filename, f.read()))
+        except OSError as ex:
+            print(filename, ex)
+    # also load the built in graphs
+    builtin = []
+    try:
+        import pkg_resources
+        for f in sorted(pkg_resources.resource_listdir("MAVProxy", "tools/graphs")):
+            raw = pkg_resources.resource_stream("MAVProxy", "tools/graphs/%s" % f).read()
+            builtin.append((f, None, raw))
+    except Exception:
+        # we're in a Windows exe, where pkg_resources doesn't work
+        import pkgutil
+        builtin = []
+        for f in BUILTIN_GRAPH_FILES:
+            raw = pkgutil.get_data('MAVProxy', 'tools//graphs//' + f)
+            builtin.append((f, None, raw))
+    return ret + builtin
+
+
+def load_graphs(extra_files=[]):
+    '''return list of GraphDefinition from all graph files, in the order
+    MAVExplorer loads them'''
+    ret = []
+    for (name, filename, xml) in graph_xml(extra_files):
+        ret.extend(load_graph_xml(xml, filename))
+    return ret
@@ -18,6 +18,8 @@ from math import *
 from pymavlink.mavextra import *
 import matplotlib.pyplot as plt
 from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_decimate
+from MAVProxy.modules.lib import mp_expression
 import threading
 import numpy as np
 
@@ -67,6 +69,70 @@ def timestamp_to_days(timestamp, timeshift=0):
     sec_to_days = 1.0 / (60*60*24)
     return tday_base + (timestamp - tday_basetime) * sec_to_days
 
+def timestamps_to_days(timestamps, timeshift=0):
+    '''convert a numpy array of log timestamps to days'''
+    if len(timestamps) > 0:
+        # sets the base if this is the first conversion
+        timestamp_to_days(timestamps[0], timeshift)
+    if tday_base is None:
+        return np.zeros(len(timestamps))
+    sec_to_days = 1.0 / (60*60*24)
+    return tday_base + (timestamps - tday_basetime) * sec_to_days
+
+def flightmode_mask(timestamps, flightmode_list, flightmode_selections):
+    '''return a boolean array of which timestamps are in a selected
+    flight mode'''
+    ends = np.array([t1 for (mode, t0, t1) in flightmode_list])
+    selected = np.zeros(len(flightmode_list) + 1, dtype=bool)
+    for (i, s) in enumerate(flightmode_selections[:len(flightmode_list)]):
+        selected[i] = bool(s)
+    return selected[np.searchsorted(ends, timestamps, side='right')]
+
+def decimate_by_rate(timestamps, period):
+    '''return the indexes of the timestamps to keep so that they are at
+    least period apart, keeping the first, as max_message_rate does'''
+    n = len(timestamps)
+    if n == 0 or np.all(np.diff(timestamps) >= period):
+        return np.arange(n)
+    keep = []
+    i = 0
+    sorted_times = np.all(np.diff(timestamps) >= 0)
+    last = None
+    while i < n:
+        if sorted_times:
+            keep.append(i)
+            t = timestamps[i]
+            # the first later timestamp with t2 - t >= period, compared by
+            # subtraction as the message walk does, as t + period may
+            # round differently
+            j = max(i + 1, int(np.searchsorted(timestamps, t + period, side='left')))
+            while j > i + 1 and timestamps[j-1] - t >= period:
+                j -= 1
+            while j < n and timestamps[j] - t < period:
+                j += 1
+            i = j
+        else:
+            if last is None or timestamps[i] - last >= period:
+                keep.append(i)
+                last = timestamps[i]
+            i += 1
+    return np.array(keep, dtype=int)
+
+class CacheColumns(mp_expression.Columns):
+    '''the fields of a message type in a vectorised graph expression,
+    read from the log cache when they are used'''
+    def __init__(self, cache, mtype, rows):
+        self._cache = cache
+        self._mtype = mtype
+        self._rows = rows
+
+    def __getattr__(self, field):
+        if field.startswith('_') or not self._cache.has_field(self._mtype, field):
+            raise AttributeError(field)
+        v = np.asarray(self._cache.column(self._mtype, field)[self._rows])
+        setattr(self, field, v)
+        return v
+
 class MilliFormatter(matplotlib.dates.AutoDateFormatter):
     '''tick formatter that shows millisecond resolution'''
     def __init__(self, locator):
@@ -125,12 +191,20 @@ class MavGraph(object):
         else:
             self.text_types = frozenset([unicode, str])
         self.max_message_rate = 0
+        self.log_cache = None
+        self.fields_prepared = False
+        self.decimate = True
+        self.decimator = mp_decimate.LineDecimator()
 
     def set_max_message_rate(self, rate_hz):
         '''set maximum rate we will graph any message'''
         self.max_message_rate = rate_hz
         self.last_message_t = {}
 
+    def set_decimate(self, enable):
+        '''enable drawing large graphs at the screen resolution'''
+        self.decimate = enable
+
     def add_field(self, field):
         '''add another field to plot'''
         self.fields.append(field)
@@ -139,6 +213,10 @@ class MavGraph(object):
         '''add another data source to plot'''
         self.mav_list.append(mav)
 
+    def set_log_cache(self, log_cache):
+        '''set a mp_logcache.LogCache holding the data of the first log'''
+        self.log_cache = log_cache
+
     def set_condition(self, condition):
         '''set graph condition'''
         self.condition = condition
@@ -219,6 +297,8 @@ class MavGraph(object):
         '''called when x limits are changed'''
         xrange = axsubplot.get_xbound()
         xlim = axsubplot.get_xlim()
+        # shared axes get the new limits after this callback
+        self.decimator.update(xlim)
         if self.draw_events == 0:
             # ignore limit change before first draw event
             return
@@ -231,6 +311,10 @@ class MavGraph(object):
         '''called on draw events'''
         self.draw_events += 1
 
+    def resize_event(self, evt):
+        '''called when the window is resized'''
+        self.decimator.update(self.ax1.get_xlim())
+
     def close_event(self, evt):
         '''called on close events'''
         self.closing = True
@@ -266,6 +350,14 @@ class MavGraph(object):
             if self.ax2:
                 self.rescale_yaxis(self.ax2)
 
+    def plot_dates(self, ax, x, y, color, **kwargs):
+        '''plot against dates on the x axis, with Axes.plot_date() where
+        matplotlib still has it'''
+        if hasattr(ax, 'plot_date'):
+            return ax.plot_date(x, y, fmt=color, tz=None, **kwargs)
+        ax.xaxis_date(None)
+        return ax.plot(x, y, color=color, **kwargs)
+
     def plotit(self, x, y, fields, colors=[], title=None, interactive=True):
         '''plot a set of graphs using date for x axis'''
         if interactive:
@@ -289,6 +381,7 @@ class MavGraph(object):
             self.ax1.callbacks.connect('xlim_changed', self.xlim_changed)
             self.fig.canvas.mpl_connect('draw_event', self.draw_event)
             self.fig.canvas.mpl_connect('close_event', self.close_event)
+            self.fig.canvas.mpl_connect('resize_event', self.resize_event)
         self.fig.canvas.mpl_connect('button_press_event', self.button_click)
         self.fig.canvas.get_default_filename = lambda: ''.join("graph" if self.title is None else
                                                                (x if x.isalnum() else '_' for x in self.title)) + '.png'
@@ -377,9 +470,16 @@ class MavGraph(object):
                                 rotation=90,
                                 alpha=0.6,
                                 verticalalignment='center')
+                elif self.decimate and mp_decimate.is_sorted(x[i]):
+                    # plot the points visible at the screen resolution,
+                    # updated when the x limits change
+                    (xd, yd) = self.decimator.initial(ax, x[i], y[i])
+                    lines = self.plot_dates(ax, xd, yd, color, label=fields[i],
+                                            linestyle=linestyle, marker=marker)
+                    self.decimator.add(lines[0], x[i], y[i])
                 else:
-                    ax.plot_date(x[i], y[i], fmt=color, label=fields[i],
-                                 linestyle=linestyle, marker=marker, tz=None)
+                    self.plot_dates(ax, x[i], y[i], color, label=fields[i],
+                                    linestyle=linestyle, marker=marker)
 
             empty = False
             
@@ -479,7 +579,7 @@ class MavGraph(object):
                         print(ex)
             if v is None:
                 try:
-                    v = mavutil.evaluate_expression(f, vars)
+                    v = mp_expression.evaluate_expression(f, vars)
                 except Exception as ex:
                     if MAVGRAPH_DEBUG:
                         print(ex)
@@ -488,21 +588,17 @@ class MavGraph(object):
             if self.xaxis is None:
                 xv = t
             else:
-                xv = mavutil.evaluate_expression(self.xaxis, vars)
+                xv = mp_expression.evaluate_expression(self.xaxis, vars)
                 if xv is None:
                     continue
             self.y[i].append(v)
             self.x[i].append(xv)
 
-    def process_mav(self, mlog, flightmode_selections):
-        '''process one file'''
-        self.vars = {}
-        idx = 0
-        all_false = True
-        for s in flightmode_selections:
-            if s:
-                all_false = False
-
+    def prepare_fields(self):
+        '''split labels and axis options from the fields'''
+        if self.fields_prepared:
+            return
+        self.fields_prepared = True
         self.num_fields = len(self.fields)
 
         self.custom_labels = [None] * self.num_fields
@@ -534,6 +630,200 @@ class MavGraph(object):
             else:
                 self.simple_field.append((m.group(1),m.group(2)))
 
+    def process_cache(self, flightmode_selections):
+        '''fill in the graph data by evaluating the fields over whole
+        columns of the log cache, returning False if the log needs to be
+        parsed instead'''
+        if self.log_cache is None:
+            return False
+        self.prepare_fields()
+        results = []
+        for i in range(self.num_fields):
+            r = self.cache_field_data(i, flightmode_selections)
+            if r is None:
+                if MAVGRAPH_DEBUG:
+                    print("Parsing log for %s" % self.fields[i])
+                return False
+            results.append(r)
+        if len(self.flightmode_list) > 0:
+            # prime the timestamp conversion
+            timestamp_to_days(self.flightmode_list[0][1], self.timeshift)
+        for (i, (t, x, y)) in enumerate(results):
+            if x is None:
+                x = timestamps_to_days(t, self.timeshift)
+            self.x[i] = x
+            self.y[i] = y
+        return True
+
+    def cache_field_data(self, i, flightmode_selections):
+        '''evaluate field i over the log cache, giving the same points as
+        a walk through the log with process_mav(). Each message of the
+        types in the field is a point, with the values of other messages
+        taken from the last one before it in the log. Returns (times,
+        xvalues, yvalues), with xvalues None unless there is an xaxis,
+        or None if the field can't be evaluated this way'''
+        cache = self.log_cache
+        expr = mp_expression.compile_expression(self.fields[i])
+        if expr.error is not None or expr.bad_condition:
+            return None
+        cond = None
+        xexpr = None
+        need = set(expr.msg_types)
+        if self.condition:
+            cond = mp_expression.compile_expression(self.condition)
+            need.update(cond.msg_types)
+        if self.xaxis:
+            xexpr = mp_expression.compile_expression(self.xaxis)
+            need.update(xexpr.msg_types)
+        # a walk through the log only knows the types in the fields
+        if not need.issubset(self.msg_types):
+            return None
+        instances = {}
+        for (mtype, ivalues) in self.instance_types[i].items():
+            ifield = cache.instance_field(mtype)
+            if ifield is None or not cache.has_field(mtype, ifield) or not all([v.isdigit() for v in ivalues]):
+                return None
+            instances[mtype] = sorted([int(v) for v in ivalues])
+        # when parsing, the last message of each instance is only kept
+        # for messages which pass the condition and flight mode, and a
+        # type used with an instance in any field is no longer available
+        # without one
+        instanced = set()
+        for itypes in self.instance_types:
+            instanced.update(itypes.keys())
+        if len(instances) > 0 and (cond is not None or any(flightmode_selections)):
+            return None
+        for mtype in need.intersection(instanced):
+            if mtype not in instances or (cond is not None and mtype in cond.msg_types):
+                return None
+            if xexpr is not None and mtype in xexpr.msg_types:
+                return None
+        for mtype in need:
+            if not cache.has_type(mtype):
+                return None
+
+        # the points are the messages of the types in the field
+        orders = []
+        times = []
+        groups = []
+        event_types = sorted([t for t in self.field_types[i] if cache.has_type(t)])
+        for mtype in event_types:
+            order = cache.order(mtype)
+            t = cache.times(mtype)
+            if mtype in instances:
+                ivals = cache.column(mtype, cache.instance_field(mtype))
+                rows = np.nonzero(np.isin(ivals, instances[mtype]))[0]
+                order = order[rows]
+                t = t[rows]
+                group = ivals[rows]
+            else:
+                group = np.full(len(order), -1.0)
+            orders.append(np.asarray(order))
+            times.append(np.asarray(t))
+            groups.append(np.stack((np.full(len(order), len(groups)), group)))
+        if len(orders) == 0:
+            return (np.zeros(0), None, np.zeros(0))
+        order = np.concatenate(orders)
+        sort = np.argsort(order, kind='stable')
+        order = order[sort]
+        times = np.concatenate(times)[sort]
+        groups = np.concatenate(groups, axis=1)[:, sort]
+        n = len(order)
+
+        # the last message of each type at each point
+        variables = {}
+        valid = {}
+        for mtype in need:
+            if mtype in instances:
+                ivals = cache.column(mtype, cache.instance_field(mtype))
+                variables[mtype] = {}
+                ok = np.ones(n, dtype=bool)
+                for instance in instances[mtype]:
+                    rows = np.nonzero(ivals == instance)[0]
+                    (irows, iok) = self.last_rows(cache.order(mtype)[rows], order)
+                    if len(rows) == 0:
+                        rows = np.zeros(1, dtype=int)
+                    variables[mtype][instance] = CacheColumns(cache, mtype, rows[irows])
+                    ok &= iok
+                valid[mtype] = ok
+            elif len(event_types) == 1 and event_types[0] == mtype:
+                variables[mtype] = CacheColumns(cache, mtype, slice(None))
+                valid[mtype] = np.ones(n, dtype=bool)
+            else:
+                (rows, ok) = self.last_rows(cache.order(mtype), order)
+                variables[mtype] = CacheColumns(cache, mtype, rows)
+                valid[mtype] = ok
+
+        def all_valid(types):
+            ret = np.ones(n, dtype=bool)
+            for mtype in types:
+                ret &= valid[mtype]
+            return ret
+
+        keep = np.ones(n, dtype=bool)
+        if any(flightmode_selections):
+            keep &= flightmode_mask(times, self.flightmode_list, flightmode_selections)
+        if cond is not None:
+            r = cond.evaluate_columns(variables, length=n)
+            if r is None:
+                return None
+            (cvalues, cmask) = r
+            keep &= cvalues.astype(bool) & all_valid(cond.msg_types)
+            if cmask is not None:
+                keep &= cmask
+        if self.max_message_rate > 0:
+            # each type, or instance, is limited to the rate
+            keep_rate = np.zeros(n, dtype=bool)
+            rows = np.nonzero(keep)[0]
+            for g in np.unique(groups[:, rows], axis=1).T:
+                grows = rows[(groups[0, rows] == g[0]) & (groups[1, rows] == g[1])]
+                keep_rate[grows[decimate_by_rate(times[grows], 1.0 / self.max_message_rate)]] = True
+            keep = keep_rate
+
+        r = expr.evaluate_columns(variables, length=n)
+        if r is None:
+            return None
+        (values, vmask) = r
+        if values.dtype.kind not in 'biuf':
+            return None
+        values = values.astype(float)
+        keep &= all_valid(expr.msg_types)
+        if vmask is not None:
+            keep &= vmask
+        # a division by zero gives no point, as it does when parsing
+        keep &= ~np.isinf(values)
+        xvalues = None
+        if xexpr is not None:
+            r = xexpr.evaluate_columns(variables, length=n)
+            if r is None:
+                return None
+            (xvalues, xmask) = r
+            if xvalues.dtype.kind not in 'biuf':
+                return None
+            keep &= all_valid(xexpr.msg_types)
+            if xmask is not None:
+                keep &= xmask
+            xvalues = xvalues.astype(float)[keep]
+        return (times[keep], xvalues, values[keep])
+
+    def last_rows(self, type_order, order):
+        '''return the index of the last row of a message type at or
+        before each position in order, and a mask of where there is one'''
+        rows = np.searchsorted(type_order, order, side='right') - 1
+        ok = rows >= 0
+        return (np.maximum(rows, 0), ok)
+
+    def process_mav(self, mlog, flightmode_selections):
+        '''process one file'''
+        self.vars = {}
+        idx = 0
+        all_false = True
+        for s in flightmode_selections:
+            if s:
+                all_false = False
+
+        self.prepare_fields()
+
         if len(self.flightmode_list) > 0:
             # prime the timestamp conversion
             timestamp_to_days(self.flightmode_list[0][1], self.timeshift)
@@ -555,7 +845,7 @@ class MavGraph(object):
             if mtype not in self.msg_types:
                 continue
             if self.condition:
-                if not mavutil.evaluate_condition(self.condition, all_messages):
+                if not mp_expression.evaluate_condition(self.condition, all_messages):
                     continue
             tdays = timestamp_to_days(msg._timestamp, self.timeshift)
 
@@ -597,6 +887,7 @@ class MavGraph(object):
         self.field_types = []
         self.instance_types = []
         self.xlim = None
+        self.decimator.clear()
         self.flightmode_list = _flightmodes
 
         # work out msg types we are interested in
@@ -626,6 +917,8 @@ class MavGraph(object):
         timeshift = self.timeshift
 
         for fi in range(0, len(self.mav_list)):
+            if fi == 0 and self.process_cache(flightmode_selections):
+                continue
             mlog = self.mav_list[fi]
             self.process_mav(mlog, flightmode_selections)
 
@@ -688,6 +981,7 @@ class MavGraph(object):
             f_out.write(html)
             f_out.close()
         else:
+            self.decimator.update(scale=200.0 / self.fig.dpi)
             plt.savefig(output, bbox_inches='tight', dpi=200)
 
 if __name__ == "__main__":
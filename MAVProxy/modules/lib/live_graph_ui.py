@@ -1,5 +1,6 @@
 from MAVProxy.modules.lib.wx_loader import wx
 from MAVProxy.modules.lib import icon
+from MAVProxy.modules.lib import mp_decimate
 import time
 import numpy, pylab
 
@@ -144,11 +145,14 @@ class GraphFrame(wx.Frame):
             pylab.setp(self.axes.get_xticklabels(), visible=True)
             pylab.setp(self.axes.get_legend().get_texts(), fontsize='small')
 
+        # long timespans have more points than pixels
+        width = mp_decimate.axes_width(self.axes)
         for i in range(len(self.plot_data)):
             ydata = numpy.array(self.data[i])
             xdata = self.xdata
             if len(ydata) < len(self.xdata):
                 xdata = xdata[-len(ydata):]
+            (xdata, ydata) = mp_decimate.minmax(xdata, ydata, self.xdata[0], 0, width)
             self.plot_data[i].set_xdata(xdata)
             self.plot_data[i].set_ydata(ydata)
 
@@ -240,62 +240,23 @@ def remove_offsets(MAG, BAT, c):
     MAG.MagZ = int(field.z)
     return MAG
 
-def magfit(mlog, timestamp_in_range):
-    '''find best magnetometer offset fit to a log file'''
+class CachedMessage(object):
+    '''the cached fields of one message, in place of the message'''
+    def __init__(self, fields):
+        self.__dict__.update(fields)
 
+def magfit_data_from_log(mlog, timestamp_in_range, mtypes, mag_instance, parameters):
+    '''return list of (MAG,ATT,BAT) samples to fit, walking through the log'''
     global earth_field, declination
-    global data
-    data = []
 
+    mag_msg = mtypes[1]
+    ATT_NAME = mtypes[2]
+    data = []
+    count = 0
     ATT = None
     BAT = None
-
-    mag_msg = margs['Magnetometer']
-    global mag_idx
-    if mag_msg[-1].isdigit():
-        mag_instance = None
-        mag_idx = mag_msg[-1]
-    elif mag_msg.endswith('[0]'):
-        mag_instance = 0
-        mag_idx = ''
-        mag_msg = 'MAG'
-    elif mag_msg.endswith(']'):
-        mag_instance = int(mag_msg[-2])
-        mag_idx = str(mag_instance+1)
-        mag_msg = 'MAG'
-    else:
-        mag_instance = None
-        mag_idx = ''
-
-    count = 0
-    parameters = {}
-
-    # get parameters
-    mlog.rewind()
-    while True:
-        msg = mlog.recv_match(type=['PARM'])
-        if msg is None:
-            break
-        parameters[msg.Name] = msg.Value
-
-    mlog.rewind()
-
-    lat = margs['Lattitude']
-    lon = margs['Longitude']
-    if lat != 0 and lon != 0:
-        earth_field = mavextra.expected_earth_field_lat_lon(lat, lon)
-        (declination,inclination,intensity) = mavextra.get_mag_field_ef(lat, lon)
-        print("Earth field: %s  strength %.0f declination %.1f degrees" % (earth_field, earth_field.length(), declination))
-
-    ATT_NAME = margs['Attitude']
-
-    mtypes = ['GPS',mag_msg,ATT_NAME,'BAT']
-    if ATT_NAME == "XKY0":
-        mtypes.append('ATT')
     last_ATT = None
-    print("Attitude source %s mtypes=%s" % (ATT_NAME, mtypes))
 
-    # extract MAG data
     while True:
         msg = mlog.recv_match(type=mtypes)
         if msg is None:
@@ -339,6 +300,176 @@ def magfit(mlog, timestamp_in_range):
             if count % margs['Reduce'] == 0:
                 data.append((msg,ATT,BAT))
             count += 1
+    return data
+
+def magfit_data_from_cache(log_cache, timestamp_in_range, mtypes, mag_instance, parameters):
+    '''return list of (MAG,ATT,BAT) samples to fit from the cached columns
+    of the log, as magfit_data_from_log() would, or None if they are not
+    cached'''
+    global earth_field, declination
+
+    mag_msg = mtypes[1]
+    ATT_NAME = mtypes[2]
+    needed = {'GPS': ['Status', 'Lat', 'Lng'],
+              mag_msg: ['MagX', 'MagY', 'MagZ', 'OfsX', 'OfsY', 'OfsZ'],
+              ATT_NAME: ['Roll', 'Pitch', 'Yaw'],
+              'BAT': []}
+    if ATT_NAME == 'XKY0':
+        needed['XKY0'] = ['YC']
+        needed['ATT'] = ['Roll', 'Pitch', 'Yaw']
+    columns = {}
+    for mtype in mtypes:
+        if not log_cache.has_type(mtype):
+            # not in the log, unless it is only text
+            if log_cache.has_type(mag_msg) and log_cache.has_type(ATT_NAME):
+                continue
+            return None
+        if not all([log_cache.has_field(mtype, f) for f in needed[mtype]]):
+            return None
+        columns[mtype] = log_cache.columns(mtype)
+
+    # the messages in log order, as the walk would see them
+    present = list(columns.keys())
+    order = numpy.concatenate([log_cache.order(m) for m in present])
+    times = numpy.concatenate([log_cache.times(m) for m in present])
+    types = numpy.concatenate([numpy.full(log_cache.count(m), i) for (i, m) in enumerate(present)])
+    rows = numpy.concatenate([numpy.arange(log_cache.count(m)) for m in present])
+    sort = numpy.argsort(order, kind='stable')
+    in_range = numpy.frompyfunc(timestamp_in_range, 1, 1)(times[sort]).astype(int)
+    after = numpy.nonzero(in_range > 0)[0]
+    if len(after) > 0:
+        sort = sort[:after[0]]
+        in_range = in_range[:after[0]]
+    sort = sort[in_range == 0]
+
+    def message(mtype, row):
+        return CachedMessage(dict([(f, float(v[row])) for (f, v) in columns[mtype].items()]))
+
+    # the ATT_NAME core, BAT instance and mag instance, as the walk takes them
+    core = columns.get(ATT_NAME, {}).get('C', None)
+    bat_instance = columns.get('BAT', {}).get('Instance', None)
+    mag_i = columns.get(mag_msg, {}).get('I', None)
+
+    data = []
+    count = 0
+    ATT = None
+    att_row = None
+    bat_row = None
+    last_att_row = None
+    atts = {}
+    bats = {}
+    for (i, row) in zip(types[sort].tolist(), rows[sort].tolist()):
+        mtype = present[i]
+        if mtype == 'GPS' and columns['GPS']['Status'][row] >= 3 and earth_field is None:
+            GPS = message('GPS', row)
+            earth_field = mavextra.expected_earth_field(GPS)
+            (declination,inclination,intensity) = mavextra.get_mag_field_ef(GPS.Lat, GPS.Lng)
+            print("Earth field: %s  strength %.0f declination %.1f degrees" % (earth_field, earth_field.length(), declination))
+        if mtype == 'ATT':
+            # needed for XKY0 for yaw
+            last_att_row = row
+        if mtype == ATT_NAME:
+            if core is not None and core[row] != 0:
+                # use core zero for EKF attitude
+                continue
+            if ATT_NAME == 'XKY0':
+                if last_att_row is None:
+                    continue
+                # get yaw from GSF, and roll/pitch from ATT, trimmed again
+                # for each XKY0 as the walk does
+                ATT = atts.get(last_att_row, None)
+                if ATT is None:
+                    ATT = message('ATT', last_att_row)
+                    atts[last_att_row] = ATT
+                ATT.Yaw = math.degrees(columns['XKY0']['YC'][row])
+                ATT.Roll  += math.degrees(parameters['AHRS_TRIM_X'])
+                ATT.Pitch += math.degrees(parameters['AHRS_TRIM_Y'])
+                ATT.Yaw   += math.degrees(parameters['AHRS_TRIM_Z'])
+            else:
+                # the attitude is made when a mag sample uses it
+                att_row = row
+        if mtype == 'BAT':
+            if bat_instance is not None:
+                if margs['BatteryNum'] != bat_instance[row]+1:
+                    continue
+            bat_row = row
+        if mtype == mag_msg and (ATT is not None or att_row is not None):
+            if mag_instance is not None:
+                if (0 if mag_i is None else mag_i[row]) != mag_instance:
+                    continue
+            if count % margs['Reduce'] == 0:
+                if ATT_NAME != 'XKY0':
+                    ATT = atts.get(att_row, None)
+                    if ATT is None:
+                        ATT = message(ATT_NAME, att_row)
+                        ATT.Roll  += math.degrees(parameters['AHRS_TRIM_X'])
+                        ATT.Pitch += math.degrees(parameters['AHRS_TRIM_Y'])
+                        ATT.Yaw   += math.degrees(parameters['AHRS_TRIM_Z'])
+                        atts[att_row] = ATT
+                BAT = None
+                if bat_row is not None:
+                    BAT = bats.get(bat_row, None)
+                    if BAT is None:
+                        BAT = message('BAT', bat_row)
+                        bats[bat_row] = BAT
+                data.append((message(mag_msg, row),ATT,BAT))
+            count += 1
+    return data
+
+def magfit(mlog, timestamp_in_range, log_cache=None):
+    '''find best magnetometer offset fit to a log file'''
+
+    global earth_field, declination
+    global data
+
+    mag_msg = margs['Magnetometer']
+    global mag_idx
+    if mag_msg[-1].isdigit():
+        mag_instance = None
+        mag_idx = mag_msg[-1]
+    elif mag_msg.endswith('[0]'):
+        mag_instance = 0
+        mag_idx = ''
+        mag_msg = 'MAG'
+    elif mag_msg.endswith(']'):
+        mag_instance = int(mag_msg[-2])
+        mag_idx = str(mag_instance+1)
+        mag_msg = 'MAG'
+    else:
+        mag_instance = None
+        mag_idx = ''
+
+    parameters = {}
+
+    # get parameters
+    mlog.rewind()
+    while True:
+        msg = mlog.recv_match(type=['PARM'])
+        if msg is None:
+            break
+        parameters[msg.Name] = msg.Value
+
+    lat = margs['Lattitude']
+    lon = margs['Longitude']
+    if lat != 0 and lon != 0:
+        earth_field = mavextra.expected_earth_field_lat_lon(lat, lon)
+        (declination,inclination,intensity) = mavextra.get_mag_field_ef(lat, lon)
+        print("Earth field: %s  strength %.0f declination %.1f degrees" % (earth_field, earth_field.length(), declination))
+
+    ATT_NAME = margs['Attitude']
+
+    mtypes = ['GPS',mag_msg,ATT_NAME,'BAT']
+    if ATT_NAME == "XKY0":
+        mtypes.append('ATT')
+    print("Attitude source %s mtypes=%s" % (ATT_NAME, mtypes))
+
+    # extract MAG data
+    data = None
+    if log_cache is not None:
+        data = magfit_data_from_cache(log_cache, timestamp_in_range, mtypes, mag_instance, parameters)
+    if data is None:
+        mlog.rewind()
+        data = magfit_data_from_log(mlog, timestamp_in_range, mtypes, mag_instance, parameters)
 
     old_corrections.offsets = Vector3(parameters.get('COMPASS_OFS%s_X' % mag_idx,0.0),
                                       parameters.get('COMPASS_OFS%s_Y' % mag_idx,0.0),
@@ -485,6 +616,8 @@ class MagFit(MPDataLogChildTask):
             A dataflash or telemetry log
         xlimits: MAVExplorer.XLimits
             An object capturing timestamp limits
+        log_cache : mp_logcache.LogCache
+            The columns of the log, if it is cached
         '''
 
         super(MagFit, self).__init__(*args, **kwargs)
@@ -505,20 +638,22 @@ class MagFit(MPDataLogChildTask):
         app.frame = MagFitUI(title=self.title,
                              close_event=self.close_event,
                              mlog=self.mlog,
-                             timestamp_in_range=self.xlimits.timestamp_in_range)
+                             timestamp_in_range=self.xlimits.timestamp_in_range,
+                             log_cache=self.log_cache)
 
         app.frame.SetDoubleBuffered(True)
         app.frame.Show()
         app.MainLoop()
 
 class MagFitUI(wx.Dialog):
-    def __init__(self, title, close_event, mlog, timestamp_in_range):
+    def __init__(self, title, close_event, mlog, timestamp_in_range, log_cache=None):
         super(MagFitUI, self).__init__(None, title=title, size=(600, 900), style=wx.DEFAULT_DIALOG_STYLE|wx.RESIZE_BORDER)
 
         # capture the close event, log and timestamp range function
         self.close_event = close_event
         self.mlog = mlog
         self.timestamp_in_range = timestamp_in_range
+        self.log_cache = log_cache
 
         # events
         self.timer = wx.Timer(self)
@@ -748,4 +883,4 @@ class MagFitUI(wx.Dialog):
     def run(self, cid):
         global margs
         margs = self.values
-        magfit(self.mlog,self.timestamp_in_range)
+        magfit(self.mlog,self.timestamp_in_range,log_cache=self.log_cache)
@@ -24,6 +24,8 @@ class MavFFT(MPDataLogChildTask):
             A dataflash or telemetry log
         xlimits: MAVExplorer.XLimits
             An object capturing timestamp limits
+        log_cache : mp_logcache.LogCache
+            The columns of the log, if it is cached
         '''
 
         super(MavFFT, self).__init__(*args, **kwargs)
@@ -36,62 +38,58 @@ class MavFFT(MPDataLogChildTask):
         '''Launch `mavfft_display`'''
 
         # run the fft tool
-        mavfft_display(self.mlog, self.xlimits.timestamp_in_range)
-
-def mavfft_display(mlog, timestamp_in_range):
-    '''display fft for raw ACC data in logfile'''
+        mavfft_display(self.mlog, self.xlimits.timestamp_in_range, log_cache=self.log_cache)
 
+class PlotData(object):
     '''object to store data about a single FFT plot'''
-    class PlotData(object):
-        def __init__(self, ffth):
-            self.seqno = -1
-            self.fftnum = ffth.N
-            self.sensor_type = ffth.type
-            self.instance = ffth.instance
-            self.sample_rate_hz = ffth.smp_rate
-            self.multiplier = ffth.mul
-            self.data = {}
-            self.data["X"] = []
-            self.data["Y"] = []
-            self.data["Z"] = []
-            self.holes = False
-            self.freq = None
-
-        def add_fftd(self, fftd):
-            if fftd.N != self.fftnum:
-                print("Skipping ISBD with wrong fftnum (%u vs %u)\n" % (fftd.fftnum, self.fftnum))
-                return
-            if self.holes:
-                print("Skipping ISBD(%u) for ISBH(%u) with holes in it" % (fftd.seqno, self.fftnum))
-                return
-            if fftd.seqno != self.seqno+1:
-                print("ISBH(%u) has holes in it" % fftd.N)
-                self.holes = True
-                return
-            self.seqno += 1
-            self.data["X"].extend(fftd.x)
-            self.data["Y"].extend(fftd.y)
-            self.data["Z"].extend(fftd.z)
-
-        def prefix(self):
-            if self.sensor_type == 0:
-                return "Accel"
-            elif self.sensor_type == 1:
-                return "Gyro"
-            else:
-                return "?Unknown Sensor Type?"
-
-        def tag(self):
-            return str(self)
-
-        def __str__(self):
-            return "%s[%u]" % (self.prefix(), self.instance)
-
-    print("Processing log for ISBH and ISBD messages")
-
+    def __init__(self, fftnum, sensor_type, instance, sample_rate_hz, multiplier):
+        self.seqno = -1
+        self.fftnum = fftnum
+        self.sensor_type = sensor_type
+        self.instance = instance
+        self.sample_rate_hz = sample_rate_hz
+        self.multiplier = multiplier
+        self.data = {}
+        self.data["X"] = []
+        self.data["Y"] = []
+        self.data["Z"] = []
+        self.holes = False
+        self.freq = None
+
+    def add_fftd(self, fftd):
+        if fftd.N != self.fftnum:
+            print("Skipping ISBD with wrong fftnum (%u vs %u)\n" % (fftd.N, self.fftnum))
+            return
+        if self.holes:
+            print("Skipping ISBD(%u) for ISBH(%u) with holes in it" % (fftd.seqno, self.fftnum))
+            return
+        if fftd.seqno != self.seqno+1:
+            print("ISBH(%u) has holes in it" % fftd.N)
+            self.holes = True
+            return
+        self.seqno += 1
+        self.data["X"].extend(fftd.x)
+        self.data["Y"].extend(fftd.y)
+        self.data["Z"].extend(fftd.z)
+
+    def prefix(self):
+        if self.sensor_type == 0:
+            return "Accel"
+        elif self.sensor_type == 1:
+            return "Gyro"
+        else:
+            return "?Unknown Sensor Type?"
+
+    def tag(self):
+        return str(self)
+
+    def __str__(self):
+        return "%s[%u]" % (self.prefix(), self.instance)
+
+def fft_data_from_log(mlog, timestamp_in_range):
+    '''return list of PlotData read from the ISBH and ISBD messages of a log'''
     things_to_plot = []
     plotdata = None
-    start_time = time.time()
     mlog.rewind()
 
     while True:
@@ -109,13 +107,89 @@ def mavfft_display(mlog, timestamp_in_range):
                 # close off previous data collection
                 things_to_plot.append(plotdata)
             # initialise plot-data collection object
-            plotdata = PlotData(m)
+            plotdata = PlotData(m.N, m.type, m.instance, m.smp_rate, m.mul)
             continue
 
         if msg_type == "ISBD":
             if plotdata is None:
                 continue
             plotdata.add_fftd(m)
+    return things_to_plot
+
+def fft_data_from_cache(log_cache, timestamp_in_range):
+    '''return list of PlotData from the cached columns of the ISBH and
+    ISBD messages, as fft_data_from_log() would, or None if they are not
+    cached'''
+    if not log_cache.has_type('ISBH') or not log_cache.has_type('ISBD'):
+        return None
+    hfields = ['N', 'type', 'instance', 'smp_rate', 'mul']
+    if not all([log_cache.has_field('ISBH', f) for f in hfields]):
+        return None
+    if not log_cache.has_field('ISBD', 'N') or not log_cache.has_field('ISBD', 'seqno'):
+        return None
+    axes = [log_cache.array_column('ISBD', f) for f in ['x', 'y', 'z']]
+    if any([a is None for a in axes]):
+        return None
+
+    # the messages of both types in log order
+    num_headers = log_cache.count('ISBH')
+    order = numpy.concatenate((log_cache.order('ISBH'), log_cache.order('ISBD')))
+    times = numpy.concatenate((log_cache.times('ISBH'), log_cache.times('ISBD')))
+    sort = numpy.argsort(order, kind='stable')
+    in_range = numpy.frompyfunc(timestamp_in_range, 1, 1)(times[sort]).astype(int)
+    # stop at the first message after the range
+    after = numpy.nonzero(in_range > 0)[0]
+    if len(after) > 0:
+        sort = sort[:after[0]]
+        in_range = in_range[:after[0]]
+    sort = sort[in_range == 0]
+    is_header = sort < num_headers
+    # the header before each message, -1 for none
+    owner = numpy.cumsum(is_header) - 1
+    headers = sort[is_header]
+    data_rows = sort[~is_header] - num_headers
+    data_owner = owner[~is_header]
+
+    hN = log_cache.column('ISBH', 'N')
+    dN = log_cache.column('ISBD', 'N')
+    seqno = log_cache.column('ISBD', 'seqno')
+    things_to_plot = []
+    # the last header is never closed off
+    for (h, row) in enumerate(headers[:-1]):
+        (i0, i1) = numpy.searchsorted(data_owner, [h, h+1])
+        rows = data_rows[i0:i1]
+        fftnum = int(hN[row])
+        plotdata = PlotData(fftnum, int(log_cache.column('ISBH', 'type')[row]),
+                            int(log_cache.column('ISBH', 'instance')[row]),
+                            log_cache.column('ISBH', 'smp_rate')[row],
+                            log_cache.column('ISBH', 'mul')[row])
+        wrong = dN[rows] != fftnum
+        if numpy.any(wrong):
+            print("Skipping %u ISBD with wrong fftnum for ISBH(%u)" % (numpy.count_nonzero(wrong), fftnum))
+            rows = rows[~wrong]
+        # the data up to the first missing sequence number
+        holes = numpy.nonzero(seqno[rows] != numpy.arange(len(rows)))[0]
+        if len(holes) > 0:
+            print("ISBH(%u) has holes in it" % fftnum)
+            plotdata.holes = True
+            rows = rows[:holes[0]]
+        plotdata.seqno = len(rows) - 1
+        for (axis, a) in zip(["X", "Y", "Z"], axes):
+            plotdata.data[axis] = a[rows].ravel()
+        things_to_plot.append(plotdata)
+    return things_to_plot
+
+def mavfft_display(mlog, timestamp_in_range, log_cache=None):
+    '''display fft for raw ACC data in logfile'''
+
+    print("Processing log for ISBH and ISBD messages")
+
+    start_time = time.time()
+    things_to_plot = None
+    if log_cache is not None:
+        things_to_plot = fft_data_from_cache(log_cache, timestamp_in_range)
+    if things_to_plot is None:
+        things_to_plot = fft_data_from_log(mlog, timestamp_in_range)
 
     if len(things_to_plot) == 0:
         print("No FFT data. Did you set INS_LOG_BAT_MASK?")
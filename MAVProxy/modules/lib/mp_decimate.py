@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+'''
+level of detail decimation for graphs
+
+A line graph of millions of points can show no more than a couple of
+points for each pixel across the axes, so handing matplotlib every point
+only makes panning and zooming slow. minmax() reduces the points within
+the x limits to the minimum and maximum of each pixel wide bucket, which
+draws the same picture, spikes included. LineDecimator keeps the full
+resolution data of the lines on an axes and decimates them again for
+the new range whenever the x limits change.
+
+AP_FLAKE8_CLEAN
+'''
+
+import numpy as np
+
+# lines with no more than this many points per bucket are not decimated
+POINTS_PER_BUCKET = 2
+
+
+def minmax(x, y, xmin, xmax, buckets):
+    '''return (x, y) arrays of the points of the line x, y to draw between
+    xmin and xmax with buckets pixels. x must be sorted. Each bucket keeps
+    its minimum and maximum points, and the points either side of the
+    range are kept so the line runs to the edges'''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    buckets = max(int(buckets), 1)
+    i0 = max(int(np.searchsorted(x, xmin, side='left')) - 1, 0)
+    i1 = min(int(np.searchsorted(x, xmax, side='right')) + 1, len(x))
+    if i1 - i0 <= POINTS_PER_BUCKET * buckets or xmax <= xmin:
+        return (x[i0:i1], y[i0:i1])
+    xs = x[i0:i1]
+    ys = y[i0:i1]
+    bucket = ((xs - xmin) * (buckets / float(xmax - xmin))).astype(np.int64)
+    np.clip(bucket, -1, buckets, out=bucket)
+    # buckets are runs of a sorted array
+    starts = np.concatenate(([0], np.nonzero(np.diff(bucket))[0] + 1))
+    counts = np.diff(np.append(starts, len(xs)))
+    with np.errstate(invalid='ignore'):
+        lo = np.fmin.reduceat(ys, starts)
+        hi = np.fmax.reduceat(ys, starts)
+    run = np.repeat(np.arange(len(starts)), counts)
+    keep = [starts, starts + counts - 1]
+    for extreme in (lo, hi):
+        idx = np.nonzero(ys == extreme[run])[0]
+        # the first point of each run equal to its extreme
+        first = np.ones(len(idx), dtype=bool)
+        first[1:] = run[idx[1:]] != run[idx[:-1]]
+        keep.append(idx[first])
+    keep = np.unique(np.concatenate(keep))
+    return (xs[keep], ys[keep])
+
+
+def is_sorted(x):
+    '''return True if the x values can be decimated, being in order'''
+    x = np.asarray(x)
+    return len(x) > 1 and x.dtype.kind in 'iuf' and not np.any(np.diff(x) < 0)
+
+
+def axes_width(ax, scale=1.0):
+    '''return the width of an axes in pixels'''
+    try:
+        width = ax.get_window_extent().width
+    except Exception:
+        width = 0
+    if not width > 0:
+        width = ax.figure.get_figwidth() * ax.figure.dpi
+    return max(int(width * scale), 1)
+
+
+class LineDecimator(object):
+    '''full resolution data of lines on an axes, drawn decimated for
+    the current x limits'''
+
+    def __init__(self):
+        self.lines = []
+
+    def initial(self, ax, x, y):
+        '''return the (x, y) points to plot on ax for the whole of a line'''
+        return minmax(x, y, x[0], x[-1], axes_width(ax))
+
+    def add(self, line, x, y):
+        '''add a matplotlib line with full resolution points x, y, which
+        must be sorted by x'''
+        self.lines.append((line, np.asarray(x, dtype=float), np.asarray(y)))
+
+    def update(self, xlim=None, scale=1.0):
+        '''decimate the lines again for new x limits, or the current
+        limits of each axes. scale is the ratio of the output resolution
+        to the screen resolution'''
+        for (line, x, y) in self.lines:
+            (xmin, xmax) = xlim if xlim is not None else line.axes.get_xlim()
+            if xmin > x[-1] or xmax < x[0]:
+                # nothing visible, leave it as it was
+                continue
+            (xd, yd) = minmax(x, y, xmin, xmax, axes_width(line.axes, scale))
+            line.set_data(xd, yd)
+
+    def clear(self):
+        self.lines = []
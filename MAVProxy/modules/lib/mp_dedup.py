@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''
+duplicate frame detection for redundant links
+
+When a vehicle is connected over several links each message arrives
+once per link. FrameDedup remembers the frames seen recently, keyed on
+(sysid, compid, seq, msgid, frame CRC32), along with the link they came
+from, so only the first copy is fully processed.
+
+The sequence number is only 8 bits, and wraps several times a second
+at high message rates, so a message with an unchanging payload (such as
+a HEARTBEAT) soon repeats a key. A frame is only a duplicate if the
+earlier copy came from another link, and the window is kept well below
+the time the sequence number takes to wrap.
+
+AP_FLAKE8_CLEAN
+'''
+
+import collections
+import time
+import zlib
+
+# how long a frame is remembered, in seconds. This must cover the
+# difference in latency between the links, but be shorter than a
+# wrap of the sequence number
+WINDOW = 0.2
+
+# upper limit on frames remembered
+MAX_ENTRIES = 16384
+
+
+class FrameDedup(object):
+    '''sliding window of recently seen frames'''
+
+    def __init__(self, window=WINDOW, max_entries=MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        # key -> (link, time seen)
+        self.seen = {}
+        self.order = collections.deque()
+        self.unique = 0
+        self.duplicates = 0
+
+    def duplicate(self, sysid, compid, seq, msgid, buf, link):
+        '''return True if the frame buf has been seen recently on a link
+        other than link'''
+        now = time.monotonic()
+        order = self.order
+        seen = self.seen
+        cutoff = now - self.window
+        while len(order) > 0 and (order[0][0] < cutoff or len(order) >= self.max_entries):
+            (t, key) = order.popleft()
+            if seen.get(key, (None, None))[1] == t:
+                # not seen again since
+                del seen[key]
+        key = (sysid, compid, seq, msgid, zlib.crc32(buf))
+        prev = seen.get(key, None)
+        if prev is not None and prev[0] != link:
+            self.duplicates += 1
+            return True
+        # new, or a repeat on the same link after the sequence number wrapped
+        seen[key] = (link, now)
+        order.append((now, key))
+        self.unique += 1
+        return False
+
+    def reset(self):
+        '''forget all frames'''
+        self.seen = {}
+        self.order.clear()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+'''
+compiled MAVLink expressions
+
+Expressions such as "ATTITUDE.roll*57.3" or "VFR_HUD.alt{HEARTBEAT.base_mode&128}"
+are used by graphs, the console and flightview. pymavlink's
+evaluate_expression() compiles the expression string on every call,
+while compile_expression() compiles it once, caching the result by
+expression string, and finds the message types it depends on.
+
+Expression.evaluate() gives the same results as
+mavutil.evaluate_expression(). Expression.evaluate_columns() evaluates
+an expression over numpy arrays of field values, using numpy versions of
+the maths functions. It returns None for expressions which can't be
+evaluated that way (for example ones calling mavextra functions that
+take whole messages), so callers can fall back to evaluate().
+
+AP_FLAKE8_CLEAN
+'''
+
+import ast
+import re
+
+import numpy as np
+from pymavlink import mavexpression
+
+# namespace expressions are evaluated in, as mavexpression does
+EXPRESSION_GLOBALS = vars(mavexpression)
+
+# numpy replacements for maths functions in vectorised expressions
+NUMPY_FUNCTIONS = {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'asin': np.arcsin, 'acos': np.arccos, 'atan': np.arctan, 'atan2': np.arctan2,
+    'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log, 'log10': np.log10,
+    'fabs': np.fabs, 'floor': np.floor, 'ceil': np.ceil, 'hypot': np.hypot,
+    'degrees': np.degrees, 'radians': np.radians,
+    'isnan': np.isnan, 'isinf': np.isinf,
+}
+COLUMN_GLOBALS = dict(EXPRESSION_GLOBALS)
+COLUMN_GLOBALS.update(NUMPY_FUNCTIONS)
+
+# names which are message types
+MSG_TYPE_RE = re.compile('^[A-Z_][A-Z0-9_]+$')
+
+# compiled expressions by expression string
+MAX_CACHE = 4096
+_cache = {}
+
+
+class Columns(object):
+    '''a message type in a vectorised expression, with a numpy array
+    for each field'''
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+
+class Expression(object):
+    '''a compiled expression'''
+
+    def __init__(self, text):
+        self.text = text
+        self.expression = text
+        self.condition = None
+        self.code = None
+        self.condition_code = None
+        # exception to raise when evaluated, as eval() would
+        self.error = None
+        # the condition couldn't be parsed, so the expression is never true
+        self.bad_condition = False
+        self.msg_types = set()
+
+        if text.endswith('}'):
+            i = text.rfind('{')
+            if i == -1:
+                self.bad_condition = True
+            else:
+                self.condition = text[i+1:-1]
+                self.expression = text[:i]
+                try:
+                    self.condition_code = compile(self.condition, '<condition>', 'eval')
+                    self.msg_types.update(self.names(self.condition))
+                except Exception:
+                    self.bad_condition = True
+        try:
+            self.code = compile(self.expression, '<expression>', 'eval')
+            self.msg_types.update(self.names(self.expression))
+        except Exception as ex:
+            self.error = ex
+
+    def names(self, source):
+        '''return the message type names used in source'''
+        ret = set()
+        try:
+            tree = ast.parse(source, mode='eval')
+        except SyntaxError:
+            return ret
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Name) and MSG_TYPE_RE.match(node.id) and
+                    node.id not in EXPRESSION_GLOBALS):
+                ret.add(node.id)
+        return ret
+
+    def evaluate(self, variables, nocondition=False):
+        '''evaluate the expression with the messages in variables'''
+        if self.bad_condition:
+            return None
+        if self.condition_code is not None:
+            try:
+                v = eval(self.condition_code, EXPRESSION_GLOBALS, variables)
+            except Exception:
+                return None
+            if not nocondition and not v:
+                return None
+        if self.error is not None:
+            raise self.error
+        try:
+            return eval(self.code, EXPRESSION_GLOBALS, variables)
+        except (NameError, ZeroDivisionError, IndexError):
+            return None
+
+    def evaluate_columns(self, columns, nocondition=False, length=None):
+        '''evaluate the expression over arrays of field values. columns
+        is a dictionary by message type of Columns (or of dictionaries of
+        field arrays), or for messages used with an instance, as in
+        IMU[1].GyrX, of dictionaries of Columns by instance. All arrays
+        must be length long, which is found from the arrays if not given.
+        Returns a tuple of the values array and a boolean array of where
+        the condition is true (None if there is no condition), or None if
+        the expression can't be evaluated this way'''
+        if self.error is not None or self.bad_condition:
+            return None
+        variables = {}
+        for (mtype, c) in columns.items():
+            if isinstance(c, Columns) or (isinstance(c, dict) and
+                                          any([isinstance(v, Columns) for v in c.values()])):
+                variables[mtype] = c
+            else:
+                variables[mtype] = Columns(c)
+        if length is None:
+            for c in variables.values():
+                for v in (c.values() if isinstance(c, dict) else [c]):
+                    for a in v.__dict__.values():
+                        length = len(a)
+                        break
+                    if length is not None:
+                        break
+                if length is not None:
+                    break
+        try:
+            with np.errstate(all='ignore'):
+                values = eval(self.code, COLUMN_GLOBALS, variables)
+                mask = None
+                if self.condition_code is not None and not nocondition:
+                    mask = eval(self.condition_code, COLUMN_GLOBALS, variables)
+        except Exception:
+            return None
+        values = np.asarray(values)
+        if values.dtype == object:
+            return None
+        if length is not None and values.shape != (length,):
+            values = np.broadcast_to(values, (length,))
+        if mask is not None:
+            mask = np.asarray(mask).astype(bool)
+            if length is not None and mask.shape != (length,):
+                mask = np.broadcast_to(mask, (length,))
+        return (values, mask)
+
+
+def compile_expression(text):
+    '''return the compiled Expression for an expression string'''
+    e = _cache.get(text, None)
+    if e is None:
+        if len(_cache) >= MAX_CACHE:
+            _cache.clear()
+        e = Expression(text)
+        _cache[text] = e
+    return e
+
+
+def evaluate_expression(text, variables, nocondition=False):
+    '''compiled replacement for mavutil.evaluate_expression()'''
+    return compile_expression(text).evaluate(variables, nocondition=nocondition)
+
+
+def evaluate_condition(condition, variables):
+    '''compiled replacement for mavutil.evaluate_condition()'''
+    if condition is None:
+        return True
+    v = evaluate_expression(condition, variables)
+    if v is None:
+        return False
+    return v
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+'''
+split a MAVLink byte stream into frames using only the frame headers,
+so that frames can be routed without decoding the payload
+
+Frames which are only forwarded are kept undecoded in LazyMessages
+dictionaries, which stand in for the last message of each type and
+decode a frame only when its type is looked up.
+
+AP_FLAKE8_CLEAN
+'''
+
+from pymavlink import mavutil
+
+PROTOCOL_MARKER_V1 = 0xFE
+PROTOCOL_MARKER_V2 = 0xFD
+IFLAG_SIGNED = 0x01
+
+HEADER_LEN_V1 = 6
+HEADER_LEN_V2 = 10
+SIGNATURE_LEN = 13
+
+
+class FrameSplitter(object):
+    '''accumulate received bytes and return complete MAVLink frames'''
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.frame_count = 0
+        self.crc_errors = 0
+
+    def check_crc(self, frame, crc_end, crc_extra):
+        '''check the CRC of a frame'''
+        crc = mavutil.mavlink.x25crc(frame[1:crc_end])
+        crc.accumulate(bytes([crc_extra]))
+        return crc.crc == (frame[crc_end] | (frame[crc_end+1] << 8))
+
+    def split(self, data):
+        '''add data, returning a list of (msgid, sysid, compid, seq, frame)
+        tuples. msgid is None for data which is not a valid frame of a
+        known message type, and should be passed to the normal parser'''
+        buf = self.buf
+        buf.extend(data)
+        mavlink_map = mavutil.mavlink.mavlink_map
+        ret = []
+        n = len(buf)
+        ofs = 0
+        while ofs < n:
+            magic = buf[ofs]
+            if magic != PROTOCOL_MARKER_V2 and magic != PROTOCOL_MARKER_V1:
+                # not a frame start, pass along up to the next possible frame
+                end = ofs + 1
+                while end < n and buf[end] != PROTOCOL_MARKER_V2 and buf[end] != PROTOCOL_MARKER_V1:
+                    end += 1
+                ret.append((None, 0, 0, 0, bytes(buf[ofs:end])))
+                ofs = end
+                continue
+            if n - ofs < 3:
+                break
+            plen = buf[ofs+1]
+            if magic == PROTOCOL_MARKER_V2:
+                incompat_flags = buf[ofs+2]
+                hlen = HEADER_LEN_V2
+                flen = hlen + plen + 2
+                if incompat_flags & IFLAG_SIGNED:
+                    flen += SIGNATURE_LEN
+            else:
+                incompat_flags = 0
+                hlen = HEADER_LEN_V1
+                flen = hlen + plen + 2
+            if n - ofs < flen:
+                # wait for the rest of the frame
+                break
+            frame = bytes(buf[ofs:ofs+flen])
+            ofs += flen
+            if magic == PROTOCOL_MARKER_V2:
+                seq = frame[4]
+                sysid = frame[5]
+                compid = frame[6]
+                msgid = frame[7] | (frame[8] << 8) | (frame[9] << 16)
+            else:
+                seq = frame[2]
+                sysid = frame[3]
+                compid = frame[4]
+                msgid = frame[5]
+            msgtype = mavlink_map.get(msgid, None)
+            if msgtype is None or (incompat_flags & ~IFLAG_SIGNED) != 0:
+                ret.append((None, sysid, compid, seq, frame))
+                continue
+            if not self.check_crc(frame, hlen + plen, msgtype.crc_extra):
+                self.crc_errors += 1
+                ret.append((None, sysid, compid, seq, frame))
+                continue
+            self.frame_count += 1
+            ret.append((msgid, sysid, compid, seq, frame))
+        if ofs > 0:
+            del buf[:ofs]
+        return ret
+
+
+class LazyMessages(dict):
+    '''dictionary of the last message of each type, which also holds the
+    undecoded frames of forwarded messages and decodes them when their
+    type is looked up'''
+
+    def __init__(self, *args):
+        dict.__init__(self, *args)
+        # mtype -> (decode function, frame, time received)
+        self.pending = {}
+
+    def add_frame(self, mtype, decode, frame, t):
+        '''add the frame of a message of type mtype received at time t,
+        decoded with decode(frame) when it is wanted'''
+        self.pending[mtype] = (decode, frame, t)
+
+    def decode(self, mtype):
+        '''decode the pending frame of mtype'''
+        (decode, frame, t) = self.pending.pop(mtype)
+        try:
+            # pymavlink only decodes a bytearray
+            m = decode(bytearray(frame))
+        except Exception:
+            return
+        m._timestamp = t
+        dict.__setitem__(self, mtype, m)
+
+    def decode_all(self):
+        '''decode all pending frames'''
+        for mtype in list(self.pending.keys()):
+            self.decode(mtype)
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            self.decode(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in self.pending:
+            self.decode(key)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.pending
+
+    def __setitem__(self, key, value):
+        self.pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if self.pending.pop(key, None) is not None and not dict.__contains__(self, key):
+            return
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        if key in self.pending:
+            self.decode(key)
+        return dict.pop(self, key, *args)
+
+    def setdefault(self, key, default=None):
+        if key in self.pending:
+            self.decode(key)
+        return dict.setdefault(self, key, default)
+
+    def __iter__(self):
+        self.decode_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        return dict.__len__(self) + len([k for k in self.pending if not dict.__contains__(self, k)])
+
+    def keys(self):
+        self.decode_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.decode_all()
+        return dict.values(self)
+
+    def items(self):
+        self.decode_all()
+        return dict.items(self)
+
+    def copy(self):
+        self.decode_all()
+        return dict(self)
+
+
+def lazy_messages(messages):
+    '''return messages as a LazyMessages dictionary'''
+    if isinstance(messages, LazyMessages):
+        return messages
+    return LazyMessages(messages)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+'''
+open several links at once
+
+Opening a link can take seconds, for example retrying a serial port
+which isn't there or a TCP connection which isn't answered. When
+MAVProxy starts with several --master links they are opened in parallel
+threads, and startup carries on once they are all open, or once the
+deadline has passed and at least one of them is open. Links which are
+still opening then are added when they finish.
+
+AP_FLAKE8_CLEAN
+'''
+
+import threading
+import time
+
+# seconds to wait for all links to open, once one is open
+OPEN_TIMEOUT = 5.0
+
+
+class PendingLink(object):
+    '''a link being opened in a thread'''
+
+    def __init__(self, descriptor, open_func):
+        self.descriptor = descriptor
+        self.open_func = open_func
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='open %s' % descriptor)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.result = self.open_func(self.descriptor)
+        except Exception as ex:
+            self.error = ex
+        self.finished.set()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def opened(self):
+        return self.done() and self.error is None
+
+
+def open_links(descriptors, open_func, timeout=OPEN_TIMEOUT, poll=0.01):
+    '''call open_func on each descriptor in a thread. Returns the list
+    of PendingLink once all have finished, or once timeout seconds have
+    passed and at least one has opened'''
+    pending = [PendingLink(d, open_func) for d in descriptors]
+    deadline = time.time() + timeout
+    while True:
+        if all([p.done() for p in pending]):
+            break
+        if time.time() >= deadline and any([p.opened() for p in pending]):
+            break
+        time.sleep(poll)
+    return pending
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+'''
+per-link reader workers
+
+A LinkReader reads from a master link in a worker thread or process,
+splits the byte stream into MAVLink frames and passes them to the main
+loop through a single-producer single-consumer ring buffer. In process
+mode the ring is in shared memory. The main loop is woken through a
+socket pair, so it can wait on LinkReader.notify_fd in place of the
+link fd. A socket rather than a pipe is used as Windows can only select
+on sockets.
+
+Serial links without a file descriptor (as on Windows) can't be waited
+on by the main loop, so they get a thread reader by default. That does
+blocking reads of the port rather than polling it. If the reader can't
+be started or waited on, the main loop polls the link as before.
+
+AP_FLAKE8_CLEAN
+'''
+
+import atexit
+import multiprocessing
+import select
+import signal
+import socket
+import struct
+import threading
+import time
+
+from MAVProxy.modules.lib import mp_fastfwd
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+READER_MODES = ['thread', 'process']
+
+# ring header, one uint64 per field
+HEADER = struct.Struct('<8Q')
+(H_WRITE, H_READ, H_FRAMES, H_BYTES, H_DROPPED, H_DROPPED_BYTES, H_HIGH_WATER, H_CLOSED) = range(8)
+
+# record header: frame length, msgid (-1 for unparsed data), sysid, compid, seq
+RECORD = struct.Struct('<IiBBBx')
+WRAP_MARKER = 0xFFFFFFFF
+
+# longest a blocking read of a link without a file descriptor waits,
+# which is how long the reader takes to notice it has been closed
+BLOCKING_READ_TIMEOUT = 0.1
+
+
+class FrameRing(object):
+    '''ring buffer of (msgid, sysid, compid, seq, frame) records. put() must
+    only be called from one producer and get() from one consumer. No
+    locks are needed as each index is only written by one side'''
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.data = buf[HEADER.size:]
+        self.capacity = len(self.data)
+
+    def _get(self, field):
+        return struct.unpack_from('<Q', self.buf, field * 8)[0]
+
+    def _set(self, field, value):
+        struct.pack_into('<Q', self.buf, field * 8, value)
+
+    def put(self, records):
+        '''add records, dropping any which don't fit. Returns number added'''
+        data = self.data
+        cap = self.capacity
+        w = self._get(H_WRITE)
+        r = self._get(H_READ)
+        (frames, nbytes, dropped, dropped_bytes, high_water) = HEADER.unpack_from(self.buf)[H_FRAMES:H_CLOSED]
+        added = 0
+        for (msgid, sysid, compid, seq, frame) in records:
+            flen = len(frame)
+            need = RECORD.size + flen
+            pos = w % cap
+            tail = cap - pos
+            skip = tail if tail < need else 0
+            if (w - r) + skip + need > cap:
+                # the consumer may have caught up since we last looked
+                r = self._get(H_READ)
+                if (w - r) + skip + need > cap:
+                    dropped += 1
+                    dropped_bytes += flen
+                    continue
+            if skip:
+                if tail >= RECORD.size:
+                    struct.pack_into('<I', data, pos, WRAP_MARKER)
+                w += skip
+                pos = 0
+            if msgid is None:
+                msgid = -1
+            RECORD.pack_into(data, pos, flen, msgid, sysid, compid, seq)
+            data[pos+RECORD.size:pos+need] = frame
+            w += need
+            frames += 1
+            nbytes += flen
+            added += 1
+            high_water = max(high_water, w - r)
+        struct.pack_into('<5Q', self.buf, H_FRAMES * 8, frames, nbytes, dropped, dropped_bytes, high_water)
+        # publish the new records last
+        self._set(H_WRITE, w)
+        return added
+
+    def get(self):
+        '''return list of all available records'''
+        data = self.data
+        cap = self.capacity
+        r = self._get(H_READ)
+        w = self._get(H_WRITE)
+        ret = []
+        while r < w:
+            pos = r % cap
+            tail = cap - pos
+            if tail < RECORD.size:
+                r += tail
+                continue
+            (flen, msgid, sysid, compid, seq) = RECORD.unpack_from(data, pos)
+            if flen == WRAP_MARKER:
+                r += tail
+                continue
+            frame = bytes(data[pos+RECORD.size:pos+RECORD.size+flen])
+            if msgid < 0:
+                msgid = None
+            ret.append((msgid, sysid, compid, seq, frame))
+            r += RECORD.size + flen
+        self._set(H_READ, r)
+        return ret
+
+    def close(self):
+        '''tell the producer to stop'''
+        self._set(H_CLOSED, 1)
+
+    def closed(self):
+        return self._get(H_CLOSED) != 0
+
+    def stats(self):
+        '''return dictionary of ring statistics'''
+        h = HEADER.unpack_from(self.buf)
+        return {
+            'frames': h[H_FRAMES],
+            'bytes': h[H_BYTES],
+            'queued': h[H_WRITE] - h[H_READ],
+            'capacity': self.capacity,
+            'high_water': h[H_HIGH_WATER],
+            'dropped': h[H_DROPPED],
+            'dropped_bytes': h[H_DROPPED_BYTES],
+        }
+
+
+def blocking_read_available(master):
+    '''return True if master is a serial link without a file descriptor
+    which can be read with a timeout'''
+    port = getattr(master, 'port', None)
+    return master.fd is None and hasattr(port, 'inWaiting') and hasattr(port, 'timeout')
+
+
+def blocking_recv(master, n):
+    '''read up to n bytes from a link without a file descriptor, waiting
+    up to BLOCKING_READ_TIMEOUT for the first byte'''
+    port = master.port
+    if port.timeout != BLOCKING_READ_TIMEOUT:
+        # pymavlink opens ports non-blocking, and reopens them on errors
+        port.timeout = BLOCKING_READ_TIMEOUT
+    s = port.read(1)
+    if len(s) > 0:
+        waiting = min(port.inWaiting(), n - 1)
+        if waiting > 0:
+            s += port.read(waiting)
+    return s
+
+
+def wakeup_pair():
+    '''return a (notify, wake) pair of connected non-blocking sockets, for
+    a worker to wake the main loop waiting on notify'''
+    (notify, wake) = socket.socketpair()
+    notify.setblocking(False)
+    wake.setblocking(False)
+    return (notify, wake)
+
+
+def reader_loop(master, ring, wake):
+    '''worker loop, reading from master and filling ring until it is closed'''
+    splitter = mp_fastfwd.FrameSplitter()
+    while not ring.closed():
+        fd = master.fd
+        blocking = False
+        if fd is not None:
+            try:
+                (rin, win, xin) = select.select([fd], [], [], 0.1)
+            except (OSError, ValueError):
+                time.sleep(0.1)
+                continue
+            if not rin:
+                continue
+        else:
+            blocking = blocking_read_available(master)
+        t0 = time.time()
+        try:
+            if blocking:
+                s = blocking_recv(master, 16*1024)
+            else:
+                s = master.recv(16*1024)
+        except Exception:
+            time.sleep(0.1)
+            continue
+        if len(s) == 0:
+            if blocking:
+                if time.time() - t0 < BLOCKING_READ_TIMEOUT * 0.5:
+                    # the read didn't wait, probably a dead port
+                    time.sleep(0.1)
+            else:
+                # a polled link with no data, or a dead port
+                time.sleep(0.001 if fd is None else 0.1)
+            continue
+        if ring.put(splitter.split(s)) == 0:
+            continue
+        try:
+            wake.send(b'x')
+        except OSError:
+            # socket buffer full, the main loop has already been woken
+            pass
+
+
+def process_main(master, shm_name, wake):
+    '''entry point for process mode readers'''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        reader_loop(master, FrameRing(shm.buf), wake)
+    finally:
+        shm.close()
+
+
+def process_mode_available(master):
+    '''return None if process mode is usable for master, or the reason it isn't'''
+    if shared_memory is None:
+        return "shared memory not available"
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return "fork not available"
+    if master.fd is None:
+        return "link has no file descriptor"
+    if not hasattr(master.port, 'inWaiting'):
+        # network links change their peer address and sockets in recv(),
+        # which must be seen by the main process for sending
+        return "only serial links are supported"
+    return None
+
+
+class LinkReader(object):
+    '''read and frame data from master in a worker thread or process'''
+
+    def __init__(self, master, mode='thread', bufsize=1024*1024):
+        if mode not in READER_MODES:
+            raise ValueError("Unknown reader mode %s" % mode)
+        self.master = master
+        self.mode = mode
+        self.shm = None
+        self.worker = None
+        size = HEADER.size + bufsize
+        if mode == 'process':
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:HEADER.size] = bytes(HEADER.size)
+            self.ring = FrameRing(self.shm.buf)
+        else:
+            self.ring = FrameRing(memoryview(bytearray(size)))
+        (self.notify_sock, self.wake_sock) = wakeup_pair()
+        self.notify_fd = self.notify_sock.fileno()
+        if mode == 'process':
+            ctx = multiprocessing.get_context('fork')
+            self.worker = ctx.Process(target=process_main, args=(master, self.shm.name, self.wake_sock),
+                                      name='reader %s' % master.address)
+            self.worker.daemon = True
+            self.worker.start()
+            atexit.register(self.close)
+        else:
+            self.worker = threading.Thread(target=reader_loop, args=(master, self.ring, self.wake_sock),
+                                           name='reader %s' % master.address)
+            self.worker.daemon = True
+            self.worker.start()
+
+    def read(self):
+        '''return list of (msgid, sysid, compid, seq, frame) received since the last call'''
+        try:
+            while len(self.notify_sock.recv(4096)) == 4096:
+                pass
+        except OSError:
+            pass
+        return self.ring.get()
+
+    def stats(self):
+        '''return dictionary of reader statistics'''
+        return self.ring.stats()
+
+    def close(self):
+        '''stop the worker and release resources'''
+        if self.worker is None:
+            return
+        self.ring.close()
+        self.worker.join(timeout=1)
+        if blocking_read_available(self.master) and self.master.port.timeout == BLOCKING_READ_TIMEOUT:
+            # back to non-blocking for polling by the main loop
+            self.master.port.timeout = 0
+        if self.mode == 'process':
+            if self.worker.is_alive():
+                self.worker.terminate()
+            atexit.unregister(self.close)
+        self.worker = None
+        for sock in [self.notify_sock, self.wake_sock]:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        if self.shm is not None:
+            # drop our views before closing the shared memory
+            self.ring = FrameRing(memoryview(bytearray(HEADER.size + 1)))
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+'''
+link quality statistics
+
+Each link keeps statistics for every (sysid, compid) it receives from:
+
+  loss      : packets missing from the MAVLink sequence numbers
+  reordered : packets arriving after a later sequence number
+  delay     : one-way delay relative to the lowest delay seen, from the
+              arrival time of messages with a time_boot_ms field. The
+              trend is the change in the delay per second over the last
+              HISTORY seconds, so a growing queue in a radio shows as a
+              positive trend
+  jitter    : the change in delay between consecutive timestamped
+              messages, as an RFC 3550 style smoothed value and a
+              histogram
+
+and the bytes per second received for each message type.
+
+AP_FLAKE8_CLEAN
+'''
+
+import bisect
+import collections
+
+from pymavlink import mavutil
+
+# seconds of history kept for rates and the delay trend
+HISTORY = 10
+
+# upper limits of the jitter histogram buckets in milliseconds, the
+# last bucket holds everything above the last limit
+JITTER_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+# a time_boot_ms going back by more than this many ms is a reboot
+TIME_WRAP_MS = 30000
+
+# the SiK radio injects RADIO_STATUS with its own sequence numbers
+RADIO_SOURCE = (ord('3'), ord('D'))
+
+
+class SourceStats(object):
+    '''statistics for one (sysid, compid) on one link'''
+
+    def __init__(self):
+        self.packets = 0
+        self.lost = 0
+        self.reordered = 0
+        self.last_seq = None
+        self.last_msec = None
+        self.base_transit = None
+        self.last_transit = None
+        self.delay = 0.0
+        self.jitter = 0.0
+        self.jitter_hist = [0] * (len(JITTER_BUCKETS) + 1)
+        # mean delay of the current second, and of past seconds
+        self.delay_sum = 0.0
+        self.delay_count = 0
+        self.delay_history = collections.deque(maxlen=HISTORY)
+        # (packets, lost) at each of the past seconds
+        self.loss_history = collections.deque(maxlen=HISTORY+1)
+
+    def sequence(self, seq):
+        '''account for a packet with sequence number seq'''
+        self.packets += 1
+        if self.last_seq is None:
+            self.last_seq = seq
+            return
+        gap = (seq - self.last_seq - 1) % 256
+        if gap < 128:
+            self.lost += gap
+            self.last_seq = seq
+        else:
+            # older than the last packet, so it was counted as lost
+            self.reordered += 1
+            if self.lost > 0:
+                self.lost -= 1
+
+    def timestamp(self, msec, now):
+        '''account for a message sent at time_boot_ms msec arriving at now'''
+        if self.last_msec is not None and msec + TIME_WRAP_MS < self.last_msec:
+            # the vehicle rebooted, start again
+            self.base_transit = None
+            self.last_transit = None
+        self.last_msec = msec
+        transit = now - msec * 0.001
+        if self.base_transit is None or transit < self.base_transit:
+            self.base_transit = transit
+        self.delay = transit - self.base_transit
+        self.delay_sum += self.delay
+        self.delay_count += 1
+        if self.last_transit is not None:
+            d = abs(transit - self.last_transit)
+            self.jitter += (d - self.jitter) / 16.0
+            self.jitter_hist[bisect.bisect_left(JITTER_BUCKETS, d * 1000)] += 1
+        self.last_transit = transit
+
+    def rotate(self):
+        '''called once a second'''
+        if self.delay_count > 0:
+            self.delay_history.append(self.delay_sum / self.delay_count)
+        self.delay_sum = 0.0
+        self.delay_count = 0
+        self.loss_history.append((self.packets, self.lost))
+
+    def loss_rate(self):
+        '''return the fraction of packets lost'''
+        total = self.packets + self.lost
+        if total == 0:
+            return 0.0
+        return self.lost / float(total)
+
+    def recent_loss_rate(self):
+        '''return the fraction of packets lost over the last HISTORY seconds'''
+        if len(self.loss_history) == 0:
+            return self.loss_rate()
+        (packets, lost) = self.loss_history[0]
+        total = (self.packets - packets) + (self.lost - lost)
+        if total <= 0:
+            return 0.0
+        return max(self.lost - lost, 0) / float(total)
+
+    def transit(self):
+        '''return the recent mean transit time, or None. This includes
+        the offset between the vehicle and local clocks, so is only
+        useful for comparing links to the same vehicle'''
+        if self.base_transit is None:
+            return None
+        if len(self.delay_history) > 0:
+            return self.base_transit + self.delay_history[-1]
+        return self.base_transit + self.delay
+
+    def delay_trend(self):
+        '''return the change in delay in seconds per second'''
+        h = self.delay_history
+        if len(h) < 2:
+            return 0.0
+        return (h[-1] - h[0]) / (len(h) - 1)
+
+    def stats(self):
+        '''return dictionary of statistics'''
+        return {
+            'packets': self.packets,
+            'lost': self.lost,
+            'loss_rate': self.loss_rate(),
+            'recent_loss_rate': self.recent_loss_rate(),
+            'reordered': self.reordered,
+            'delay': self.delay,
+            'delay_trend': self.delay_trend(),
+            'jitter': self.jitter,
+            'jitter_hist': list(self.jitter_hist),
+        }
+
+
+class LinkStats(object):
+    '''statistics for one link'''
+
+    def __init__(self):
+        self.sources = {}
+        # bytes by message ID in the current second, and past seconds
+        self.type_bytes = {}
+        self.type_history = collections.deque(maxlen=HISTORY)
+
+    def source(self, sysid, compid):
+        '''return the SourceStats for a sysid and compid'''
+        key = (sysid, compid)
+        s = self.sources.get(key, None)
+        if s is None:
+            s = SourceStats()
+            self.sources[key] = s
+        return s
+
+    def update(self, sysid, compid, seq, msgid, nbytes):
+        '''account for a received frame'''
+        self.type_bytes[msgid] = self.type_bytes.get(msgid, 0) + nbytes
+        if (sysid, compid) != RADIO_SOURCE:
+            self.source(sysid, compid).sequence(seq)
+
+    def timestamp(self, sysid, compid, msec, now):
+        '''account for a received message with a time_boot_ms field'''
+        if msec != 0:
+            self.source(sysid, compid).timestamp(msec, now)
+
+    def rotate(self):
+        '''called once a second'''
+        self.type_history.append(self.type_bytes)
+        self.type_bytes = {}
+        for s in self.sources.values():
+            s.rotate()
+
+    def type_rates(self):
+        '''return dictionary of bytes per second by message type name'''
+        n = len(self.type_history)
+        if n == 0:
+            return {}
+        totals = {}
+        for d in self.type_history:
+            for (msgid, nbytes) in d.items():
+                totals[msgid] = totals.get(msgid, 0) + nbytes
+        ret = {}
+        for (msgid, total) in totals.items():
+            mtype = mavutil.mavlink.mavlink_map.get(msgid, None)
+            name = mtype.msgname if mtype is not None else str(msgid)
+            ret[name] = total / float(n)
+        return ret
+
+    def reset(self):
+        '''clear all statistics'''
+        self.__init__()
+
+    def stats(self):
+        '''return dictionary of statistics'''
+        sources = {}
+        for ((sysid, compid), s) in sorted(self.sources.items()):
+            sources['%u:%u' % (sysid, compid)] = s.stats()
+        return {
+            'sources': sources,
+            'type_rates': self.type_rates(),
+        }
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+'''
+columnar cache of log data
+
+The numeric fields of every message in a log are converted once into
+numpy arrays, one per message type, and saved in a cache directory
+keyed by a hash of the log. When the same log is opened again the
+arrays are memory mapped, so getting the values of a field is an array
+slice rather than a parse of the whole log.
+
+Each message type is stored as TYPE.npy, a 2D float64 array with the
+message timestamps in row 0, the position of each message in the log in
+row 1 and a row per numeric field, with an index.json describing the
+fields and instance field of each type. Text fields are not cached.
+DataFlash array fields, such as ISBD.x, are cached as a field per
+element, x[0] to x[31]. The
+positions give the order of messages of different types with the same
+timestamp, for evaluating expressions over several types as a walk
+through the log would.
+
+Binary DataFlash logs with microsecond timestamps are decoded directly
+from the log into arrays, one message type at a time, using the message
+offsets DFReader finds when it opens the log. Other logs, and DataFlash
+messages without a TimeUS field, are read with recv_match().
+
+The key is a hash of the log size and a sample of its contents, so it
+doesn't need a read of the whole log. The cache is kept under
+~/.mavproxy/logcache, with the least recently used logs removed when it
+gets larger than MAX_CACHE_BYTES.
+
+AP_FLAKE8_CLEAN
+'''
+
+import array
+import hashlib
+import json
+import os
+import shutil
+import struct
+import time
+
+import numpy as np
+
+from MAVProxy.modules.lib import mp_util
+
+FORMAT_VERSION = 3
+
+# rows before the fields
+TIME_ROW = 0
+ORDER_ROW = 1
+FIELD_ROW = 2
+
+# blocks of the log hashed to make the key
+KEY_BLOCKS = 64
+KEY_BLOCK_SIZE = 65536
+
+# size the cache directory is pruned to
+MAX_CACHE_BYTES = 20 * 1024 * 1024 * 1024
+
+INDEX_NAME = 'index.json'
+
+# message types which are not data
+SKIP_TYPES = frozenset(['BAD_DATA', 'FMT', 'FMTU', 'MULT', 'UNIT'])
+
+# numpy types of the numeric struct codes used by DataFlash formats
+DF_NUMPY_TYPES = {
+    'b': '<i1', 'B': '<u1', 'e': '<f2', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+    'f': '<f4', 'd': '<f8', 'q': '<i8', 'Q': '<u8',
+}
+
+# elements of a DataFlash array field, which DFReader decodes as int16
+DF_ARRAY_LENGTH = 32
+
+# DataFlash messages decoded at a time
+DF_CHUNK = 500000
+
+
+def default_cache_dir():
+    '''return the directory caches are kept in'''
+    return mp_util.dot_mavproxy('logcache')
+
+
+def log_key(filename, options=''):
+    '''return the cache key for a log. options is a string describing
+    anything which changes the data loaded from the log, such as a time
+    range'''
+    size = os.path.getsize(filename)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(('%u:%u:%s' % (FORMAT_VERSION, size, options)).encode())
+    with open(filename, 'rb') as f:
+        if size <= KEY_BLOCKS * KEY_BLOCK_SIZE:
+            h.update(f.read())
+        else:
+            step = (size - KEY_BLOCK_SIZE) // (KEY_BLOCKS - 1)
+            for i in range(KEY_BLOCKS):
+                f.seek(i * step)
+                h.update(f.read(KEY_BLOCK_SIZE))
+    return h.hexdigest()
+
+
+def is_number(v):
+    return isinstance(v, (int, float))
+
+
+class TypeBuilder(object):
+    '''accumulates the rows of one message type'''
+
+    def __init__(self, m):
+        self.fields = [f for f in m._fieldnames if is_number(getattr(m, f, None))]
+        self.instance_field = getattr(m, '_instance_field', None)
+        fmt = getattr(m, 'fmt', None)
+        if fmt is not None:
+            self.instance_field = getattr(fmt, 'instance_field', None)
+        if self.instance_field not in self.fields:
+            self.instance_field = None
+        self.data = array.array('d')
+
+    def add(self, m, order):
+        self.data.append(m._timestamp)
+        self.data.append(order)
+        values = [getattr(m, f, None) for f in self.fields]
+        try:
+            self.data.extend(values)
+        except TypeError:
+            self.data.extend([v if is_number(v) else np.nan for v in values])
+
+    def save(self, filename):
+        '''write the rows as a (FIELD_ROW+fields, count) array'''
+        ncols = FIELD_ROW + len(self.fields)
+        rows = np.frombuffer(self.data, dtype=np.float64).reshape(-1, ncols)
+        out = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64, shape=(ncols, len(rows)))
+        out[:] = rows.T
+        out.flush()
+        del out
+        return len(rows)
+
+
+class DataFlashType(object):
+    '''decodes all messages of one DataFlash format into arrays'''
+
+    def __init__(self, fmt):
+        from pymavlink import DFReader
+        self.fmt = fmt
+        self.fields = []
+        # (column in the decoded rows, array element or None, multiplier)
+        self.sources = []
+        names = []
+        formats = []
+        offsets = []
+        ofs = 0
+        for (i, c) in enumerate(fmt.msg_fmts):
+            s = DFReader.FORMAT_TO_STRUCT[c][0]
+            name = fmt.columns[i]
+            if c == 'a':
+                for j in range(DF_ARRAY_LENGTH):
+                    self.fields.append('%s[%u]' % (name, j))
+                    self.sources.append((name, j, None))
+                names.append(name)
+                formats.append(('<i2', (DF_ARRAY_LENGTH,)))
+                offsets.append(ofs)
+            elif s in DF_NUMPY_TYPES:
+                self.fields.append(name)
+                self.sources.append((name, None, fmt.msg_mults[i]))
+                names.append(name)
+                formats.append(DF_NUMPY_TYPES[s])
+                offsets.append(ofs)
+            ofs += struct.calcsize('<' + s)
+        self.length = ofs
+        self.dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': ofs})
+        self.instance_field = fmt.instance_field if fmt.instance_field in self.fields else None
+
+    def save(self, mlog, filename):
+        '''decode the messages from mlog into a (FIELD_ROW+fields, count) array file'''
+        data = np.frombuffer(mlog.data_map, dtype=np.uint8)
+        starts = np.array(mlog.offsets[self.fmt.type], dtype=np.int64)
+        # a message cut off by the end of the log is not read by DFReader
+        starts = starts[starts + 3 + self.length <= mlog.data_len]
+        offsets = starts + 3
+        count = len(offsets)
+        out = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64,
+                                        shape=(FIELD_ROW + len(self.fields), count))
+        out[ORDER_ROW] = starts
+        ramp = np.arange(self.length)
+        for start in range(0, count, DF_CHUNK):
+            end = min(start + DF_CHUNK, count)
+            rows = data[offsets[start:end, None] + ramp].view(self.dtype)[:, 0]
+            out[TIME_ROW, start:end] = mlog.clock.timebase + rows['TimeUS'] * 0.000001
+            for (i, (name, element, mult)) in enumerate(self.sources):
+                values = rows[name] if element is None else rows[name][:, element]
+                if mult is None:
+                    out[FIELD_ROW+i, start:end] = values
+                elif 0.0 < mult < 1.0:
+                    # divide as DFReader does, for the same rounding
+                    out[FIELD_ROW+i, start:end] = values / (1 / mult)
+                else:
+                    out[FIELD_ROW+i, start:end] = values * mult
+        out.flush()
+        del out
+        # the log can't be closed while there is a view of it
+        del data
+        return count
+
+
+def dataflash_types(mlog):
+    '''return list of DataFlashType for the message types of a log which
+    can be decoded into arrays, or None if it isn't a binary DataFlash
+    log with microsecond timestamps'''
+    try:
+        from pymavlink import DFReader
+    except ImportError:
+        return None
+    if (not isinstance(mlog, DFReader.DFReader_binary) or
+            not isinstance(mlog.clock, DFReader.DFReaderClock_usec)):
+        return None
+    ret = []
+    for fmt in mlog.formats.values():
+        if (fmt.name in SKIP_TYPES or len(mlog.offsets[fmt.type]) == 0 or
+                len(fmt.columns) == 0 or fmt.columns[0] != 'TimeUS'):
+            continue
+        t = DataFlashType(fmt)
+        if t.length != fmt.len - 3:
+            continue
+        ret.append(t)
+    return ret
+
+
+class LogCache(object):
+    '''the cached columns of one log'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_NAME)) as f:
+            self.index = json.load(f)
+        self.type_info = self.index['types']
+        self.arrays = {}
+
+    def __getstate__(self):
+        # memory maps are opened again after unpickling
+        state = self.__dict__.copy()
+        state['arrays'] = {}
+        return state
+
+    def key(self):
+        return os.path.basename(self.path)
+
+    def close(self):
+        '''drop the memory maps, which are opened again when used'''
+        self.arrays = {}
+
+    def types(self):
+        '''return list of cached message types'''
+        return sorted(self.type_info.keys())
+
+    def has_type(self, mtype):
+        return mtype in self.type_info
+
+    def fields(self, mtype):
+        '''return list of cached fields of a message type'''
+        info = self.type_info.get(mtype, None)
+        if info is None:
+            return []
+        return list(info['fields'])
+
+    def has_field(self, mtype, field):
+        info = self.type_info.get(mtype, None)
+        return info is not None and field in info['fields']
+
+    def instance_field(self, mtype):
+        '''return the instance field of a message type, or None'''
+        info = self.type_info.get(mtype, None)
+        if info is None:
+            return None
+        return info['instance_field']
+
+    def count(self, mtype):
+        info = self.type_info.get(mtype, None)
+        if info is None:
+            return 0
+        return info['count']
+
+    def data(self, mtype):
+        '''return the memory mapped array for a message type'''
+        a = self.arrays.get(mtype, None)
+        if a is None:
+            a = np.load(os.path.join(self.path, mtype + '.npy'), mmap_mode='r')
+            self.arrays[mtype] = a
+        return a
+
+    def times(self, mtype):
+        '''return array of the timestamps of a message type'''
+        return self.data(mtype)[TIME_ROW]
+
+    def order(self, mtype):
+        '''return array of the positions in the log of a message type'''
+        return self.data(mtype)[ORDER_ROW]
+
+    def column(self, mtype, field):
+        '''return array of the values of a field'''
+        return self.data(mtype)[FIELD_ROW + self.type_info[mtype]['fields'].index(field)]
+
+    def array_column(self, mtype, field):
+        '''return a (count, elements) array of the values of an array
+        field, or None if it isn't cached'''
+        fields = self.type_info[mtype]['fields']
+        name = '%s[0]' % field
+        if name not in fields:
+            return None
+        i = fields.index(name)
+        n = 1
+        while i + n < len(fields) and fields[i+n] == '%s[%u]' % (field, n):
+            n += 1
+        return self.data(mtype)[FIELD_ROW+i:FIELD_ROW+i+n].T
+
+    def columns(self, mtype):
+        '''return dictionary of arrays of all fields of a message type'''
+        a = self.data(mtype)
+        return dict([(f, a[FIELD_ROW+i]) for (i, f) in enumerate(self.type_info[mtype]['fields'])])
+
+    def instances(self, mtype):
+        '''return sorted list of the instance numbers of a message type'''
+        ifield = self.instance_field(mtype)
+        if ifield is None:
+            return []
+        return sorted(np.unique(self.column(mtype, ifield)).tolist())
+
+    def size(self):
+        '''return bytes used by the cache files'''
+        return sum([os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path)])
+
+
+def cache_path(key, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    return os.path.join(cache_dir, key)
+
+
+def load(filename, options='', cache_dir=None, key=None):
+    '''return the LogCache for a log, or None if it isn't cached'''
+    if key is None:
+        key = log_key(filename, options)
+    path = cache_path(key, cache_dir)
+    try:
+        cache = LogCache(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if cache.index.get('version', None) != FORMAT_VERSION:
+        return None
+    try:
+        # note the use for pruning
+        os.utime(os.path.join(path, INDEX_NAME))
+    except OSError:
+        pass
+    return cache
+
+
+def build(mlog, filename, options='', cache_dir=None, key=None, progress_callback=None):
+    '''convert a log opened with mavutil.mavlink_connection() into a
+    cache, returning the LogCache. The log is rewound before and after'''
+    if key is None:
+        key = log_key(filename, options)
+    path = cache_path(key, cache_dir)
+    tmp_path = path + '.tmp%u' % os.getpid()
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    types = {}
+    walk_types = None
+    df_types = dataflash_types(mlog)
+    if df_types is not None:
+        for (i, t) in enumerate(df_types):
+            count = t.save(mlog, os.path.join(tmp_path, t.fmt.name + '.npy'))
+            types[t.fmt.name] = {
+                'fields': t.fields,
+                'instance_field': t.instance_field,
+                'count': count,
+            }
+            if progress_callback is not None:
+                progress_callback(int(100 * (i+1) / len(df_types)))
+        # read the rest of the types from the log
+        walk_types = set([fmt.name for fmt in mlog.formats.values()
+                          if len(mlog.offsets[fmt.type]) > 0]) - set(types.keys()) - SKIP_TYPES
+
+    builders = {}
+    last_pct = -1
+    count = 0
+    # DataFlash messages are ordered by their offset, as the decoded types are
+    from pymavlink import DFReader
+    df_offsets = isinstance(mlog, DFReader.DFReader_binary)
+    mlog.rewind()
+    try:
+        while walk_types is None or len(walk_types) > 0:
+            m = mlog.recv_match(type=walk_types)
+            if m is None:
+                break
+            mtype = m.get_type()
+            b = builders.get(mtype, None)
+            if b is None:
+                if mtype in SKIP_TYPES:
+                    continue
+                b = TypeBuilder(m)
+                builders[mtype] = b
+            if df_offsets:
+                b.add(m, mlog.offset - m.fmt.len)
+            else:
+                b.add(m, count)
+            count += 1
+            if progress_callback is not None and walk_types is None:
+                pct = int(getattr(mlog, 'percent', 0))
+                if pct != last_pct:
+                    last_pct = pct
+                    progress_callback(pct)
+    finally:
+        mlog.rewind()
+
+    for (mtype, b) in builders.items():
+        count = b.save(os.path.join(tmp_path, mtype + '.npy'))
+        types[mtype] = {
+            'fields': b.fields,
+            'instance_field': b.instance_field,
+            'count': count,
+        }
+    index = {
+        'version': FORMAT_VERSION,
+        'filename': os.path.basename(filename),
+        'options': options,
+        'created': time.time(),
+        'types': types,
+    }
+    with open(os.path.join(tmp_path, INDEX_NAME), 'w') as f:
+        json.dump(index, f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process has just built it
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return LogCache(path)
+
+
+def open_cache(filename, mlog, options='', cache_dir=None, progress_callback=None):
+    '''return the LogCache for a log, building it if needed'''
+    key = log_key(filename, options)
+    cache = load(filename, options, cache_dir=cache_dir, key=key)
+    if cache is None:
+        cache = build(mlog, filename, options, cache_dir=cache_dir, key=key, progress_callback=progress_callback)
+        prune(cache_dir, keep=key)
+    return cache
+
+
+def prune(cache_dir=None, max_bytes=MAX_CACHE_BYTES, keep=None):
+    '''remove the least recently used logs until the cache is smaller
+    than max_bytes, never removing keep, which is a key or a collection
+    of keys'''
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    if keep is None or isinstance(keep, str):
+        keep = [keep]
+    entries = []
+    total = 0
+    for key in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, key)
+        if '.tmp' in key:
+            # left by a build which didn't finish
+            try:
+                if time.time() - os.path.getmtime(path) > 24*60*60:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+            continue
+        try:
+            used = os.path.getmtime(os.path.join(path, INDEX_NAME))
+            size = sum([os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)])
+        except OSError:
+            continue
+        entries.append((used, key, size))
+        total += size
+    for (used, key, size) in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key in keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
@@ -18,6 +18,8 @@ class MPModule(object):
         self.multi_instance = multi_instance
         self.multi_vehicle = multi_vehicle
         self.named_float_seq = 0
+        # message types passed to mavlink_packet(), None means all types
+        self.packet_types = None
 
         if description is None:
             self.description = name + " handling"
@@ -54,6 +56,17 @@ class MPModule(object):
     def mavlink_packet(self, packet):
         pass
 
+    def wants_packet_type(self, mtype):
+        '''return True if mavlink_packet() should be called for messages of type mtype'''
+        if type(self).mavlink_packet is MPModule.mavlink_packet:
+            # module does not handle packets at all
+            return False
+        return self.packet_types is None or mtype in self.packet_types
+
+    def wants_idle_task(self):
+        '''return True if idle_task() should be called from the main loop'''
+        return type(self).idle_task is not MPModule.idle_task
+
     #
     # Methods for subclass use
     #
@@ -155,6 +168,27 @@ class MPModule(object):
     def add_completion_function(self, name, callback):
         self.mpstate.completion_functions[name] = callback
 
+    def set_packet_types(self, types):
+        '''only pass messages with a type in types to mavlink_packet(). Use
+        None to receive all message types'''
+        if types is not None:
+            types = frozenset(types)
+        self.packet_types = types
+        self.mpstate.packet_dispatch_changed()
+
+    def add_periodic_task(self, callback, frequency, name=None):
+        '''call callback() at frequency Hz from the main loop, returning
+        the task. This is cheaper than checking a periodic_event in
+        idle_task() as the main loop only wakes for tasks which are due.
+        Tasks are removed automatically when the module is unloaded'''
+        if name is None:
+            name = "%s.%s" % (self.name, getattr(callback, '__name__', 'task'))
+        return self.mpstate.scheduler.add(callback, frequency, name=name, owner=self)
+
+    def remove_periodic_task(self, task):
+        '''stop a task added with add_periodic_task()'''
+        self.mpstate.scheduler.remove(task)
+
     def flyto_frame_units(self):
         '''return a frame string and unit'''
         return "%s %s" % (self.settings.height_unit, self.settings.flytoframe)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+'''
+bounded send queues for MAVProxy outputs
+
+Messages for an output are added to its queue while processing the
+vehicle link, and written by the main loop. Stream sockets are written
+without blocking, keeping any partly sent data for the next pass, so a
+slow consumer only fills its own queue. When a queue is full its policy
+decides what is lost:
+
+  drop-oldest   : discard the oldest queued messages
+  drop-priority : discard the oldest messages other than PRIORITY_TYPES
+  disconnect    : drop the client connection and everything queued
+
+Each output can also have lists of allowed and blocked message types,
+and a maximum rate for each message type, enforced with a token bucket
+per message ID.
+
+AP_FLAKE8_CLEAN
+'''
+
+import collections
+import fnmatch
+import socket
+import time
+
+from pymavlink import mavutil
+
+try:
+    from wsproto.connection import ConnectionState
+    from wsproto.events import BytesMessage
+except ImportError:
+    ConnectionState = None
+    BytesMessage = None
+
+POLICIES = ['drop-oldest', 'drop-priority', 'disconnect']
+
+# message types kept by the drop-priority policy
+PRIORITY_TYPES = ['HEARTBEAT', 'COMMAND_ACK']
+PRIORITY_MSGIDS = set([mavutil.mavlink.MAVLINK_MSG_ID_HEARTBEAT,
+                       mavutil.mavlink.MAVLINK_MSG_ID_COMMAND_ACK])
+
+# maximum bytes passed to one send() call
+SEND_SIZE = 65536
+
+# rate limited message types may send a burst of this many seconds of
+# messages, so jitter in the incoming rate doesn't lose extra messages
+BURST_TIME = 0.5
+
+
+def type_msgids(patterns):
+    '''return the set of message IDs matching a list of message type
+    names, which may include wildcards'''
+    ret = set()
+    for (msgid, mtype) in mavutil.mavlink.mavlink_map.items():
+        for p in patterns:
+            if fnmatch.fnmatch(mtype.msgname, p.upper()):
+                ret.add(msgid)
+                break
+    return ret
+
+
+class OutputQueue(object):
+    '''send queue for one output connection'''
+
+    def __init__(self, conn, max_bytes=256*1024, policy='drop-oldest'):
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy %s" % policy)
+        self.conn = conn
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # per-output settings, overriding the global defaults
+        self.options = {}
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        # unsent part of data already started on a stream socket
+        self.pending = None
+        self.pending_port = None
+        # message filtering, see set_filter()
+        self.filtering = False
+        self.allow = None
+        self.block = set()
+        self.rates = {}
+        self.buckets = {}
+
+        # statistics
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.high_water = 0
+        self.disconnects = 0
+        self.filtered = 0
+        self.rate_limited = 0
+
+    def set_filter(self, allow=None, block=None, rates=None):
+        '''set the message IDs to send. allow is a set of message IDs or
+        None for all, block a set of message IDs not to send, and rates
+        a dictionary of maximum rates in Hz by message ID'''
+        self.allow = allow
+        self.block = block if block is not None else set()
+        self.rates = rates if rates is not None else {}
+        now = time.monotonic()
+        self.buckets = {}
+        for (msgid, rate) in self.rates.items():
+            self.buckets[msgid] = [self.burst(rate), now]
+        self.filtered = 0
+        self.rate_limited = 0
+        self.filtering = allow is not None or len(self.block) > 0 or len(self.rates) > 0
+
+    def burst(self, rate):
+        '''token bucket size for a rate'''
+        return max(1.0, rate * BURST_TIME)
+
+    def accept(self, msgid):
+        '''return True if a message with ID msgid passes the filters'''
+        if (self.allow is not None and msgid not in self.allow) or msgid in self.block:
+            self.filtered += 1
+            return False
+        rate = self.rates.get(msgid, None)
+        if rate is None:
+            return True
+        bucket = self.buckets[msgid]
+        now = time.monotonic()
+        tokens = min(bucket[0] + (now - bucket[1]) * rate, self.burst(rate))
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            self.rate_limited += 1
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def ready(self):
+        '''return False if the output can't take messages yet'''
+        if hasattr(self.conn, 'listen') and getattr(self.conn, 'port', None) is None:
+            # a server with no client
+            return False
+        ws = getattr(self.conn, 'ws', None)
+        if ws is not None and ConnectionState is not None and ws.state != ConnectionState.OPEN:
+            # websocket handshake not done
+            return False
+        return True
+
+    def put(self, msgid, buf):
+        '''queue the frame buf of a message with ID msgid'''
+        if self.filtering and not self.accept(msgid):
+            return
+        if not self.ready():
+            return
+        n = len(buf)
+        if self.queued_bytes + n > self.max_bytes and not self.make_room(msgid, n):
+            self.dropped += 1
+            self.dropped_bytes += n
+            return
+        self.queue.append((msgid, buf))
+        self.queued_bytes += n
+        if self.queued_bytes > self.high_water:
+            self.high_water = self.queued_bytes
+
+    def _drop(self, msgid, buf):
+        self.queued_bytes -= len(buf)
+        self.dropped += 1
+        self.dropped_bytes += len(buf)
+
+    def make_room(self, msgid, n):
+        '''apply the queue policy to make room for n bytes. Returns False
+        if the new message should be dropped'''
+        queue = self.queue
+        if self.policy == 'disconnect':
+            self.disconnect()
+            return False
+        if self.policy == 'drop-oldest':
+            while len(queue) > 0 and self.queued_bytes + n > self.max_bytes:
+                self._drop(*queue.popleft())
+            return True
+        # drop-priority: discard the oldest normal messages first
+        kept = []
+        while len(queue) > 0 and self.queued_bytes + n > self.max_bytes:
+            (m, buf) = queue.popleft()
+            if m in PRIORITY_MSGIDS:
+                kept.append((m, buf))
+            else:
+                self._drop(m, buf)
+        queue.extendleft(reversed(kept))
+        if self.queued_bytes + n <= self.max_bytes:
+            return True
+        if msgid not in PRIORITY_MSGIDS:
+            return False
+        # only priority messages are queued, drop the oldest of them
+        while len(queue) > 0 and self.queued_bytes + n > self.max_bytes:
+            self._drop(*queue.popleft())
+        return True
+
+    def stream_socket(self):
+        '''return the connected stream socket of the output, or None'''
+        port = getattr(self.conn, 'port', None)
+        if isinstance(port, socket.socket) and port.type == socket.SOCK_STREAM:
+            return port
+        return None
+
+    def next_data(self):
+        '''take up to SEND_SIZE bytes of frames from the queue'''
+        ws = getattr(self.conn, 'ws', None)
+        bufs = []
+        total = 0
+        while len(self.queue) > 0 and total < SEND_SIZE:
+            (msgid, buf) = self.queue.popleft()
+            self.queued_bytes -= len(buf)
+            self.sent += 1
+            total += len(buf)
+            if ws is not None and BytesMessage is not None:
+                buf = ws.send(BytesMessage(data=buf))
+            bufs.append(buf)
+        return memoryview(b''.join(bufs))
+
+    def drain(self):
+        '''write as much as possible without blocking. Returns True if
+        everything queued has been written'''
+        if self.pending is None and len(self.queue) == 0:
+            return True
+        sock = self.stream_socket()
+        if sock is None:
+            # datagram and serial outputs, let pymavlink write each frame
+            self.pending = None
+            while len(self.queue) > 0:
+                (msgid, buf) = self.queue.popleft()
+                self.queued_bytes -= len(buf)
+                self.conn.write(buf)
+                self.sent += 1
+                self.sent_bytes += len(buf)
+            return True
+        if self.pending is not None and sock is not self.pending_port:
+            # a new client, it must start at a frame boundary
+            self.pending = None
+        while True:
+            if self.pending is None:
+                if len(self.queue) == 0:
+                    return True
+                self.pending = self.next_data()
+                self.pending_port = sock
+            try:
+                n = sock.send(self.pending)
+            except (BlockingIOError, InterruptedError):
+                return False
+            except OSError:
+                self.disconnect()
+                return True
+            self.sent_bytes += n
+            if n < len(self.pending):
+                self.pending = self.pending[n:]
+                return False
+            self.pending = None
+
+    def disconnect(self):
+        '''drop the client connection of the output and all queued data'''
+        self.disconnects += 1
+        while len(self.queue) > 0:
+            self._drop(*self.queue.popleft())
+        self.pending = None
+        conn = self.conn
+        if getattr(conn, 'port', None) is None:
+            return
+        if hasattr(conn, 'close_port'):
+            # websocket server
+            conn.close_port()
+        elif hasattr(conn, 'listen'):
+            # TCP server, wait for a new client
+            conn.port.close()
+            conn.port = None
+            conn.fd = conn.listen.fileno()
+        elif hasattr(conn, 'handle_disconnect'):
+            # TCP client, reconnect
+            conn.handle_disconnect()
+
+    def stats(self):
+        '''return dictionary of queue statistics'''
+        queued = self.queued_bytes
+        if self.pending is not None:
+            queued += len(self.pending)
+        return {
+            'policy': self.policy,
+            'max_bytes': self.max_bytes,
+            'queued': len(self.queue),
+            'queued_bytes': queued,
+            'high_water': self.high_water,
+            'sent': self.sent,
+            'sent_bytes': self.sent_bytes,
+            'dropped': self.dropped,
+            'dropped_bytes': self.dropped_bytes,
+            'disconnects': self.disconnects,
+            'filtered': self.filtered,
+            'rate_limited': self.rate_limited,
+        }
+
+
+def output_queue(conn, max_bytes=256*1024, policy='drop-oldest'):
+    '''return the queue for an output connection, creating it if needed'''
+    q = getattr(conn, 'out_queue', None)
+    if q is None:
+        q = OutputQueue(conn, max_bytes=max_bytes, policy=policy)
+        conn.out_queue = q
+    return q
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+'''
+performance statistics for the MAVProxy main loop and module callbacks
+
+AP_FLAKE8_CLEAN
+'''
+
+import json
+import math
+import time
+
+# high resolution clock used for all timing
+clock = time.perf_counter
+
+
+class PerfStat(object):
+    '''call count, cumulative time and latency histogram for one callback'''
+
+    # each histogram bucket covers a factor of sqrt(2) in latency,
+    # starting at 1 microsecond. 48 buckets reaches ~16 seconds
+    nbuckets = 48
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.nbuckets
+
+    def add(self, dt):
+        '''add one call which took dt seconds'''
+        self.count += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+        if dt <= 1.0e-6:
+            idx = 0
+        else:
+            idx = min(int(2 * math.log2(dt * 1.0e6)), self.nbuckets - 1)
+        self.buckets[idx] += 1
+
+    def mean(self):
+        '''mean call time in seconds'''
+        if self.count == 0:
+            return 0
+        return self.total / self.count
+
+    def percentile(self, pct):
+        '''return approximate time in seconds below which pct percent of calls completed'''
+        if self.count == 0:
+            return 0
+        threshold = self.count * pct * 0.01
+        n = 0
+        for i in range(self.nbuckets):
+            n += self.buckets[i]
+            if n >= threshold:
+                # use the upper edge of the bucket
+                return min(2 ** ((i + 1) * 0.5) * 1.0e-6, self.max)
+        return self.max
+
+    def to_dict(self):
+        '''return stats as a dictionary suitable for JSON'''
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class PerfStats(object):
+    '''collection of PerfStat objects keyed by (category, name)
+
+    categories used by MAVProxy are:
+      mavlink_packet : per-module mavlink_packet() calls
+      idle_task      : per-module idle_task() calls
+      periodic       : scheduled periodic task calls
+      msgtype        : total processing cost of each received message type
+      main_loop      : main loop iteration, select() and periodic task times
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        self.start_time = time.time()
+        self.last_dump = time.time()
+
+    def add(self, category, name, dt):
+        '''record a call of dt seconds'''
+        key = (category, name)
+        s = self.stats.get(key, None)
+        if s is None:
+            s = PerfStat()
+            self.stats[key] = s
+        s.add(dt)
+
+    def reset(self):
+        '''discard all statistics'''
+        self.stats = {}
+        self.start_time = time.time()
+
+    def categories(self):
+        '''return sorted list of categories with data'''
+        return sorted(set([c for (c, n) in self.stats.keys()]))
+
+    def show(self, f, category=None):
+        '''write a table of statistics to f, busiest first'''
+        elapsed = time.time() - self.start_time
+        f.write("Stats over %.1fs (%s)\n" % (elapsed, "enabled" if self.enabled else "disabled"))
+        for c in self.categories():
+            if category is not None and c != category:
+                continue
+            f.write("%-14s %-26s %9s %8s %5s %9s %9s %9s %9s\n" % (
+                c, "name", "count", "total", "load", "mean(us)", "p50(us)", "p99(us)", "max(us)"))
+            keys = [k for k in self.stats.keys() if k[0] == c]
+            keys = sorted(keys, key=lambda k: self.stats[k].total, reverse=True)
+            for k in keys:
+                s = self.stats[k]
+                load = 0
+                if elapsed > 0:
+                    load = 100.0 * s.total / elapsed
+                f.write("%-14s %-26s %9u %8.3f %4.1f%% %9.1f %9.1f %9.1f %9.1f\n" % (
+                    '', k[1], s.count, s.total, load,
+                    s.mean() * 1.0e6, s.percentile(50) * 1.0e6, s.percentile(99) * 1.0e6, s.max * 1.0e6))
+
+    def to_dict(self):
+        '''return all statistics as a dictionary suitable for JSON'''
+        ret = {
+            'time': time.time(),
+            'start_time': self.start_time,
+            'stats': {},
+        }
+        for (c, n) in sorted(self.stats.keys()):
+            if c not in ret['stats']:
+                ret['stats'][c] = {}
+            ret['stats'][c][n] = self.stats[(c, n)].to_dict()
+        return ret
+
+    def dump_json(self, filename, append=True):
+        '''write statistics as one line of JSON to filename'''
+        with open(filename, mode='a' if append else 'w') as f:
+            f.write(json.dumps(self.to_dict()) + "\n")
+        self.last_dump = time.time()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+'''
+replay link, feeding the frames of a telemetry log to MAVProxy as
+though they came from a vehicle
+
+A link is given as replay:FILENAME?OPTIONS, where OPTIONS are separated
+by & and may be:
+
+  speed=N : replay at N times the original speed. 0 means as fast as
+            MAVProxy can take the data. Default 1
+  loop=1  : start again at the end of the log
+  link=N  : only replay messages received on link N
+  sent=1  : also replay messages MAVProxy sent. MAVProxy stores the
+            link number in the bottom 2 bits of tlog timestamps, using
+            3 for messages it sent, which are skipped by default
+
+For example:
+  mavproxy.py --master replay:flight.tlog?speed=20&loop=1
+
+A worker thread writes each frame into one of a pair of connected
+sockets when it is due, so the main loop waits on the other as it would
+on a network link. Sockets rather than a pipe are used as Windows can
+only select on sockets. With speed=0 the socket buffer fills and the
+worker waits for the main loop to catch up.
+
+AP_FLAKE8_CLEAN
+'''
+
+import select
+import socket
+import struct
+import threading
+import time
+
+from pymavlink import mavutil
+
+# wall clock time to batch frames into one socket write
+BATCH_TIME = 0.001
+
+
+def parse_device(device):
+    '''parse FILENAME?OPTIONS into (filename, options dictionary)'''
+    options = {'speed': 1.0, 'loop': False, 'link': None, 'sent': False}
+    if '?' not in device:
+        return (device, options)
+    (filename, opts) = device.split('?', 1)
+    for opt in opts.split('&'):
+        if opt == '':
+            continue
+        (name, eq, value) = opt.partition('=')
+        if name not in options:
+            raise ValueError("Unknown replay option %s" % name)
+        if name == 'speed':
+            options[name] = float(value)
+        elif name == 'link':
+            options[name] = int(value)
+        else:
+            options[name] = value in ['1', 'true', 'True', '']
+    return (filename, options)
+
+
+def read_records(data, link=None, sent=False):
+    '''return list of (timestamp, frame) for records in tlog data'''
+    ret = []
+    ofs = 0
+    n = len(data)
+    v1 = mavutil.mavlink.PROTOCOL_MARKER_V1
+    v2 = mavutil.mavlink.PROTOCOL_MARKER_V2
+    while ofs + 8 + 8 <= n:
+        marker = data[ofs+8]
+        if marker == v2:
+            flen = 12 + data[ofs+9]
+            if data[ofs+10] & mavutil.mavlink.MAVLINK_IFLAG_SIGNED:
+                flen += mavutil.mavlink.MAVLINK_SIGNATURE_BLOCK_LEN
+        elif marker == v1:
+            flen = 8 + data[ofs+9]
+        else:
+            # not a tlog record, resync
+            ofs += 1
+            continue
+        if ofs + 8 + flen > n:
+            break
+        usec = struct.unpack_from('>Q', data, ofs)[0]
+        linknum = usec & 3
+        if (link is None or linknum == link) and (sent or linknum != 3):
+            ret.append((usec * 1.0e-6, data[ofs+8:ofs+8+flen]))
+        ofs += 8 + flen
+    return ret
+
+
+class ReplayLink(mavutil.mavfile):
+    '''a MAVLink connection replaying a telemetry log'''
+
+    def __init__(self, device, source_system=255, source_component=0):
+        (self.filename, options) = parse_device(device)
+        self.speed = options['speed']
+        self.loop = options['loop']
+        with open(self.filename, 'rb') as f:
+            self.records = read_records(f.read(), link=options['link'], sent=options['sent'])
+        if len(self.records) == 0:
+            raise ValueError("No messages to replay in %s" % self.filename)
+        (self.notify_sock, self.wake_sock) = socket.socketpair()
+        self.notify_sock.setblocking(False)
+        self.wake_sock.setblocking(False)
+        mavutil.mavfile.__init__(self, self.notify_sock.fileno(), "replay:" + device,
+                                 source_system=source_system, source_component=source_component)
+        self.port = self
+        self.closing = False
+        self.replayed = 0
+        self.passes = 0
+        self.thread = threading.Thread(target=self.replay_thread, name='replay %s' % self.filename)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def replay_thread(self):
+        '''write frames into the socket as they become due'''
+        while not self.closing:
+            start = time.monotonic()
+            t0 = self.records[0][0]
+            i = 0
+            n = len(self.records)
+            while i < n and not self.closing:
+                # gather all frames due in the next BATCH_TIME
+                now = time.monotonic()
+                batch = []
+                while i < n:
+                    (t, frame) = self.records[i]
+                    if self.speed > 0 and start + (t - t0) / self.speed > now + BATCH_TIME:
+                        break
+                    batch.append(frame)
+                    i += 1
+                    if len(batch) >= 512:
+                        break
+                if len(batch) == 0:
+                    (t, frame) = self.records[i]
+                    time.sleep(max(start + (t - t0) / self.speed - now, 0))
+                    continue
+                self.write_frames(b''.join(batch))
+                self.replayed += len(batch)
+            self.passes += 1
+            elapsed = time.monotonic() - start
+            print("Replayed %u messages from %s in %.1fs (%.0f msgs/s)" % (
+                n, self.filename, elapsed, n / max(elapsed, 1.0e-6)))
+            if not self.loop:
+                return
+
+    def write_frames(self, data):
+        '''write all of data into the socket, waiting while it is full'''
+        view = memoryview(data)
+        while len(view) > 0 and not self.closing:
+            (rin, win, xin) = select.select([], [self.wake_sock], [], 0.1)
+            if not win:
+                continue
+            try:
+                n = self.wake_sock.send(view)
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+            view = view[n:]
+
+    def recv(self, n=None):
+        if n is None:
+            n = self.mav.bytes_needed()
+        try:
+            return self.notify_sock.recv(n)
+        except (BlockingIOError, OSError):
+            return b''
+
+    def write(self, buf):
+        '''there is no vehicle to send to'''
+        return len(buf)
+
+    def inWaiting(self):
+        return 0
+
+    def close(self):
+        self.closing = True
+        self.thread.join(timeout=1)
+        for sock in [self.notify_sock, self.wake_sock]:
+            try:
+                sock.close()
+            except OSError:
+                pass
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+'''
+routing table choosing the link to send on for each system ID
+
+Routes are updated as HEARTBEATs arrive and once a second from the link
+quality statistics (see mp_linkstats), so finding the link for a system
+ID is a dictionary lookup. A link is only used for a system ID if it has
+received a HEARTBEAT from it within STALE_TIME and is not down. Of those
+the link with the lowest cost is chosen, where the cost is the recent
+transit time relative to the fastest link plus LOSS_COST times the
+recent loss rate. The route only moves to another link when that is
+better by more than HYSTERESIS, so it doesn't flap between links of
+similar quality.
+
+AP_FLAKE8_CLEAN
+'''
+
+import time
+
+# seconds without a HEARTBEAT before a link is not used for a system ID
+STALE_TIME = 3.0
+
+# cost of losing all packets, in seconds of transit time
+LOSS_COST = 2.0
+
+# how much lower the cost of a link must be to move a route to it
+HYSTERESIS = 0.05
+
+
+class RoutingTable(object):
+    '''best link for each system ID'''
+
+    def __init__(self, stale_time=STALE_TIME, loss_cost=LOSS_COST, hysteresis=HYSTERESIS):
+        self.stale_time = stale_time
+        self.loss_cost = loss_cost
+        self.hysteresis = hysteresis
+        # sysid -> link
+        self.routes = {}
+        # sysid -> {link: time of last HEARTBEAT}
+        self.heartbeats = {}
+        self.changes = 0
+
+    def route(self, sysid):
+        '''return the link to send to sysid on, or None'''
+        return self.routes.get(sysid, None)
+
+    def heartbeat(self, sysid, link, now=None):
+        '''note a HEARTBEAT from sysid received on link'''
+        if now is None:
+            now = time.time()
+        links = self.heartbeats.get(sysid, None)
+        if links is None:
+            links = {}
+            self.heartbeats[sysid] = links
+        links[link] = now
+        current = self.routes.get(sysid, None)
+        if current is None:
+            self.routes[sysid] = link
+        elif current is not link and not self.usable(sysid, current, now):
+            # the current route has gone quiet, don't wait for update()
+            self.set_route(sysid, link)
+
+    def usable(self, sysid, link, now):
+        '''return True if link can be used to send to sysid'''
+        if getattr(link, 'linkerror', False):
+            return False
+        t = self.heartbeats[sysid].get(link, None)
+        return t is not None and now - t <= self.stale_time
+
+    def set_route(self, sysid, link):
+        self.routes[sysid] = link
+        self.changes += 1
+
+    def link_quality(self, sysid, link):
+        '''return (transit, loss) for sysid on link. transit is None if unknown'''
+        stats = getattr(link, 'link_stats', None)
+        if stats is None:
+            return (None, 0.0)
+        # use the component we receive most from, normally the autopilot
+        best = None
+        for ((s, compid), source) in stats.sources.items():
+            if s == sysid and (best is None or source.packets > best.packets):
+                best = source
+        if best is None:
+            return (None, 0.0)
+        return (best.transit(), best.recent_loss_rate())
+
+    def costs(self, sysid, links):
+        '''return dictionary of costs of sending to sysid by link'''
+        quality = {}
+        for link in links:
+            quality[link] = self.link_quality(sysid, link)
+        transits = [t for (t, loss) in quality.values() if t is not None]
+        min_transit = min(transits) if len(transits) > 0 else 0
+        ret = {}
+        for (link, (transit, loss)) in quality.items():
+            cost = loss * self.loss_cost
+            if transit is not None:
+                cost += transit - min_transit
+            ret[link] = cost
+        return ret
+
+    def update(self, now=None):
+        '''choose the best link for every system ID'''
+        if now is None:
+            now = time.time()
+        for (sysid, links) in self.heartbeats.items():
+            current = self.routes.get(sysid, None)
+            usable = [link for link in links if self.usable(sysid, link, now)]
+            if len(usable) == 0:
+                # nothing is good, use the last link heard from
+                best = max(links, key=lambda link: links[link])
+                if best is not current:
+                    self.set_route(sysid, best)
+                continue
+            costs = self.costs(sysid, usable)
+            best = min(usable, key=lambda link: costs[link])
+            if current not in costs or costs[best] + self.hysteresis < costs[current]:
+                if best is not current:
+                    self.set_route(sysid, best)
+
+    def remove_link(self, link):
+        '''forget a link which has been closed'''
+        for sysid in list(self.heartbeats.keys()):
+            links = self.heartbeats[sysid]
+            links.pop(link, None)
+            if len(links) == 0:
+                del self.heartbeats[sysid]
+                self.routes.pop(sysid, None)
+            elif self.routes.get(sysid, None) is link:
+                self.routes[sysid] = max(links, key=lambda x: links[x])
+        self.update()
+
+    def show(self):
+        '''return list of (sysid, link) routes'''
+        return sorted(self.routes.items(), key=lambda x: x[0])
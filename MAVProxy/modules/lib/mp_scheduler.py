@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+'''
+periodic task scheduler for the MAVProxy main loop
+
+Tasks are kept in a heap ordered by deadline so that each main loop
+pass only runs the tasks which are due, and the main loop can sleep
+until the next deadline.
+
+AP_FLAKE8_CLEAN
+'''
+
+import heapq
+import time
+
+from MAVProxy.modules.lib import mp_perf
+
+
+class PeriodicTask(object):
+    '''a callback to be called at a fixed frequency'''
+
+    def __init__(self, callback, frequency, name, owner=None):
+        self.callback = callback
+        self.name = name
+        self.owner = owner
+        self.active = True
+        self.deadline = 0
+        self.set_frequency(frequency)
+
+    def set_frequency(self, frequency):
+        '''change the task frequency in Hz, applied from the next call'''
+        self.frequency = frequency
+        self.period = 1.0 / frequency
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+class MPScheduler(object):
+    '''run PeriodicTask callbacks when they are due'''
+
+    def __init__(self):
+        self.heap = []
+        # called with (task, exception) if a task raises an exception
+        self.error_callback = None
+
+    def add(self, callback, frequency, name=None, owner=None, run_now=False):
+        '''add a task calling callback() at frequency Hz, returning the task'''
+        if name is None:
+            name = getattr(callback, '__name__', str(callback))
+        task = PeriodicTask(callback, frequency, name, owner=owner)
+        task.deadline = time.monotonic()
+        if not run_now:
+            task.deadline += task.period
+        heapq.heappush(self.heap, task)
+        return task
+
+    def remove(self, task):
+        '''stop a task running. It is dropped from the heap when next due'''
+        task.active = False
+
+    def remove_owner(self, owner):
+        '''stop all tasks belonging to owner'''
+        for task in self.heap:
+            if task.owner is owner:
+                task.active = False
+
+    def tasks(self):
+        '''return list of active tasks, soonest first'''
+        return sorted([t for t in self.heap if t.active])
+
+    def time_to_next(self):
+        '''return seconds until the next task is due'''
+        while len(self.heap) > 0 and not self.heap[0].active:
+            heapq.heappop(self.heap)
+        if len(self.heap) == 0:
+            return 1.0
+        return max(self.heap[0].deadline - time.monotonic(), 0)
+
+    def run(self, perf=None):
+        '''run all tasks which are due. If perf is enabled record task times'''
+        now = time.monotonic()
+        while len(self.heap) > 0 and self.heap[0].deadline <= now:
+            task = heapq.heappop(self.heap)
+            if not task.active:
+                continue
+            try:
+                if perf is not None and perf.enabled:
+                    t0 = mp_perf.clock()
+                    task.callback()
+                    perf.add('periodic', task.name, mp_perf.clock() - t0)
+                else:
+                    task.callback()
+            except Exception as ex:
+                if self.error_callback is not None:
+                    self.error_callback(task, ex)
+            # reschedule, skipping any periods we have missed
+            task.deadline += task.period
+            if task.deadline <= now:
+                task.deadline = now + task.period
+            if task.active:
+                heapq.heappush(self.heap, task)
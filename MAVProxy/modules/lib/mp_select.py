@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+'''
+persistent file descriptor registry for the MAVProxy main loop, using
+the best available selectors implementation (epoll on Linux)
+
+AP_FLAKE8_CLEAN
+'''
+
+import selectors
+import time
+
+
+class MPSelector(object):
+    '''map file descriptors to handler functions, keeping registrations
+    with the OS between main loop iterations'''
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        # fd -> (handler, arg, port)
+        self.handlers = {}
+
+    def want(self, fd, handler, arg, port=None):
+        '''make sure fd is registered to call handler(arg) when readable.
+        port is the object owning fd; if it changes (for example on a
+        reconnect which reuses the same fd number) fd is re-registered'''
+        h = self.handlers.get(fd, None)
+        if h is not None:
+            if h[0] == handler and h[1] == arg and h[2] is port:
+                return True
+            self.unregister(fd)
+        try:
+            self.selector.register(fd, selectors.EVENT_READ, (handler, arg))
+        except (ValueError, OSError, KeyError):
+            return False
+        self.handlers[fd] = (handler, arg, port)
+        return True
+
+    def unregister(self, fd):
+        '''remove fd from the registry'''
+        if fd not in self.handlers:
+            return
+        self.handlers.pop(fd)
+        try:
+            self.selector.unregister(fd)
+        except (ValueError, OSError, KeyError):
+            pass
+
+    def prune(self, wanted):
+        '''unregister all fds not in the set wanted'''
+        for fd in list(self.handlers.keys()):
+            if fd not in wanted:
+                self.unregister(fd)
+
+    def select(self, timeout):
+        '''wait for up to timeout seconds, returning a list of (fd, handler, arg)
+        for readable file descriptors'''
+        if len(self.handlers) == 0:
+            # some platforms don't allow select on an empty set
+            time.sleep(timeout)
+            return []
+        ret = []
+        for (key, mask) in self.selector.select(timeout):
+            (handler, arg) = key.data
+            ret.append((key.fd, handler, arg))
+        return ret
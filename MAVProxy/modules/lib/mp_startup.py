@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+'''
+startup timing for MAVProxy
+
+Records the time taken by each phase of startup, the import and init
+time of each module, and when the first HEARTBEAT arrives, for
+mavproxy.py --startup-profile. Module imports can also be done in
+parallel threads ahead of the modules being initialised, which helps
+when imports are limited by a slow disk.
+
+AP_FLAKE8_CLEAN
+'''
+
+import importlib
+import threading
+import time
+
+clock = time.perf_counter
+
+# when this module was first imported, which mavproxy.py does before its
+# other imports
+START = clock()
+
+# threads used to import modules ahead of loading them
+PREFETCH_THREADS = 4
+
+
+class StartupProfile(object):
+    '''times of the phases of startup'''
+
+    def __init__(self, start=START):
+        self.start = start
+        self.last = self.start
+        self.phases = []
+        # module name -> [import time, init time]
+        self.modules = {}
+        self.first_heartbeat = None
+        self.reported = False
+
+    def phase(self, name):
+        '''mark the end of a phase of startup'''
+        now = clock()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def module(self, name, import_time, init_time):
+        '''record the time taken to load a module'''
+        self.modules[name] = [import_time, init_time]
+
+    def heartbeat(self):
+        '''note the arrival of a HEARTBEAT'''
+        if self.first_heartbeat is None:
+            self.first_heartbeat = clock() - self.start
+
+    def report(self, f):
+        '''write the profile to file object f'''
+        f.write("Startup profile:\n")
+        for (name, t) in self.phases:
+            f.write("  %-28s %7.3fs\n" % (name, t))
+        f.write("  %-28s %7.3fs\n" % ("total", self.last - self.start))
+        if len(self.modules) > 0:
+            f.write("  %-20s %8s %8s\n" % ("module", "import", "init"))
+            for (name, (import_time, init_time)) in sorted(self.modules.items(),
+                                                           key=lambda x: -(x[1][0] + x[1][1])):
+                f.write("  %-20s %7.3fs %7.3fs\n" % (name, import_time, init_time))
+        self.reported = True
+
+    def report_heartbeat(self, f):
+        if self.first_heartbeat is not None:
+            f.write("First HEARTBEAT %.3fs after start\n" % self.first_heartbeat)
+
+
+def prefetch_modules(modpaths):
+    '''import modules in background threads, so a later import finds
+    them loaded. Import errors are ignored, they are reported when the
+    module is loaded. Returns the threads'''
+    pending = list(modpaths)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if len(pending) == 0:
+                    return
+                modpath = pending.pop(0)
+            try:
+                importlib.import_module(modpath)
+            except Exception:
+                pass
+
+    threads = []
+    for i in range(min(PREFETCH_THREADS, len(pending))):
+        t = threading.Thread(target=worker, name='prefetch')
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    return threads
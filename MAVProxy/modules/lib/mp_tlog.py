@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+'''
+buffered telemetry log writer
+
+Records are packed straight into a pool of preallocated chunks by the
+caller, and a writer thread writes complete chunks with vectored
+writes. Chunks only ever hold whole records, so the log can be rotated
+at any chunk boundary and every segment is a normal tlog.
+
+If compression is enabled each write is a separate gzip member, so a
+segment can be decompressed with gunzip (or gzip.open) to a normal
+tlog, and a crash only loses the data which had not yet been written.
+
+Uncompressed tlogs also get a sidecar index, see mp_tlogindex.
+
+AP_FLAKE8_CLEAN
+'''
+
+import os
+import struct
+import threading
+import time
+import zlib
+
+from MAVProxy.modules.lib import mp_tlogindex
+
+FSYNC_POLICIES = ['none', 'flush', 'rotate']
+
+# maximum buffers per writev() call
+IOV_MAX = 1024
+
+
+def segment_filename(filename, n):
+    '''return the filename of segment n of a rotated log. The first
+    segment uses filename, later segments insert the segment number
+    before the .tlog extension, so flight.tlog becomes flight.2.tlog
+    and flight.tlog.raw becomes flight.2.tlog.raw'''
+    if n <= 1:
+        return filename
+    i = filename.rfind('.tlog')
+    if i == -1:
+        return "%s.%u" % (filename, n)
+    return "%s.%u%s" % (filename[:i], n, filename[i:])
+
+
+class TLogWriter(object):
+    '''write a telemetry log from a background thread'''
+
+    def __init__(self, filename, append=False, compress=False, index=False, chunk_size=65536, nchunks=8):
+        self.base_filename = filename
+        self.append = append
+        self.index = index
+        if index:
+            chunk_size = min(chunk_size, mp_tlogindex.MAX_BLOCK_SIZE)
+        self.chunk_size = chunk_size
+        self.cond = threading.Condition()
+        self.free = [bytearray(chunk_size) for i in range(nchunks)]
+        # keep at most this many unused chunks after a burst
+        self.max_free = nchunks * 4
+        self.full = []
+        self.cur = self.free.pop()
+        self.cur_len = 0
+        # index data for the current chunk
+        self.cur_first = None
+        self.cur_last = None
+        self.cur_offsets = {}
+        self.closing = False
+        self.flush_requested = False
+
+        # policy, changed with set_policy()
+        self.flush_period = 10.0
+        self.rotate_size = 0
+        self.rotate_time = 0
+        self.fsync = 'none'
+        self.compress = compress
+
+        # statistics
+        self.records = 0
+        self.bytes_written = 0
+        self.writes = 0
+        self.chunks_allocated = nchunks
+
+        self.fd = None
+        self.idx_f = None
+        self.segment = 0
+        self.filename = None
+        self.file_size = 0
+        self.open_time = 0
+        self.compressed = False
+        self.open_segment()
+
+        self.thread = threading.Thread(target=self.writer_thread, name='log_writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def open_segment(self):
+        '''open the next log segment'''
+        while True:
+            self.segment += 1
+            filename = segment_filename(self.base_filename, self.segment)
+            self.compressed = self.compress
+            if self.compressed:
+                filename += '.gz'
+            if self.segment == 1 or not os.path.exists(filename):
+                break
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if self.append and self.segment == 1:
+            flags |= os.O_APPEND
+        else:
+            flags |= os.O_TRUNC
+        self.fd = os.open(filename, flags, 0o644)
+        self.filename = filename
+        self.file_size = os.fstat(self.fd).st_size
+        self.open_time = time.time()
+        if self.index and not self.compressed:
+            idx_filename = mp_tlogindex.index_filename(filename)
+            if flags & os.O_APPEND and os.path.exists(idx_filename):
+                self.idx_f = open(idx_filename, 'ab')
+            else:
+                self.idx_f = open(idx_filename, 'wb')
+            if self.idx_f.tell() == 0:
+                self.idx_f.write(mp_tlogindex.INDEX_MAGIC)
+
+    def close_segment(self):
+        '''close the current log segment'''
+        if self.fsync != 'none':
+            os.fsync(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        if self.idx_f is not None:
+            self.idx_f.close()
+            self.idx_f = None
+
+    def _next_chunk(self, n):
+        '''queue the current chunk for writing and start a new one which
+        can hold at least n bytes. Must be called with cond held'''
+        if self.cur_len > 0:
+            meta = None
+            if self.cur_first is not None:
+                meta = (self.cur_first, self.cur_last, self.cur_offsets)
+                self.cur_first = None
+                self.cur_offsets = {}
+            self.full.append((self.cur, self.cur_len, meta))
+            self.cond.notify()
+        if len(self.free) > 0:
+            self.cur = self.free.pop()
+        else:
+            self.cur = bytearray(self.chunk_size)
+            self.chunks_allocated += 1
+        if len(self.cur) < n:
+            self.cur = bytearray(n)
+        self.cur_len = 0
+
+    def log(self, buf, usec=None, linknum=None):
+        '''log a MAVLink message buffer with a timestamp. If linknum is
+        given it is stored in the bottom 2 bits of the timestamp'''
+        if usec is None:
+            usec = int(time.time() * 1.0e6)
+        if linknum is not None:
+            usec = (usec & ~3) | linknum
+        n = len(buf) + 8
+        with self.cond:
+            if self.cur_len + n > len(self.cur):
+                self._next_chunk(n)
+            ofs = self.cur_len
+            struct.pack_into('>Q', self.cur, ofs, usec)
+            self.cur[ofs+8:ofs+n] = buf
+            self.cur_len += n
+            self.records += 1
+            if self.index and n > 8:
+                msgid = mp_tlogindex.record_msgid(buf)
+                offsets = self.cur_offsets.get(msgid, None)
+                if offsets is None:
+                    self.cur_offsets[msgid] = [ofs]
+                else:
+                    offsets.append(ofs)
+                if self.cur_first is None:
+                    self.cur_first = usec
+                self.cur_last = usec
+            if self.flush_period <= 0:
+                self.cond.notify()
+
+    def write(self, data):
+        '''log data without adding a timestamp'''
+        n = len(data)
+        with self.cond:
+            if self.cur_len + n > len(self.cur):
+                self._next_chunk(n)
+            self.cur[self.cur_len:self.cur_len+n] = data
+            self.cur_len += n
+            self.records += 1
+            if self.flush_period <= 0:
+                self.cond.notify()
+
+    def put(self, data):
+        '''log a timestamped record. The writer used to be fed through a
+        queue, this keeps old callers working'''
+        if self.index and len(data) > 8:
+            self.log(data[8:], usec=struct.unpack('>Q', data[:8])[0])
+        else:
+            self.write(data)
+
+    def set_policy(self, flush_period, rotate_size, rotate_time, fsync, compress):
+        '''change the flush and rotation policy. The writer thread is woken
+        so that a new policy takes effect at once'''
+        policy = (flush_period, rotate_size, rotate_time, fsync, compress)
+        with self.cond:
+            if policy == (self.flush_period, self.rotate_size, self.rotate_time, self.fsync, self.compress):
+                return
+            self.flush_period = flush_period
+            self.rotate_size = rotate_size
+            self.rotate_time = rotate_time
+            self.fsync = fsync
+            self.compress = compress
+            self.cond.notify()
+
+    def flush(self):
+        '''ask the writer thread to write all buffered data'''
+        with self.cond:
+            self.flush_requested = True
+            self.cond.notify()
+
+    def close(self, timeout=5):
+        '''write all buffered data and close the log'''
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        self.thread.join(timeout=timeout)
+
+    def writev(self, views):
+        '''write a list of memoryviews to the log'''
+        if self.compressed:
+            c = zlib.compressobj(6, zlib.DEFLATED, 31)
+            views = [memoryview(c.compress(b''.join(views)) + c.flush())]
+        while len(views) > 0:
+            if hasattr(os, 'writev'):
+                n = os.writev(self.fd, views[:IOV_MAX])
+            else:
+                n = os.write(self.fd, views[0])
+            self.writes += 1
+            self.file_size += n
+            self.bytes_written += n
+            # discard what has been written
+            while len(views) > 0 and n >= len(views[0]):
+                n -= len(views[0])
+                views.pop(0)
+            if n > 0:
+                views[0] = views[0][n:]
+
+    def time_to_rotate(self):
+        '''return seconds until time based rotation is due, or None'''
+        if self.rotate_time <= 0:
+            return None
+        return self.open_time + self.rotate_time - time.time()
+
+    def write_index(self, chunks, offset):
+        '''add index blocks for chunks written at offset'''
+        for (b, n, meta) in chunks:
+            if meta is not None:
+                (first, last, offsets) = meta
+                self.idx_f.write(mp_tlogindex.pack_block(offset, n, first, last, offsets))
+            offset += n
+
+    def rotate_due(self):
+        '''return True if the current segment should be closed'''
+        if self.file_size == 0:
+            # don't create empty segments. Time based rotation starts
+            # again from now, so the writer doesn't spin waiting for data
+            if self.rotate_time > 0 and self.time_to_rotate() <= 0:
+                self.open_time = time.time()
+            return False
+        if self.rotate_size > 0 and self.file_size >= self.rotate_size:
+            return True
+        t = self.time_to_rotate()
+        return t is not None and t <= 0
+
+    def writer_thread(self):
+        '''write chunks as they fill, and partial chunks every flush_period'''
+        last_flush = time.monotonic()
+        while True:
+            with self.cond:
+                if len(self.full) == 0 and not self.closing and not self.flush_requested:
+                    timeout = None
+                    if self.flush_period > 0:
+                        timeout = last_flush + self.flush_period - time.monotonic()
+                    t = self.time_to_rotate()
+                    if t is not None and (timeout is None or t < timeout):
+                        timeout = t
+                    if timeout is None or timeout > 0:
+                        self.cond.wait(timeout)
+                t = self.time_to_rotate()
+                flushing = (self.closing or self.flush_requested or self.flush_period <= 0 or
+                            time.monotonic() >= last_flush + self.flush_period or
+                            (t is not None and t <= 0))
+                if flushing and self.cur_len > 0:
+                    self._next_chunk(0)
+                chunks = self.full
+                self.full = []
+                self.flush_requested = False
+                closing = self.closing
+            try:
+                if len(chunks) > 0:
+                    offset = self.file_size
+                    self.writev([memoryview(b)[:n] for (b, n, meta) in chunks])
+                    if self.idx_f is not None:
+                        self.write_index(chunks, offset)
+                if flushing:
+                    last_flush = time.monotonic()
+                    if self.idx_f is not None:
+                        self.idx_f.flush()
+                    if self.fsync == 'flush':
+                        os.fsync(self.fd)
+                if closing:
+                    self.close_segment()
+                    return
+                if self.rotate_due():
+                    self.close_segment()
+                    self.open_segment()
+                    print("Telemetry log: %s" % self.filename)
+            except OSError as ex:
+                print("Telemetry log write failed: %s" % ex)
+                if closing:
+                    return
+            with self.cond:
+                # return standard sized chunks to the pool
+                for (b, n, meta) in chunks:
+                    if len(b) == self.chunk_size and len(self.free) < self.max_free:
+                        self.free.append(b)
+
+    def stats(self):
+        '''return dictionary of writer statistics'''
+        with self.cond:
+            buffered = self.cur_len + sum([n for (b, n, meta) in self.full])
+        return {
+            'filename': self.filename,
+            'segment': self.segment,
+            'records': self.records,
+            'bytes_written': self.bytes_written,
+            'writes': self.writes,
+            'buffered': buffered,
+            'chunks_allocated': self.chunks_allocated,
+        }
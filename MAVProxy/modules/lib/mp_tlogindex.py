@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+'''
+sidecar index for telemetry logs
+
+The index for flight.tlog is kept in flight.tlog.idx. It is written by
+TLogWriter as the log is written, and is a sequence of block records,
+each giving the byte range of a block of whole tlog records, the first
+and last timestamp in the block, and for each message ID in the block
+the offsets of its records within the block. The blocks are periodic
+offset/time checkpoints, and the offset lists let a reader load only
+the message types it needs.
+
+Parts of a log not covered by the index (for example a log written by
+an older version and then continued) are treated as holding any time
+and any message type, so an index never causes messages to be missed.
+
+AP_FLAKE8_CLEAN
+'''
+
+import io
+import os
+import struct
+
+from pymavlink import mavutil
+
+INDEX_MAGIC = b'MPTLIDX\x01'
+
+# offset, length, first timestamp (usec), last timestamp (usec), number of msgids
+BLOCK_HEADER = struct.Struct('<QIQQH')
+# msgid, count. The counts are followed by the uint16 offsets within the
+# block of the records of each msgid, in the same order
+BLOCK_COUNT = struct.Struct('<II')
+
+# blocks must be no larger than this, unless they hold a single record,
+# so that offsets within a block fit in 16 bits
+MAX_BLOCK_SIZE = 65536
+
+
+def index_filename(filename):
+    '''return the index filename for a tlog'''
+    return filename + '.idx'
+
+
+def pack_block(offset, length, first_usec, last_usec, offsets):
+    '''return an index block record. offsets is a dictionary of lists of
+    record offsets within the block, indexed by msgid'''
+    msgids = sorted(offsets.keys())
+    ret = [BLOCK_HEADER.pack(offset, length, first_usec, last_usec, len(msgids))]
+    for msgid in msgids:
+        ret.append(BLOCK_COUNT.pack(msgid, len(offsets[msgid])))
+    for msgid in msgids:
+        ret.append(struct.pack('<%uH' % len(offsets[msgid]), *offsets[msgid]))
+    return b''.join(ret)
+
+
+def record_length(data, ofs):
+    '''return the length of the tlog record at ofs, including the timestamp'''
+    plen = data[ofs+9]
+    if data[ofs+8] == mavutil.mavlink.PROTOCOL_MARKER_V2:
+        if data[ofs+10] & mavutil.mavlink.MAVLINK_IFLAG_SIGNED:
+            return 8 + 12 + plen + mavutil.mavlink.MAVLINK_SIGNATURE_BLOCK_LEN
+        return 8 + 12 + plen
+    return 8 + 8 + plen
+
+
+def record_msgid(buf):
+    '''return the message ID of a MAVLink frame'''
+    if buf[0] == mavutil.mavlink.PROTOCOL_MARKER_V2:
+        return buf[7] | (buf[8] << 8) | (buf[9] << 16)
+    return buf[5]
+
+
+class IndexBlock(object):
+    '''one block of a tlog. offsets is a dictionary of lists of record
+    offsets within the block by msgid, or None for parts of the log not
+    covered by the index, which may hold anything'''
+
+    def __init__(self, offset, length, first_usec=None, last_usec=None, offsets=None):
+        self.offset = offset
+        self.length = length
+        self.first_usec = first_usec
+        self.last_usec = last_usec
+        self.offsets = offsets
+        self.counts = None
+        if offsets is not None:
+            self.counts = {}
+            for msgid in offsets:
+                self.counts[msgid] = len(offsets[msgid])
+
+    def end(self):
+        return self.offset + self.length
+
+    def in_time_range(self, start_usec, end_usec):
+        '''return True if the block may hold records between start_usec and end_usec'''
+        if self.counts is None:
+            return True
+        if start_usec is not None and self.last_usec < start_usec:
+            return False
+        if end_usec is not None and self.first_usec > end_usec:
+            return False
+        return True
+
+    def has_types(self, msgids):
+        '''return True if the block may hold any of msgids'''
+        if self.counts is None:
+            return True
+        for msgid in msgids:
+            if msgid in self.counts:
+                return True
+        return False
+
+
+class TLogIndex(object):
+    '''index of a tlog, loaded from its sidecar file'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file_size = os.path.getsize(filename)
+        blocks = []
+        with open(index_filename(filename), 'rb') as f:
+            data = f.read()
+        if not data.startswith(INDEX_MAGIC):
+            raise ValueError("bad tlog index %s" % index_filename(filename))
+        ofs = len(INDEX_MAGIC)
+        while ofs + BLOCK_HEADER.size <= len(data):
+            (offset, length, first_usec, last_usec, ncounts) = BLOCK_HEADER.unpack_from(data, ofs)
+            ofs += BLOCK_HEADER.size
+            if ofs + ncounts * BLOCK_COUNT.size > len(data):
+                # truncated index
+                break
+            counts = []
+            for i in range(ncounts):
+                counts.append(BLOCK_COUNT.unpack_from(data, ofs))
+                ofs += BLOCK_COUNT.size
+            total = sum([c for (m, c) in counts])
+            if ofs + total * 2 > len(data):
+                break
+            offsets = {}
+            for (msgid, count) in counts:
+                offsets[msgid] = struct.unpack_from('<%uH' % count, data, ofs)
+                ofs += count * 2
+            if offset + length > self.file_size:
+                # the log has been truncated
+                continue
+            blocks.append(IndexBlock(offset, length, first_usec, last_usec, offsets))
+        blocks.sort(key=lambda b: b.offset)
+
+        # add blocks for anything not covered by the index
+        self.blocks = []
+        ofs = 0
+        for b in blocks:
+            if b.offset < ofs:
+                # overlaps a previous block, ignore it
+                continue
+            if b.offset > ofs:
+                self.blocks.append(IndexBlock(ofs, b.offset - ofs))
+            self.blocks.append(b)
+            ofs = b.end()
+        if ofs < self.file_size:
+            self.blocks.append(IndexBlock(ofs, self.file_size - ofs))
+
+    @staticmethod
+    def load(filename):
+        '''return the index for a tlog, or None if it has no usable index'''
+        if not os.path.exists(index_filename(filename)):
+            return None
+        try:
+            return TLogIndex(filename)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def indexed_bytes(self):
+        '''return number of bytes of the log covered by the index'''
+        return sum([b.length for b in self.blocks if b.counts is not None])
+
+    def time_range(self):
+        '''return (first, last) timestamp of indexed records in seconds, or None'''
+        first = [b.first_usec for b in self.blocks if b.counts is not None]
+        last = [b.last_usec for b in self.blocks if b.counts is not None]
+        if len(first) == 0:
+            return None
+        return (min(first) * 1.0e-6, max(last) * 1.0e-6)
+
+    def absolute_time(self, t):
+        '''convert a time relative to the start of the log to a timestamp.
+        Negative times are relative to the end of the log'''
+        r = self.time_range()
+        if t is None or r is None:
+            return None
+        if t < 0:
+            return r[1] + t
+        return r[0] + t
+
+    def counts(self):
+        '''return a dictionary of message counts by message name for the
+        indexed part of the log'''
+        ret = {}
+        for b in self.blocks:
+            if b.counts is None:
+                continue
+            for (msgid, count) in b.counts.items():
+                mtype = mavutil.mavlink.mavlink_map.get(msgid, None)
+                name = mtype.msgname if mtype is not None else str(msgid)
+                ret[name] = ret.get(name, 0) + count
+        return ret
+
+    def offset_for_time(self, t):
+        '''return the offset of the first block which may hold records at or after timestamp t'''
+        for b in self.blocks:
+            if b.in_time_range(t * 1.0e6, None):
+                return b.offset
+        return self.file_size
+
+    def msgids(self, types):
+        '''return set of message IDs for a list of message names'''
+        ret = set()
+        for (msgid, mtype) in mavutil.mavlink.mavlink_map.items():
+            if mtype.msgname in types:
+                ret.add(msgid)
+        return ret
+
+    def select_blocks(self, msgids=None, start_time=None, end_time=None):
+        '''return list of blocks which may hold records with the given
+        message IDs between start_time and end_time'''
+        start_usec = None if start_time is None else start_time * 1.0e6
+        end_usec = None if end_time is None else end_time * 1.0e6
+        ret = []
+        for b in self.blocks:
+            if not b.in_time_range(start_usec, end_usec):
+                continue
+            if msgids is not None and not b.has_types(msgids):
+                continue
+            ret.append(b)
+        return ret
+
+    def ranges(self, types=None, start_time=None, end_time=None):
+        '''return a list of (offset, length) byte ranges of the log holding
+        all records of the given message types between start_time and
+        end_time (timestamps in seconds). None means no restriction'''
+        msgids = None
+        if types is not None:
+            msgids = self.msgids(types)
+        ret = []
+        for b in self.select_blocks(msgids, start_time, end_time):
+            if len(ret) > 0 and ret[-1][0] + ret[-1][1] == b.offset:
+                # merge with the previous range
+                ret[-1] = (ret[-1][0], ret[-1][1] + b.length)
+            else:
+                ret.append((b.offset, b.length))
+        return ret
+
+    def read(self, types=None, start_time=None, end_time=None):
+        '''return the records of the given message types between
+        start_time and end_time, forming a valid tlog. Unindexed parts of
+        the log are returned whole'''
+        msgids = None
+        if types is not None:
+            msgids = self.msgids(types)
+        filtering = msgids is not None or start_time is not None or end_time is not None
+        ret = []
+        with open(self.filename, 'rb') as f:
+            for b in self.select_blocks(msgids, start_time, end_time):
+                f.seek(b.offset)
+                data = f.read(b.length)
+                if b.offsets is None or not filtering:
+                    ret.append(data)
+                    continue
+                # pick out the wanted records
+                ofs_list = []
+                for (msgid, offsets) in b.offsets.items():
+                    if msgids is None or msgid in msgids:
+                        ofs_list.extend(offsets)
+                for ofs in sorted(ofs_list):
+                    if start_time is not None or end_time is not None:
+                        t = struct.unpack_from('>Q', data, ofs)[0] * 1.0e-6
+                        if ((start_time is not None and t < start_time) or
+                                (end_time is not None and t > end_time)):
+                            continue
+                    ret.append(data[ofs:ofs+record_length(data, ofs)])
+        return b''.join(ret)
+
+
+class IndexedTLog(mavutil.mavmmaplog):
+    '''a mavmmaplog holding only part of a tlog'''
+
+    def __init__(self, filename, data, progress_callback=None):
+        mavutil.mavlogfile.__init__(self, filename)
+        self.f.close()
+        self.f = io.BytesIO(data)
+        self.filesize = len(data)
+        self.data_len = len(data)
+        self.data_map = None
+        if self.data_len != 0:
+            self.data_map = data
+            self._rewind()
+            self.init_arrays(progress_callback)
+        self._flightmodes = None
+
+    def close(self):
+        self.f.close()
+
+
+def open_tlog(filename, types=None, start_time=None, end_time=None, progress_callback=None):
+    '''open a tlog for reading, using its index to only load the parts
+    holding the given message types between start_time and end_time.
+    Times are in seconds relative to the start of the log, or to the end
+    of the log if negative. HEARTBEAT and PARAM_VALUE are always loaded so
+    flight modes and parameters are available'''
+    index = None
+    if types is not None or start_time is not None or end_time is not None:
+        index = TLogIndex.load(filename)
+    if index is None:
+        if start_time is not None or end_time is not None:
+            print("No index for %s, loading whole log" % filename)
+        return mavutil.mavlink_connection(filename, progress_callback=progress_callback)
+    if types is not None:
+        types = set(types)
+        types.update(['HEARTBEAT', 'PARAM_VALUE'])
+    data = index.read(types=types,
+                      start_time=index.absolute_time(start_time),
+                      end_time=index.absolute_time(end_time))
+    return IndexedTLog(filename, data, progress_callback=progress_callback)
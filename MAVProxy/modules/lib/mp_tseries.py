@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+'''
+time series store for received telemetry
+
+The numeric fields of every received message are kept in a ring buffer
+per message type, holding at least the last horizon seconds (up to
+max_samples messages of each type). Each buffer is a 2D numpy array with
+a row per message, plus arrays of the receive times and source system
+IDs, so queries for a time window are a binary search and a slice.
+
+Messages with an instance field (such as BATTERY_STATUS.id) are stored
+together, and queries can select one instance.
+
+The frames of messages which are forwarded without being decoded (see
+the fastfwd setting) are kept as they are, for up to the horizon, and
+only decoded into the store when their type is queried.
+
+AP_FLAKE8_CLEAN
+'''
+
+import collections
+
+import numpy as np
+
+from MAVProxy.modules.lib import mp_expression
+
+# default seconds of history to keep
+HORIZON = 60.0
+
+# upper limit on the messages of one type kept
+MAX_SAMPLES = 100000
+
+# initial ring buffer size
+MIN_SAMPLES = 64
+
+
+class Series(object):
+    '''ring buffer of the numeric fields of one message type'''
+
+    def __init__(self, fields, instance_field=None, capacity=MIN_SAMPLES):
+        self.fields = fields
+        self.columns = dict([(name, i) for (i, name) in enumerate(fields)])
+        self.instance_field = instance_field
+        self.times = np.zeros(capacity)
+        self.sysids = np.zeros(capacity, dtype=np.uint8)
+        self.data = np.zeros((capacity, len(fields)))
+        # index of the next row to write
+        self.head = 0
+        self.count = 0
+
+    def capacity(self):
+        return len(self.times)
+
+    def ordered(self, a):
+        '''return a copy of a column array in time order'''
+        if self.count < len(a):
+            return a[:self.count].copy()
+        return np.concatenate((a[self.head:], a[:self.head]))
+
+    def resize(self, capacity):
+        '''change the ring buffer size, keeping the newest rows'''
+        n = min(self.count, capacity)
+        times = np.zeros(capacity)
+        sysids = np.zeros(capacity, dtype=np.uint8)
+        data = np.zeros((capacity, len(self.fields)))
+        if n > 0:
+            times[:n] = self.ordered(self.times)[-n:]
+            sysids[:n] = self.ordered(self.sysids)[-n:]
+            data[:n] = self.ordered(self.data)[-n:]
+        self.times = times
+        self.sysids = sysids
+        self.data = data
+        self.count = n
+        self.head = n % capacity
+
+    def append(self, t, sysid, values, horizon, max_samples):
+        '''add a row of values received at time t'''
+        cap = len(self.times)
+        if self.count == cap and cap < max_samples and self.times[self.head] > t - horizon:
+            # the oldest row is still wanted, grow the buffer
+            self.resize(min(cap * 2, max_samples))
+        i = self.head
+        self.data[i] = values
+        self.times[i] = t
+        self.sysids[i] = sysid
+        self.head = (i + 1) % len(self.times)
+        if self.count < len(self.times):
+            self.count += 1
+
+    def last_time(self):
+        '''return time of the newest row'''
+        return self.times[self.head - 1]
+
+    def window(self, field, start=None, end=None, sysid=None, instance=None):
+        '''return (times, values) arrays for field between start and end'''
+        col = self.columns[field]
+        times = self.ordered(self.times)
+        i0 = 0 if start is None else np.searchsorted(times, start, side='left')
+        i1 = len(times) if end is None else np.searchsorted(times, end, side='right')
+        times = times[i0:i1]
+        if self.count < len(self.times):
+            rows = np.arange(i0, i1)
+        else:
+            rows = (np.arange(i0, i1) + self.head) % len(self.times)
+        values = self.data[rows, col]
+        mask = None
+        if sysid is not None:
+            mask = self.sysids[rows] == sysid
+        if instance is not None and self.instance_field is not None:
+            imask = self.data[rows, self.columns[self.instance_field]] == instance
+            mask = imask if mask is None else mask & imask
+        if mask is not None:
+            return (times[mask], values[mask])
+        return (times, values)
+
+
+class TelemetryStore(object):
+    '''history of the numeric fields of received messages'''
+
+    def __init__(self, horizon=HORIZON, max_samples=MAX_SAMPLES):
+        self.horizon = horizon
+        self.max_samples = max_samples
+        self.series = {}
+        # mtype -> deque of (time, frame, decode function) not yet decoded
+        self.pending = {}
+
+    def add(self, m, t):
+        '''add a received message m, received at time t'''
+        mtype = m.get_type()
+        if mtype in self.pending:
+            # keep the rows in time order
+            self.decode_pending(mtype)
+        s = self.series.get(mtype, None)
+        if s is None:
+            fields = [f for f in m._fieldnames
+                      if isinstance(getattr(m, f), (int, float)) and not isinstance(getattr(m, f), bool)]
+            if len(fields) == 0:
+                # nothing to keep, but remember that
+                self.series[mtype] = False
+                return
+            s = Series(fields, getattr(m, '_instance_field', None))
+            self.series[mtype] = s
+        elif s is False:
+            return
+        try:
+            values = [getattr(m, f) for f in s.fields]
+            s.append(t, m.get_srcSystem(), values, self.horizon, self.max_samples)
+        except (TypeError, ValueError):
+            # a field which can't be converted, don't keep the row
+            pass
+
+    def add_frame(self, mtype, frame, t, decode):
+        '''add the undecoded frame of a message of type mtype received at
+        time t, to be decoded with decode(frame) when it is queried'''
+        q = self.pending.get(mtype, None)
+        if q is None:
+            q = collections.deque(maxlen=self.max_samples)
+            self.pending[mtype] = q
+        q.append((t, frame, decode))
+        cutoff = t - self.horizon
+        while q[0][0] < cutoff:
+            q.popleft()
+
+    def decode_pending(self, mtype=None):
+        '''decode the frames waiting for one type, or all types'''
+        if mtype is None:
+            for mtype in list(self.pending.keys()):
+                self.decode_pending(mtype)
+            return
+        q = self.pending.pop(mtype, None)
+        if q is None:
+            return
+        # the main loop may still be adding to q
+        for (t, frame, decode) in list(q):
+            try:
+                # pymavlink only decodes a bytearray
+                m = decode(bytearray(frame))
+            except Exception:
+                continue
+            self.add(m, t)
+
+    def set_horizon(self, horizon):
+        '''change the seconds of history kept'''
+        self.horizon = horizon
+
+    def clear(self):
+        self.series = {}
+        self.pending = {}
+
+    def types(self):
+        '''return list of message types with history'''
+        self.decode_pending()
+        return sorted([mtype for (mtype, s) in self.series.items() if s])
+
+    def fields(self, mtype):
+        '''return list of fields kept for a message type'''
+        self.decode_pending(mtype)
+        s = self.series.get(mtype, None)
+        if not s:
+            return []
+        return list(s.fields)
+
+    def query(self, mtype, field, start=None, end=None, sysid=None, instance=None):
+        '''return (times, values) numpy arrays for mtype.field received
+        between times start and end, optionally for one sysid or one
+        instance. Returns None if there is no such history'''
+        self.decode_pending(mtype)
+        s = self.series.get(mtype, None)
+        if not s or field not in s.columns:
+            return None
+        return s.window(field, start=start, end=end, sysid=sysid, instance=instance)
+
+    def last(self, mtype, field, seconds, sysid=None, instance=None):
+        '''return (times, values) for the last seconds of mtype.field'''
+        self.decode_pending(mtype)
+        s = self.series.get(mtype, None)
+        if not s or s.count == 0:
+            return self.query(mtype, field)
+        return self.query(mtype, field, start=s.last_time() - seconds, sysid=sysid, instance=instance)
+
+    def evaluate(self, expression, seconds, sysid=None):
+        '''evaluate an expression over the last seconds of history,
+        returning (times, values) or None. The expression may only use
+        one message type'''
+        e = mp_expression.compile_expression(expression)
+        if len(e.msg_types) != 1:
+            return None
+        mtype = list(e.msg_types)[0]
+        self.decode_pending(mtype)
+        s = self.series.get(mtype, None)
+        if not s or s.count == 0:
+            return None
+        start = s.last_time() - seconds
+        columns = {}
+        times = None
+        for field in s.fields:
+            (times, columns[field]) = s.window(field, start=start, sysid=sysid)
+        ret = e.evaluate_columns({mtype: columns})
+        if ret is None:
+            return None
+        (values, mask) = ret
+        if mask is not None:
+            return (times[mask], values[mask])
+        return (times, values)
+
+    def memory(self):
+        '''return bytes used by the buffers'''
+        total = 0
+        for s in self.series.values():
+            if s:
+                total += s.times.nbytes + s.sysids.nbytes + s.data.nbytes
+        return total
@@ -156,6 +156,58 @@ class WrapMMap(object):
 
 mutex = multiproc.Lock()
 
+class LogCacheUsers(object):
+    '''Reference count the child tasks using each log cache
+
+        A log cache is passed to child tasks by its path, and each child
+        memory maps the same cache files read only, so the parsed log is
+        held once in the page cache however many tasks use it. The
+        parent counts the running tasks using each cache, so a cache is
+        not pruned while it is in use, and drops its own memory maps of a
+        cache it no longer needs once the last task using it has closed.
+    '''
+
+    def __init__(self):
+        self.tasks = {}
+        self.released = []
+
+    def add(self, log_cache, task):
+        '''note that a child task is using a log cache'''
+        self.tasks.setdefault(log_cache.key(), []).append(task)
+
+    def count(self, log_cache):
+        '''return the number of running tasks using a log cache'''
+        self.update()
+        return len(self.tasks.get(log_cache.key(), []))
+
+    def in_use(self):
+        '''return the keys of caches used by running tasks'''
+        self.update()
+        return list(self.tasks.keys())
+
+    def release(self, log_cache):
+        '''drop the memory maps of a log cache the parent no longer
+        needs, now or once the tasks using it have closed'''
+        if log_cache is None:
+            return
+        self.released.append(log_cache)
+        self.update()
+
+    def update(self):
+        '''forget tasks which have finished'''
+        for key in list(self.tasks.keys()):
+            tasks = [t for t in self.tasks[key] if t.child is not None and t.is_alive()]
+            if len(tasks) > 0:
+                self.tasks[key] = tasks
+                continue
+            del self.tasks[key]
+        for log_cache in self.released[:]:
+            if log_cache.key() not in self.tasks:
+                log_cache.close()
+                self.released.remove(log_cache)
+
+log_cache_users = LogCacheUsers()
+
 class MPChildTask(object):
     '''Manage a MAVProxy child task
     
@@ -271,11 +323,23 @@ class MPDataLogChildTask(MPChildTask):
         ----------
         mlog : DFReader / mavmmaplog
             A dataflash or telemetry log
+        log_cache : mp_logcache.LogCache
+            The columns of the log, if it is cached. The child reads them
+            from the parent's cache files rather than parsing the log
         '''
         super(MPDataLogChildTask, self).__init__(*args, **kwargs)
 
         # all attributes are implicitly passed to the child process 
         self._mlog = kwargs['mlog']
+        self._log_cache = kwargs.get('log_cache', None)
+
+    # @override
+    def start(self):
+        '''Start the child process, counting it as a user of the log cache'''
+
+        super(MPDataLogChildTask, self).start()
+        if self._log_cache is not None:
+            log_cache_users.add(self._log_cache, self)
 
     # @override
     def wrap(self):
@@ -310,3 +374,9 @@ class MPDataLogChildTask(MPChildTask):
         '''The dataflash or telemetry log (DFReader / mavmmaplog)'''
 
         return self._mlog
+
+    @property
+    def log_cache(self):
+        '''The cached columns of the log (LogCache), or None'''
+
+        return self._log_cache
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from __future__ import print_function
-import os, wx, pickle
+import os, pickle
 from MAVProxy.modules.lib import mp_util
 
 '''
@@ -35,6 +35,7 @@ class ManagedWindow(object):
 
 def get_wx_window_layout(wx_window):
     '''get a WinLayout for a wx window'''
+    import wx
     dsize = wx.DisplaySize()
     pos = wx_window.GetPosition()
     size = wx_window.GetSize()
@@ -9,8 +9,6 @@ from math import *
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_settings
 from MAVProxy.modules.lib import mp_util
-from pymavlink import mavutil
-from PIL import ImageColor
 
 obc_icons = {
     100 : 'greenplane.png',
@@ -71,6 +69,7 @@ class ADSBModule(mp_module.MPModule):
 
     def __init__(self, mpstate):
         super(ADSBModule, self).__init__(mpstate, "adsb", "ADS-B data support", public = True)
+        self.set_packet_types(['ADSB_VEHICLE'])
         self.threat_vehicles = {}
         self.active_threat_ids = []  # holds all threat ids the vehicle is evading
 
@@ -92,8 +91,10 @@ class ADSBModule(mp_module.MPModule):
         self.add_completion_function('(ADSBSETTING)',
                                      self.ADSB_settings.completion)
         
-        self.threat_detection_timer = mavutil.periodic_event(2)
-        self.threat_timeout_timer = mavutil.periodic_event(2)
+        self.add_periodic_task(self.check_threat_timeout, 2)
+        self.add_periodic_task(self.perform_threat_detection, 2)
+        # TODO: possibly evade detected threats with ids in
+        # self.active_threat_ids
         self.tnow = self.get_time()
         self.last_traffic = self.tnow
 
@@ -242,6 +243,8 @@ class ADSBModule(mp_module.MPModule):
             GPI = self.master.messages.get("GLOBAL_POSITION_INT", None)
             if GPI is None:
                 return
+            # PIL is slow to import, only load it when there is a map
+            from PIL import ImageColor
             ref_alt = GPI.alt*0.001
             lat_deg = lat * 1.0e-7
             lon_deg = lon * 1.0e-7
@@ -273,16 +276,6 @@ class ADSBModule(mp_module.MPModule):
             state = m.to_dict()
             self.add_vehicle(state)
 
-    def idle_task(self):
-        '''called on idle'''
-        if self.threat_timeout_timer.trigger():
-            self.check_threat_timeout()
-
-        if self.threat_detection_timer.trigger():
-            self.perform_threat_detection()
-            # TODO: possibly evade detected threats with ids in
-            # self.active_threat_ids
-
 
 def init(mpstate):
     '''initialise module'''
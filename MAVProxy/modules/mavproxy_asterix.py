@@ -282,10 +282,12 @@ class AsterixModule(mp_module.MPModule):
                 adsb_mod.mavlink_packet(adsb_pkt)
 
             try:
+                link = self.module('link')
                 for sysid in self.mpstate.sysid_outputs:
                     # fwd to sysid clients
-                    adsb_pkt.pack(self.mpstate.sysid_outputs[sysid].mav)
-                    self.mpstate.sysid_outputs[sysid].write(adsb_pkt.get_msgbuf())
+                    conn = self.mpstate.sysid_outputs[sysid]
+                    adsb_pkt.pack(conn.mav)
+                    link.write_output(conn, adsb_pkt.get_msgId(), adsb_pkt.get_msgbuf())
             except Exception:
                 pass
                 
@@ -4,7 +4,7 @@
   uses lib/console.py for display
 """
 
-import os, sys, math, time, re
+import os, sys, math, time
 import traceback
 
 from MAVProxy.modules.lib import wxconsole
@@ -12,6 +12,7 @@ from MAVProxy.modules.lib import textconsole
 from pymavlink import mavutil
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_module
+from MAVProxy.modules.lib import mp_expression
 from MAVProxy.modules.lib import mp_settings
 from MAVProxy.modules.lib import wxsettings
 from MAVProxy.modules.lib.mp_menu import *
@@ -22,8 +23,7 @@ class DisplayItem:
     def __init__(self, fmt, expression, row):
         self.expression = expression.strip('"\'')
         self.format = fmt.strip('"\'')
-        re_caps = re.compile('[A-Z_][A-Z0-9_]+')
-        self.msg_types = set(re.findall(re_caps, expression))
+        self.msg_types = mp_expression.compile_expression(self.expression).msg_types
         self.row = row
 
 class ConsoleModule(mp_module.MPModule):
@@ -611,6 +611,9 @@ class ConsoleModule(mp_module.MPModule):
                                 "%u lost" % m.mav_loss,
                                 "%.2fs delay" % linkdelay,
                     ]
+                    source_stats = m.link_stats.sources.get((sysid, compid), None)
+                    if source_stats is not None and source_stats.last_transit is not None:
+                        linkbits.append("%.0fms jitter" % (source_stats.jitter * 1000))
                     try:
                         if m.mav.signing.sig_count:
                             # other end is sending us signed packets
@@ -776,7 +779,7 @@ class ConsoleModule(mp_module.MPModule):
             if type in self.user_added[id].msg_types:
                 d = self.user_added[id]
                 try:
-                    val = mavutil.evaluate_expression(d.expression, self.master.messages)
+                    val = mp_expression.evaluate_expression(d.expression, self.master.messages)
                     console_string = d.format % val
                 except Exception as ex:
                     console_string = "????"
@@ -97,6 +97,7 @@ class WriteQueue:
 class FTPModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(FTPModule, self).__init__(mpstate, "ftp", public=True)
+        self.set_packet_types(['FILE_TRANSFER_PROTOCOL'])
         self.add_command('ftp', self.cmd_ftp, "file transfer",
                          ["<list|get|rm|rmdir|rename|mkdir|crc|cancel|status>",
                           "set (FTPSETTING)",
@@ -4,10 +4,10 @@
   uses lib/live_graph.py for display
 """
 
-from pymavlink import mavutil
 import re, os, sys
 
 from MAVProxy.modules.lib import live_graph
+from MAVProxy.modules.lib import mp_expression
 
 from MAVProxy.modules.lib import mp_module
 
@@ -160,7 +160,7 @@ class Graph():
             if mtype not in self.field_types[i]:
                 continue
             f = self.fields[i]
-            self.values[i] = mavutil.evaluate_expression(f, self.state.master.messages)
+            self.values[i] = mp_expression.evaluate_expression(f, self.state.master.messages)
             if self.values[i] is not None:
                 have_value = True
         if have_value and self.livegraph is not None:
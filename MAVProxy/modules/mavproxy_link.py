@@ -16,7 +16,6 @@ import fnmatch
 import json
 import math
 import os
-import struct
 import sys
 import time
 import traceback
@@ -26,7 +25,15 @@ if sys.version_info[0] >= 3:
 else:
     import StringIO
 
+from MAVProxy.modules.lib import mp_dedup
+from MAVProxy.modules.lib import mp_fastfwd
+from MAVProxy.modules.lib import mp_linkopen
+from MAVProxy.modules.lib import mp_linkreader
+from MAVProxy.modules.lib import mp_linkstats
 from MAVProxy.modules.lib import mp_module
+from MAVProxy.modules.lib import mp_outqueue
+from MAVProxy.modules.lib import mp_perf
+from MAVProxy.modules.lib import mp_replay
 from MAVProxy.modules.lib import mp_util
 
 if mp_util.has_wxpython:
@@ -54,6 +61,16 @@ activityPackets = frozenset([
     'SYS_STATUS',
 ])
 radioStatusPackets = frozenset(['RADIO', 'RADIO_STATUS'])
+# message types the link module always needs decoded when fastfwd is enabled
+fastfwdDecodePackets = activityPackets | delayedPackets | radioStatusPackets | frozenset([
+    'ATTITUDE',
+    'COMMAND_ACK',
+    'COMPASSMOT_STATUS',
+    'MISSION_ACK',
+    'SIMSTATE',
+    'STATUSTEXT',
+    'TIMESYNC',
+])
 
 preferred_ports = [
     '*FTDI*',
@@ -80,6 +97,9 @@ class LinkModule(mp_module.MPModule):
         super(LinkModule, self).__init__(mpstate, "link", "link control", public=True, multi_vehicle=True)
         self.add_command('link', self.cmd_link, "link control",
                          ["<list|ports|resetstats>",
+                          'stats (LINK)',
+                          'stats json',
+                          'routes',
                           'add (SERIALPORT)',
                           'attributes (LINK) (ATTRIBUTES)',
                           'remove (LINKS)',
@@ -102,6 +122,14 @@ class LinkModule(mp_module.MPModule):
         self.datarate_logging_timer = mavutil.periodic_event(1)
         self.old_streamrate = 0
         self.old_streamrate2 = 0
+        # cache of which message IDs need decoding in fastfwd mode
+        self.fastfwd_decode = {}
+        self.fastfwd_dispatch = None
+        # frames recently received, to drop copies from redundant links
+        self.dedup = mp_dedup.FrameDedup()
+        # links still opening after link_add_parallel() returned
+        self.pending_links = []
+        self.add_periodic_task(self.rotate_link_stats, 1)
 
         # a list of TimeSync requests which are listening for and
         # sending TIMESYNC messages at the moment:
@@ -148,6 +176,9 @@ class LinkModule(mp_module.MPModule):
             else:
                 self.menu_added_console = False
 
+        if len(self.pending_links) > 0:
+            self.check_pending_links()
+
         for m in self.mpstate.mav_master:
             m.source_system = self.settings.source_system
             m.mav.srcSystem = m.source_system
@@ -240,10 +271,14 @@ class LinkModule(mp_module.MPModule):
             self.cmd_link_remove(args[1:])
         elif args[0] == "resetstats":
             self.reset_link_stats()
+        elif args[0] == "stats":
+            self.cmd_link_stats(args[1:])
+        elif args[0] == "routes":
+            self.cmd_link_routes()
         elif args[0] == "ping":
             self.cmd_ping(args[1:])
         else:
-            print("usage: link <list|add|remove|attributes|hl|dataratelogging|resetstats>")
+            print("usage: link <list|add|remove|attributes|hl|dataratelogging|resetstats|stats|routes>")
 
     def cmd_dl(self, args):
         '''Toggle datarate logging'''
@@ -335,6 +370,20 @@ class LinkModule(mp_module.MPModule):
                 self.status.bytecounters['MasterIn'][master.linknum].rate(),
                 sign_string,
             ))
+            if master.dup_count > 0:
+                print("  %u duplicates of messages received on other links" % master.dup_count)
+            reader = getattr(master, 'link_reader', None)
+            if reader is not None:
+                s = reader.stats()
+                print("  reader %s: %u frames, queued %u/%u bytes (high %u), dropped %u frames (%u bytes)" % (
+                    reader.mode,
+                    s['frames'],
+                    s['queued'],
+                    s['capacity'],
+                    s['high_water'],
+                    s['dropped'],
+                    s['dropped_bytes'],
+                ))
 
     def reset_link_stats(self):
         '''reset link statistics'''
@@ -343,6 +392,8 @@ class LinkModule(mp_module.MPModule):
             self.status.bytecounters['MasterIn'][master.linknum].__init__()
             master.mav_loss = 0
             master.mav_count = 0
+            master.dup_count = 0
+            master.link_stats.reset()
 
     def cmd_alllinks(self, args):
         '''send command on all links'''
@@ -353,6 +404,60 @@ class LinkModule(mp_module.MPModule):
             self.mpstate.functions.process_stdin(' '.join(args), True)
         self.cmd_vehicle([str(saved_target)])
 
+    def rotate_link_stats(self):
+        '''update the link quality statistics, called once a second'''
+        for master in self.mpstate.mav_master:
+            master.link_stats.rotate()
+        self.status.link_stats = [master.link_stats.stats() for master in self.mpstate.mav_master]
+        self.mpstate.routing.update()
+
+    def cmd_link_routes(self):
+        '''show the link used to send to each sysid'''
+        routing = self.mpstate.routing
+        now = time.time()
+        for (sysid, link) in routing.show():
+            links = routing.heartbeats[sysid]
+            costs = routing.costs(sysid, links)
+            others = ["%s:%.3f%s" % (self.link_label(m), costs[m], "" if routing.usable(sysid, m, now) else "(stale)")
+                      for m in links]
+            print("sysid %u: link %s (costs %s)" % (sysid, self.link_label(link), " ".join(others)))
+        print("%u route changes" % routing.changes)
+
+    def cmd_link_stats(self, args):
+        '''show link quality statistics'''
+        if len(args) > 0 and args[0] == 'json':
+            print(json.dumps(self.status.link_stats))
+            return
+        masters = self.mpstate.mav_master
+        if len(args) > 0:
+            i = self.find_link(args[0])
+            if i is None:
+                print("Connection (%s) not found" % args[0])
+                return
+            masters = [masters[i]]
+        for master in masters:
+            stats = master.link_stats.stats()
+            print("link %s" % self.link_label(master))
+            for (source, s) in stats['sources'].items():
+                print("  %s: %u pkts, %u lost (%.1f%%), %u reordered, delay %.3fs (trend %+.1fms/s), jitter %.1fms" % (
+                    source,
+                    s['packets'],
+                    s['lost'],
+                    s['loss_rate'] * 100,
+                    s['reordered'],
+                    s['delay'],
+                    s['delay_trend'] * 1000,
+                    s['jitter'] * 1000,
+                ))
+                if sum(s['jitter_hist']) > 0:
+                    limits = ["<%ums" % b for b in mp_linkstats.JITTER_BUCKETS] + [">%ums" % mp_linkstats.JITTER_BUCKETS[-1]]
+                    print("    jitter: " + " ".join(["%s:%u" % (limit, count)
+                                                    for (limit, count) in zip(limits, s['jitter_hist'])
+                                                    if count > 0]))
+            rates = sorted(stats['type_rates'].items(), key=lambda x: -x[1])
+            if len(rates) > 0:
+                print("  bytes/s: " + " ".join(["%s:%.0f" % (mtype, rate) for (mtype, rate) in rates]))
+
     def cmd_link_list(self):
         '''list links'''
         print("%u links" % len(self.mpstate.mav_master))
@@ -387,39 +492,132 @@ class LinkModule(mp_module.MPModule):
         for attr in optional_attributes:
             print("Applying attribute to link: %s = %s" % (attr, optional_attributes[attr]))
             setattr(conn, attr, optional_attributes[attr])
+        if 'reader' in optional_attributes or 'reader_bufsize' in optional_attributes:
+            self.update_link_reader(conn)
+
+    def update_link_reader(self, conn):
+        '''start, stop or change the reader worker for a link based on its
+        "reader" attribute, which may be "thread", "process" or "none"'''
+        mode = getattr(conn, 'reader', None)
+        if mode in [None, '', 'none']:
+            mode = None
+        bufsize = int(getattr(conn, 'reader_bufsize', 1024*1024))
+        reader = conn.link_reader
+        if reader is not None:
+            if reader.mode == mode and reader.ring.capacity == bufsize:
+                return
+            reader.close()
+            conn.link_reader = None
+        if mode is None:
+            return
+        if mode not in mp_linkreader.READER_MODES:
+            print("Unknown reader mode %s, use one of %s" % (mode, mp_linkreader.READER_MODES))
+            return
+        if mode == 'process':
+            reason = mp_linkreader.process_mode_available(conn)
+            if reason is not None:
+                print("Process reader not available for %s (%s), using thread" % (conn.address, reason))
+                mode = 'thread'
+        try:
+            conn.link_reader = mp_linkreader.LinkReader(conn, mode=mode, bufsize=bufsize)
+        except Exception as ex:
+            # the main loop polls or waits on the link itself instead
+            print("Failed to start %s reader for %s: %s" % (mode, conn.address, ex))
+
+    def connect_device(self, device, force_connected, retries, baud=None):
+        '''open a pymavlink connection to device'''
+        if baud is None:
+            baud = self.settings.baudrate
+        try:
+            return mavutil.mavlink_connection(device, autoreconnect=True,
+                                              source_system=self.settings.source_system,
+                                              baud=baud,
+                                              force_connected=force_connected,
+                                              retries=retries)
+        except Exception:
+            # try the same thing but without force-connected for
+            # backwards-compatability
+            return mavutil.mavlink_connection(device, autoreconnect=True,
+                                              source_system=self.settings.source_system,
+                                              baud=baud,
+                                              retries=retries)
+
+    def open_link(self, descriptor, force_connected=False, retries=3):
+        '''open the connection for a link descriptor, returning (conn,
+        optional_attributes). This can be called from any thread'''
+        (device, optional_attributes) = self.parse_link_descriptor(descriptor)
+        baud = self.settings.baudrate
+        # if there's only 1 colon for port:baud
+        # and if the first string is a valid serial port, it's a serial connection
+        if len(device.split(':')) == 2:
+            ports = mavutil.auto_detect_serial(preferred_list=preferred_ports)
+            for p in ports:
+                if p.device == device.split(':')[0]:
+                    # it's a valid serial port, reformat arguments to fit
+                    baud = int(device.split(':')[1])
+                    self.settings.baudrate = baud
+                    device = device.split(':')[0]
+                    break
+        print("Connect %s source_system=%d" % (device, self.settings.source_system))
+        if device.startswith('replay:'):
+            conn = mp_replay.ReplayLink(device[7:],
+                                        source_system=self.settings.source_system,
+                                        source_component=self.settings.source_component)
+        else:
+            conn = self.connect_device(device, force_connected, retries, baud=baud)
+        conn.mav.srcComponent = self.settings.source_component
+        return (conn, optional_attributes)
 
     def link_add(self, descriptor, force_connected=False, retries=3):
         '''add new link'''
         try:
-            (device, optional_attributes) = self.parse_link_descriptor(descriptor)
-            # if there's only 1 colon for port:baud
-            # and if the first string is a valid serial port, it's a serial connection
-            if len(device.split(':')) == 2:
-                ports = mavutil.auto_detect_serial(preferred_list=preferred_ports)
-                for p in ports:
-                    if p.device == device.split(':')[0]:
-                        # it's a valid serial port, reformat arguments to fit
-                        self.settings.baudrate = int(device.split(':')[1])
-                        device = device.split(':')[0]
-                        break
-            print("Connect %s source_system=%d" % (device, self.settings.source_system))
-            try:
-                conn = mavutil.mavlink_connection(device, autoreconnect=True,
-                                                  source_system=self.settings.source_system,
-                                                  baud=self.settings.baudrate,
-                                                  force_connected=force_connected,
-                                                  retries=retries)
-            except Exception:
-                # try the same thing but without force-connected for
-                # backwards-compatability
-                conn = mavutil.mavlink_connection(device, autoreconnect=True,
-                                                  source_system=self.settings.source_system,
-                                                  baud=self.settings.baudrate,
-                                                  retries=retries)
-            conn.mav.srcComponent = self.settings.source_component
+            (conn, optional_attributes) = self.open_link(descriptor, force_connected, retries)
         except Exception as msg:
             print("Failed to connect to %s : %s" % (descriptor, msg))
             return False
+        self.add_connection(conn, optional_attributes)
+        return True
+
+    def link_add_parallel(self, descriptors, force_connected=False, retries=3, timeout=mp_linkopen.OPEN_TIMEOUT):
+        '''add several links, opening them at the same time. Returns once
+        all of them have opened or failed, or after timeout seconds if
+        at least one is open. Links which are still opening are added
+        when they open. Returns the number of links opened or still
+        opening'''
+        def open_func(descriptor):
+            return self.open_link(descriptor, force_connected, retries)
+        pending = mp_linkopen.open_links(descriptors, open_func, timeout=timeout)
+        count = 0
+        # add them in the order given, so link numbers follow the
+        # command line when they all open in time
+        for p in pending:
+            if not p.done():
+                print("Link %s still connecting" % p.descriptor)
+                self.pending_links.append(p)
+                count += 1
+            elif self.pending_link_done(p):
+                count += 1
+        return count
+
+    def pending_link_done(self, p):
+        '''add a link which has finished opening, returning True if it opened'''
+        if p.error is not None:
+            print("Failed to connect to %s : %s" % (p.descriptor, p.error))
+            return False
+        (conn, optional_attributes) = p.result
+        self.add_connection(conn, optional_attributes)
+        return True
+
+    def check_pending_links(self):
+        '''add links which were still opening at startup once they open'''
+        for p in self.pending_links[:]:
+            if p.done():
+                self.pending_links.remove(p)
+                if self.pending_link_done(p):
+                    print("Connected to %s on link %u" % (p.descriptor, p.result[0].linknum))
+
+    def add_connection(self, conn, optional_attributes):
+        '''add an open connection as a new link'''
         if self.settings.rtscts:
             conn.set_rtscts(True)
         conn.mav.set_callback(self.master_callback, conn)
@@ -430,9 +628,19 @@ class LinkModule(mp_module.MPModule):
         conn.link_delayed = False
         conn.last_heartbeat = 0
         conn.last_message = 0
+        conn.dup_count = 0
+        conn.link_stats = mp_linkstats.LinkStats()
         conn.highest_msec = {}
         conn.target_system = self.settings.target_system
+        conn.frame_splitter = mp_fastfwd.FrameSplitter()
+        conn.link_reader = None
         self.apply_link_attributes(conn, optional_attributes)
+        if (conn.link_reader is None and 'reader' not in optional_attributes and
+                mp_linkreader.blocking_read_available(conn)):
+            # the main loop can't wait on a link without a file
+            # descriptor, so read it in a thread instead of polling it
+            conn.reader = 'thread'
+            self.update_link_reader(conn)
         self.mpstate.mav_master.append(conn)
         self.status.counters['MasterIn'].append(0)
         self.status.bytecounters['MasterIn'].append(self.status.ByteCounter())
@@ -441,7 +649,6 @@ class LinkModule(mp_module.MPModule):
             mp_util.child_fd_list_add(conn.port.fileno())
         except Exception:
             pass
-        return True
 
     def cmd_link_add(self, args):
         '''add new link'''
@@ -492,6 +699,9 @@ class LinkModule(mp_module.MPModule):
             return
         conn = self.mpstate.mav_master[i]
         print("Removing link %s" % conn.address)
+        if conn.link_reader is not None:
+            conn.link_reader.close()
+            conn.link_reader = None
         try:
             try:
                 mp_util.child_fd_list_remove(conn.port.fileno())
@@ -502,6 +712,7 @@ class LinkModule(mp_module.MPModule):
             print(msg)
             pass
         self.mpstate.mav_master.pop(i)
+        self.mpstate.routing.remove_link(conn)
         self.status.counters['MasterIn'].pop(i)
         self.status.bytecounters['MasterIn'].pop(i)
         del self.mpstate.vehicle_link_map[conn.linknum]
@@ -546,9 +757,7 @@ class LinkModule(mp_module.MPModule):
 
         mtype = m.get_type()
         if mtype != 'BAD_DATA' and self.mpstate.logqueue:
-            usec = self.get_usec()
-            usec = (usec & ~3) | 3 # linknum 3
-            self.mpstate.logqueue.put(bytearray(struct.pack('>Q', usec) + m.get_msgbuf()))
+            self.mpstate.logqueue.log(m.get_msgbuf(), linknum=3)
 
     def handle_msec_timestamp(self, m, master):
         '''special handling for MAVLink packets with a time_boot_ms field'''
@@ -963,12 +1172,156 @@ class LinkModule(mp_module.MPModule):
         for ot in self.outstanding_timesyncs:
             ot.handle_TIMESYNC(m, master)
 
-    def mavlink_packet(self, msg):
-        '''handle an incoming mavlink packet'''
-        pass
-
     def master_callback(self, m, master):
         '''process mavlink message m on master, sending any messages to recipients'''
+        perf = self.mpstate.perf
+        if perf.enabled:
+            t0 = mp_perf.clock()
+            self.process_master_message(m, master)
+            perf.add('msgtype', m.get_type(), mp_perf.clock() - t0)
+        else:
+            self.process_master_message(m, master)
+
+    def output_queue(self, conn):
+        '''return the send queue of an output'''
+        q = getattr(conn, 'out_queue', None)
+        if q is None:
+            q = mp_outqueue.output_queue(conn,
+                                         max_bytes=self.mpstate.settings.outqueue_size * 1024,
+                                         policy=self.mpstate.settings.outqueue_policy)
+        return q
+
+    def write_output(self, conn, msgid, buf):
+        '''queue the frame buf of a message with ID msgid for an output'''
+        self.output_queue(conn).put(msgid, buf)
+
+    def forward_to_outputs(self, mtype, msgid, buf):
+        '''queue the frame buf of a message of type mtype for our outputs'''
+        # pass messages along to listeners, except for REQUEST_DATA_STREAM, which
+        # would lead a conflict in stream rate setting between mavproxy and the other
+        # GCS
+        if not self.mpstate.settings.mavfwd_rate and mtype == 'REQUEST_DATA_STREAM':
+            return
+        if mtype in self.no_fwd_types:
+            return
+        for r in self.mpstate.mav_outputs:
+            self.output_queue(r).put(msgid, buf)
+
+    def fastfwd_wanted(self, msgid):
+        '''return True if messages with this ID need to be decoded in fastfwd mode'''
+        if self.status.watch is not None:
+            return True
+        if self.fastfwd_dispatch is not self.mpstate.packet_dispatch:
+            # modules or their subscriptions have changed
+            self.fastfwd_decode = {}
+            self.fastfwd_dispatch = self.mpstate.packet_dispatch
+        ret = self.fastfwd_decode.get(msgid, None)
+        if ret is None:
+            msgtype = mavutil.mavlink.mavlink_map[msgid]
+            mtype = msgtype.msgname
+            # instanced messages are stored under their instance too,
+            # which needs the payload
+            ret = (mtype in fastfwdDecodePackets or msgtype.instance_field is not None or
+                   len(self.mpstate.packet_modules(mtype)) > 0)
+            self.fastfwd_decode[msgid] = ret
+        return ret
+
+    def fastfwd_buffer(self, master, s):
+        '''process received data s from master, forwarding messages which
+        nothing in MAVProxy consumes without decoding them. Returns the
+        list of decoded messages'''
+        return self.fastfwd_frames(master, master.frame_splitter.split(s))
+
+    def fastfwd_frames(self, master, frames):
+        '''process a list of (msgid, sysid, compid, seq, frame) from a
+        FrameSplitter, see fastfwd_buffer()'''
+        ret = []
+        for (msgid, sysid, compid, seq, frame) in frames:
+            if msgid is None or self.fastfwd_wanted(msgid):
+                msgs = master.mav.parse_buffer(frame)
+                if msgs:
+                    ret.extend(msgs)
+                continue
+            self.forward_frame(master, msgid, sysid, compid, seq, frame)
+        return ret
+
+    def update_link_stats(self, master, m, buf):
+        '''add a received message to the link quality statistics'''
+        sysid = m.get_srcSystem()
+        compid = m.get_srcComponent()
+        master.link_stats.update(sysid, compid, m.get_seq(), m.get_msgId(), len(buf))
+        msec = getattr(m, 'time_boot_ms', None)
+        if msec is not None and m.get_type() != 'GLOBAL_POSITION_INT':
+            # GLOBAL_POSITION_INT has the fix time, not boot time
+            master.link_stats.timestamp(sysid, compid, msec, time.time())
+
+    def is_duplicate(self, master, sysid, compid, seq, msgid, buf):
+        '''return True if a frame is a copy of one already received on
+        another link, which should only count in the link statistics'''
+        if len(self.mpstate.mav_master) < 2 or not self.mpstate.settings.dedup:
+            return False
+        self.dedup.window = self.mpstate.settings.dedup_window
+        if not self.dedup.duplicate(sysid, compid, seq, msgid, buf, master.linknum):
+            return False
+        master.dup_count += 1
+        return True
+
+    def update_link_activity(self, master):
+        '''note that master is receiving from the vehicle'''
+        if master.linkerror:
+            master.linkerror = False
+            self.say("link %s OK" % (self.link_label(master)))
+        self.status.last_message = time.time()
+        master.last_message = self.status.last_message
+
+    def forward_frame(self, master, msgid, sysid, compid, seq, frame):
+        '''route an undecoded frame, see fastfwd_buffer()'''
+        master.link_stats.update(sysid, compid, seq, msgid, len(frame))
+        if sysid in self.mpstate.sysid_outputs:
+            self.write_output(self.mpstate.sysid_outputs[sysid], msgid, frame)
+            return
+        self.status.counters['MasterIn'][master.linknum] += 1
+
+        # keep the link loss statistics as pymavlink's post_message() would
+        src_tuple = (sysid, compid)
+        if src_tuple != (ord('3'), ord('D')):
+            last_seq = master.last_seq.get(src_tuple, -1)
+            if last_seq != -1 and seq != (last_seq + 1) % 256:
+                master.mav_loss += (seq - (last_seq + 1)) % 256
+            master.last_seq[src_tuple] = seq
+            master.mav_count += 1
+
+        if self.is_duplicate(master, sysid, compid, seq, msgid, frame):
+            return
+
+        mtype = mavutil.mavlink.mavlink_map[msgid].msgname
+        if mtype not in dataPackets and self.mpstate.logqueue:
+            self.mpstate.logqueue.log(frame, linknum=master.linknum)
+        self.status.msg_count[mtype] = self.status.msg_count.get(mtype, 0) + 1
+        self.store_frame(master, sysid, mtype, frame)
+
+        self.forward_to_outputs(mtype, msgid, frame)
+
+    def store_frame(self, master, sysid, mtype, frame):
+        '''keep an undecoded frame where decoded messages are kept, to be
+        decoded if anything looks it up'''
+        now = time.time()
+        decode = master.mav.decode
+        if not isinstance(self.status.msgs, mp_fastfwd.LazyMessages):
+            self.status.msgs = mp_fastfwd.lazy_messages(self.status.msgs)
+        self.status.msgs.add_frame(mtype, decode, frame, now)
+        state = master.sysid_state.get(sysid, None)
+        if state is None:
+            state = mavutil.mavfile_state()
+            master.sysid_state[sysid] = state
+        if not isinstance(state.messages, mp_fastfwd.LazyMessages):
+            state.messages = mp_fastfwd.lazy_messages(state.messages)
+        state.messages.add_frame(mtype, decode, frame, now)
+        if self.mpstate.tseries.horizon > 0:
+            self.mpstate.tseries.add_frame(mtype, frame, now, decode)
+
+    def process_master_message(self, m, master):
+        '''process mavlink message m on master, see master_callback()'''
         sysid = m.get_srcSystem()
         mtype = m.get_type()
 
@@ -980,9 +1333,32 @@ class LinkModule(mp_module.MPModule):
                 self.mpstate.vehicle_link_map[master.linknum].add((sysid, compid))
                 print("Detected vehicle {0}:{1} on link {2}".format(sysid, compid, master.linknum))
 
+        # the original frame, which is written unchanged to outputs and logs
+        buf = m.get_msgbuf()
+        if mtype != 'BAD_DATA':
+            self.update_link_stats(master, m, buf)
+            if mtype == 'HEARTBEAT':
+                self.mpstate.routing.heartbeat(sysid, master)
+                profile = self.mpstate.startup_profile
+                if profile is not None and profile.first_heartbeat is None:
+                    profile.heartbeat()
+                    profile.report_heartbeat(sys.stdout)
+
+        if mtype != 'BAD_DATA' and self.is_duplicate(master, sysid, m.get_srcComponent(), m.get_seq(),
+                                                     m.get_msgId(), buf):
+            # only keep the statistics of this link
+            if getattr(m, '_timestamp', None) is None:
+                master.post_message(m)
+            self.status.counters['MasterIn'][master.linknum] += 1
+            if getattr(m, 'time_boot_ms', None) is not None and self.message_is_from_primary_vehicle(m):
+                self.handle_msec_timestamp(m, master)
+            if mtype in activityPackets:
+                self.update_link_activity(master)
+            return
+
         # see if it is handled by a specialised sysid connection
         if sysid in self.mpstate.sysid_outputs:
-            self.mpstate.sysid_outputs[sysid].write(m.get_msgbuf())
+            self.write_output(self.mpstate.sysid_outputs[sysid], m.get_msgId(), buf)
             if mtype == "GLOBAL_POSITION_INT":
                 for modname in 'map', 'asterix', 'NMEA', 'NMEA2':
                     mod = self.module(modname)
@@ -997,20 +1373,18 @@ class LinkModule(mp_module.MPModule):
         if mtype == 'GLOBAL_POSITION_INT':
             # send GLOBAL_POSITION_INT to 2nd GCS for 2nd vehicle display
             for sysid in self.mpstate.sysid_outputs:
-                self.mpstate.sysid_outputs[sysid].write(m.get_msgbuf())
+                self.write_output(self.mpstate.sysid_outputs[sysid], m.get_msgId(), buf)
 
             if self.mpstate.settings.fwdpos:
                 for link in self.mpstate.mav_master:
                     if link != master:
-                        link.write(m.get_msgbuf())
+                        link.write(buf)
 
         # and log them
         if mtype not in dataPackets and self.mpstate.logqueue:
             # put link number in bottom 2 bits, so we can analyse packet
             # delay in saved logs
-            usec = self.get_usec()
-            usec = (usec & ~3) | master.linknum
-            self.mpstate.logqueue.put(bytearray(struct.pack('>Q', usec) + m.get_msgbuf()))
+            self.mpstate.logqueue.log(buf, linknum=master.linknum)
 
         # keep the last message of each type around
         self.status.msgs[mtype] = m
@@ -1019,6 +1393,9 @@ class LinkModule(mp_module.MPModule):
             self.status.msg_count[mtype] = 0
         self.status.msg_count[mtype] += 1
 
+        if self.mpstate.tseries.horizon > 0:
+            self.mpstate.tseries.add(m, time.time())
+
         if instance_field is not None:
             instance_value = getattr(m, instance_field, None)
             if instance_value is not None:
@@ -1033,11 +1410,7 @@ class LinkModule(mp_module.MPModule):
             self.handle_msec_timestamp(m, master)
 
         if mtype in activityPackets:
-            if master.linkerror:
-                master.linkerror = False
-                self.say("link %s OK" % (self.link_label(master)))
-            self.status.last_message = time.time()
-            master.last_message = self.status.last_message
+            self.update_link_activity(master)
 
         if master.link_delayed and self.mpstate.settings.checkdelay:
             # don't process delayed packets that cause double reporting
@@ -1048,25 +1421,14 @@ class LinkModule(mp_module.MPModule):
 
         # don't pass along bad data
         if mtype != 'BAD_DATA':
-            # pass messages along to listeners, except for REQUEST_DATA_STREAM, which
-            # would lead a conflict in stream rate setting between mavproxy and the other
-            # GCS
-            if self.mpstate.settings.mavfwd_rate or mtype != 'REQUEST_DATA_STREAM':
-                if mtype not in self.no_fwd_types:
-                    for r in self.mpstate.mav_outputs:
-                        if hasattr(r, 'ws') and r.ws is not None:
-                            from wsproto.connection import ConnectionState
-                            if r.ws.state != ConnectionState.OPEN:  # Ensure Websocket handshake is done
-                                continue
-                        r.write(m.get_msgbuf())
+            self.forward_to_outputs(mtype, m.get_msgId(), buf)
 
             sysid = m.get_srcSystem()
             target_sysid = self.target_system
+            perf = self.mpstate.perf
 
-            # pass to modules
-            for (mod, pm) in self.mpstate.modules:
-                if not hasattr(mod, 'mavlink_packet'):
-                    continue
+            # pass to modules which have subscribed to this message type
+            for mod in self.mpstate.packet_modules(mtype):
                 # Do not send other-system-or-component heartbeat packets to non-multi-vehicle modules
                 if not self.message_is_from_primary_vehicle(m) and not mod.multi_vehicle and mtype == 'HEARTBEAT':
                     continue
@@ -1080,7 +1442,12 @@ class LinkModule(mp_module.MPModule):
                         # have marked themselves as being multi-vehicle capable
                         continue
                 try:
-                    mod.mavlink_packet(m)
+                    if perf.enabled:
+                        t0 = mp_perf.clock()
+                        mod.mavlink_packet(m)
+                        perf.add('mavlink_packet', mod.name, mp_perf.clock() - t0)
+                    else:
+                        mod.mavlink_packet(m)
                 except Exception as msg:
                     exc_type, exc_value, exc_traceback = sys.exc_info()
                     if self.mpstate.settings.moddebug > 3:
@@ -4,19 +4,28 @@
     output add 10.11.12.13:14550
     output list
     output remove 3      # to remove 3rd output
+    output set 3 policy drop-priority
+    output set 3 queue_size 64
+    output set 3 allow HEARTBEAT,ATTITUDE,GLOBAL_POSITION_INT,SYS_STATUS
+    output set 3 block RAW_IMU,SCALED_IMU*
+    output set 3 rate ATTITUDE:4,GLOBAL_POSITION_INT:2
+    output set 3 rate none   # remove rate limits
 '''
 
 from pymavlink import mavutil
 
 
 from MAVProxy.modules.lib import mp_module
+from MAVProxy.modules.lib import mp_outqueue
 from MAVProxy.modules.lib import mp_util
 
 class OutputModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(OutputModule, self).__init__(mpstate, "output", "output control", public=True)
         self.add_command('output', self.cmd_output, "output control",
-                         ["<list|add|remove|sysid>"])
+                         ["<list|add|remove|sysid>",
+                          "set (OUTPUT) <policy|queue_size|allow|block|rate>"])
+        self.add_periodic_task(self.update_queues, 1)
 
     def cmd_output(self, args):
         '''handle output commands'''
@@ -37,8 +46,27 @@ class OutputModule(mp_module.MPModule):
                 print("Usage: output sysid SYSID OUTPUT")
                 return
             self.cmd_output_sysid(args[1:])
+        elif args[0] == "set":
+            if len(args) != 4:
+                print("Usage: output set OUTPUT <policy|queue_size|allow|block|rate> VALUE")
+                return
+            self.cmd_output_set(args[1:])
         else:
-            print("usage: output <list|add|remove|sysid>")
+            print("usage: output <list|add|remove|sysid|set>")
+
+    def show_queue(self, conn):
+        '''show send queue statistics for an output'''
+        q = getattr(conn, 'out_queue', None)
+        if q is None:
+            return
+        s = q.stats()
+        print("   queue %s: %u msgs %u/%u bytes (max %u), sent %u, dropped %u (%u bytes), disconnects %u" % (
+            s['policy'], s['queued'], s['queued_bytes'], s['max_bytes'], s['high_water'],
+            s['sent'], s['dropped'], s['dropped_bytes'], s['disconnects']))
+        if q.filtering:
+            print("   filter %s: filtered %u, rate limited %u" % (
+                ' '.join(["%s=%s" % (k, q.options[k]) for k in ['allow', 'block', 'rate'] if k in q.options]),
+                s['filtered'], s['rate_limited']))
 
     def cmd_output_list(self):
         '''list outputs'''
@@ -46,11 +74,109 @@ class OutputModule(mp_module.MPModule):
         for i in range(len(self.mpstate.mav_outputs)):
             conn = self.mpstate.mav_outputs[i]
             print("%u: %s" % (i, conn.address))
+            self.show_queue(conn)
         if len(self.mpstate.sysid_outputs) > 0:
             print("%u sysid outputs" % len(self.mpstate.sysid_outputs))
             for sysid in self.mpstate.sysid_outputs:
                 conn = self.mpstate.sysid_outputs[sysid]
                 print("%u: %s" % (sysid, conn.address))
+                self.show_queue(conn)
+
+    def find_output(self, device):
+        '''find an output by number or address'''
+        for i in range(len(self.mpstate.mav_outputs)):
+            conn = self.mpstate.mav_outputs[i]
+            if str(i) == device or conn.address == device:
+                return conn
+        for conn in self.mpstate.sysid_outputs.values():
+            if conn.address == device:
+                return conn
+        return None
+
+    def cmd_output_set(self, args):
+        '''set a send queue option for one output'''
+        (device, name, value) = args
+        conn = self.find_output(device)
+        if conn is None:
+            print("Unknown output %s" % device)
+            return
+        if name == 'policy':
+            if value not in mp_outqueue.POLICIES:
+                print("Policy must be one of %s" % ' '.join(mp_outqueue.POLICIES))
+                return
+        elif name == 'queue_size':
+            try:
+                value = int(value)
+            except ValueError:
+                print("Bad queue size %s" % value)
+                return
+        elif name in ['allow', 'block', 'rate']:
+            if self.parse_filter(name, value) is None:
+                return
+        else:
+            print("Unknown option %s" % name)
+            return
+        q = self.module('link').output_queue(conn)
+        if value == 'none':
+            q.options.pop(name, None)
+        else:
+            q.options[name] = value
+        if name in ['allow', 'block', 'rate']:
+            self.apply_filter(q)
+        self.update_queues()
+
+    def parse_filter(self, name, value):
+        '''parse an allow, block or rate option, returning a set of
+        message IDs, or a dictionary of rates by message ID for rate.
+        Returns None on error'''
+        if value == 'none':
+            return {} if name == 'rate' else set()
+        if name != 'rate':
+            ret = mp_outqueue.type_msgids(value.split(','))
+            if len(ret) == 0:
+                print("No message types match %s" % value)
+                return None
+            return ret
+        ret = {}
+        for r in value.split(','):
+            try:
+                (types, rate) = r.split(':')
+                rate = float(rate)
+            except ValueError:
+                print("Rates must be given as TYPE:RATE")
+                return None
+            if rate <= 0:
+                print("Rates must be positive, use block to stop a message type")
+                return None
+            msgids = mp_outqueue.type_msgids([types])
+            if len(msgids) == 0:
+                print("No message types match %s" % types)
+                return None
+            for msgid in msgids:
+                ret[msgid] = rate
+        return ret
+
+    def apply_filter(self, q):
+        '''set the message filter of a queue from its options'''
+        allow = None
+        if 'allow' in q.options:
+            allow = self.parse_filter('allow', q.options['allow'])
+        block = None
+        if 'block' in q.options:
+            block = self.parse_filter('block', q.options['block'])
+        rates = None
+        if 'rate' in q.options:
+            rates = self.parse_filter('rate', q.options['rate'])
+        q.set_filter(allow=allow, block=block, rates=rates)
+
+    def update_queues(self):
+        '''apply the send queue settings to all outputs'''
+        for conn in self.mpstate.mav_outputs + list(self.mpstate.sysid_outputs.values()):
+            q = getattr(conn, 'out_queue', None)
+            if q is None:
+                continue
+            q.max_bytes = q.options.get('queue_size', self.settings.outqueue_size) * 1024
+            q.policy = q.options.get('policy', self.settings.outqueue_policy)
 
     def cmd_output_add(self, args):
         '''add new output'''
@@ -358,7 +358,7 @@ class ParamState:
             mav.srcComponent = mavutil.mavlink.MAV_COMP_ID_MISSIONPLANNER
             try:
                 buf = p.pack(mav)
-                self.mpstate.logqueue.put(bytearray(struct.pack('>Q', usec) + buf))
+                self.mpstate.logqueue.log(buf, usec=usec)
                 # also give to param editor so it can update for changes
                 if editor:
                     editor.mavlink_packet(p)
@@ -11,7 +11,7 @@ import json
 import socket
 from threading import Thread
 
-from flask import Flask
+from flask import Flask, request
 from werkzeug.serving import make_server
 from MAVProxy.modules.lib import mp_module
 
@@ -50,11 +50,15 @@ class RestServer():
 
         # Save status
         self.status = None
+        self.link_stats = []
+        self.tseries = None
         self.server = None
 
     def update_dict(self, mpstate):
         '''We don't have time to waste'''
         self.status = mpstate.status
+        self.link_stats = mpstate.status.link_stats
+        self.tseries = mpstate.tseries
 
     def set_ip_port(self, ip, port):
         '''set ip and port'''
@@ -116,8 +120,32 @@ class RestServer():
 
         return json.dumps(new_dict)
 
+    def links(self, arg=None):
+        '''Deal with link statistics requests'''
+        if arg is None:
+            return json.dumps(self.link_stats)
+        try:
+            return json.dumps(self.link_stats[int(arg)])
+        except (ValueError, IndexError):
+            return '{"link": "%s", "links": %u}' % (arg, len(self.link_stats))
+
+    def history(self, arg):
+        '''Deal with telemetry history requests, arg is TYPE/FIELD'''
+        if self.tseries is None or '/' not in arg:
+            return '{"result": "No history"}'
+        (mtype, field) = arg.split('/', 1)
+        seconds = request.args.get('seconds', default=self.tseries.horizon, type=float)
+        data = self.tseries.last(mtype, field, seconds)
+        if data is None:
+            return '{"result": "No history"}'
+        (times, values) = data
+        return json.dumps({'time': times.tolist(), 'value': values.tolist()})
+
     def add_endpoint(self):
         '''Set endpoits'''
+        self.app.add_url_rule('/rest/history/<path:arg>', 'history', self.history)
+        self.app.add_url_rule('/rest/links/<arg>', 'links', self.links)
+        self.app.add_url_rule('/rest/links/', 'links', self.links)
         self.app.add_url_rule('/rest/mavlink/<path:arg>', 'rest', self.request)
         self.app.add_url_rule('/rest/mavlink/', 'rest', self.request)
 
@@ -759,17 +759,17 @@ class swarm(mp_module.MPModule):
 
         # time of last HB for each vehicle. Key is tuple of sysid,compid. Value is time of last HB
         self.vehicleLastHB = {}
-        self.needHBupdate_timer = mavutil.periodic_event(1)
+        self.add_periodic_task(self.update_gui_hb, 1)
 
         # Periodic event to update the GUI
         self.needGUIupdate = False
-        self.needGUIupdate_timer = mavutil.periodic_event(1)
+        self.add_periodic_task(self.update_gui_layout, 1)
 
         # Periodic event to send param (offset) requests (5 Hz)
-        self.requestParams_timer = mavutil.periodic_event(5)
+        self.add_periodic_task(self.request_params, 5)
 
         # Periodic event re-get params (0.1 Hz)
-        self.RerequestParams_timer = mavutil.periodic_event(0.1)
+        self.add_periodic_task(self.rerequest_params, 0.1)
 
         # List of any vehicles we still need to get params for
         self.vehParamsToGet = []
@@ -813,30 +813,32 @@ class swarm(mp_module.MPModule):
         '''set window layout'''
         self.gui.parent_pipe.send([layout])
 
-    def idle_task(self):
-        '''run on idle'''
-        # send updated HB stats to GUI every 1 sec
-        if self.needHBupdate_timer.trigger():
-            self.gui.updateHB(self.vehicleLastHB)
+    def update_gui_hb(self):
+        '''send updated HB stats to GUI every 1 sec'''
+        self.gui.updateHB(self.vehicleLastHB)
 
-        # do we need to update the GUI?
-        if self.needGUIupdate_timer.trigger() and self.needGUIupdate:
+    def update_gui_layout(self):
+        '''update the GUI if needed'''
+        if self.needGUIupdate:
             self.gui.updateLayout(self.vehicleListing)
             self.needGUIupdate = False
 
-        # do we need to get any vehicle follow sysid params?
-        # only send param requests 1 per 0.1sec, to avoid link flooding
-        if self.requestParams_timer.trigger() and len(self.vehParamsToGet) > 0:
+    def request_params(self):
+        '''get any vehicle follow sysid params. Only one request is sent
+        per call, to avoid link flooding'''
+        if len(self.vehParamsToGet) > 0:
             (sysid, compid) = self.vehParamsToGet.pop(0)
             self.mpstate.foreach_mav(sysid, compid, lambda mav: mav.param_request_read_send(
                 sysid, compid, parmString("FOLL_SYSID"), -1))
 
-        if self.RerequestParams_timer.trigger():
-            # If any in vehicleListing are missing their FOLL_SYSID, re-request
-            for veh in self.vehicleListing:
-                if veh[2] == 0:
-                    self.vehParamsToGet.append(((veh[0], veh[1])))
+    def rerequest_params(self):
+        '''if any in vehicleListing are missing their FOLL_SYSID, re-request'''
+        for veh in self.vehicleListing:
+            if veh[2] == 0:
+                self.vehParamsToGet.append(((veh[0], veh[1])))
 
+    def idle_task(self):
+        '''run on idle'''
         # execute any commands from GUI via parent_pipe
         if self.gui.parent_pipe.poll():
             (cmd, sysid, compid) = self.gui.parent_pipe.recv()
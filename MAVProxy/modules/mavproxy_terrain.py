@@ -12,6 +12,7 @@ from MAVProxy.modules.lib import mp_settings
 class TerrainModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(TerrainModule, self).__init__(mpstate, "terrain", "terrain handling", public=True)
+        self.set_packet_types(['TERRAIN_REQUEST', 'TERRAIN_REPORT'])
 
         self.current_request = None
         self.sent_mask = 0
@@ -20,6 +21,8 @@ class TerrainModule(mp_module.MPModule):
         self.blocks_sent = 0
         self.check_lat = 0
         self.check_lon = 0
+        # send at most 5 terrain blocks per second
+        self.add_periodic_task(self.send_task, 5)
         self.add_command('terrain', self.cmd_terrain, "terrain control",
                          ["<status|check>",
                           'set (TERRAINSETTING)'])
@@ -131,13 +134,10 @@ class TerrainModule(mp_module.MPModule):
         self.current_request = None
         self.sent_mask = 0
 
-    def idle_task(self):
-        '''called when idle'''
+    def send_task(self):
+        '''periodic task sending the next block of a terrain request'''
         if self.current_request is None:
             return
-        if time.time() - self.last_send_time < 0.2:
-            # limit to 5 per second
-            return
         self.send_terrain_data()
 
 def init(mpstate):
@@ -21,9 +21,13 @@ os.environ['MAVLINK20'] = '1'
 
 from MAVProxy.modules.lib import multiproc
 from MAVProxy.modules.lib import rline
+from MAVProxy.modules.lib import mp_expression
 from MAVProxy.modules.lib import wxconsole
 from MAVProxy.modules.lib import param_help
 from MAVProxy.modules.lib import param_ftp
+from MAVProxy.modules.lib import mp_tlogindex
+from MAVProxy.modules.lib import mp_logcache
+from MAVProxy.modules.lib import multiproc_util
 from MAVProxy.modules.lib.graph_ui import Graph_UI
 from pymavlink.mavextra import *
 from MAVProxy.modules.lib.mp_menu import *
@@ -34,7 +38,7 @@ from pymavlink import DFReader
 from MAVProxy.modules.lib.mp_settings import MPSettings, MPSetting
 from MAVProxy.modules.lib import wxsettings
 from MAVProxy.modules.lib.graphdefinition import GraphDefinition
-from lxml import objectify
+from MAVProxy.modules.lib import graphdefs
 import pkg_resources
 from builtins import input
 import datetime
@@ -50,18 +54,6 @@ TopMenu = None
 # have we decoded MAVFtp params?
 done_ftp_decode = False
 
-def xml_unescape(e):
-    '''unescape < amd >'''
-    e = e.replace('&gt;', '>')
-    e = e.replace('&lt;', '<')
-    return e
-
-def xml_escape(e):
-    '''escape < amd >'''
-    e = e.replace('>', '&gt;')
-    e = e.replace('<', '&lt;')
-    return e
-
 def timestring(msg):
     '''return string for msg timestamp'''
     ts_ms = int(msg._timestamp * 1000.0) % 1000
@@ -115,11 +107,16 @@ class MEState(object):
               MPSetting('debug', int, 0, 'debug level'),
               MPSetting('paramdocs', bool, True, 'show param docs'),
               MPSetting('max_rate', float, 0, 'maximum display rate of graphs in Hz'),
+              MPSetting('decimate', bool, True, 'draw large graphs at the screen resolution'),
               MPSetting('vehicle_type', str, 'Auto', 'force vehicle type for mode handling'),
+              MPSetting('start_time', float, None, 'start of indexed tlogs to load in seconds, negative from end'),
+              MPSetting('end_time', float, None, 'end of indexed tlogs to load in seconds, negative from end'),
+              MPSetting('logcache', bool, True, 'keep a cache of log data for fast graphs'),
               ]
             )
 
         self.mlog = None
+        self.logcache = None
         self.mav_param = None
         self.filename = None
         self.command_map = command_map
@@ -172,13 +169,6 @@ class MEState(object):
         except EOFError:
             pass
             
-def have_graph(name):
-    '''return true if we have a graph of the given name'''
-    for g in mestate.graphs:
-        if g.name == name:
-            return True
-    return False
-
 def menu_callback(m):
     '''called on menu selection'''
     if m.returnkey.startswith('# '):
@@ -260,118 +250,32 @@ def setup_menus():
 
 def expression_ok(expression, msgs=None):
     '''return True if an expression is OK with current messages'''
-    expression_ok = True
-    if expression is None:
-        return False
-    fields = expression.split()
     if msgs is None:
         msgs = mestate.status.msgs
-    for f in fields:
-        try:
-            if f.endswith(">"):
-                a2 = f.rfind("<")
-                if a2 != -1:
-                    f = f[:a2]
-            if f.endswith(':2'):
-                f = f[:-2]
-            if f[-1] == '}':
-                # avoid passing nocondition unless needed to allow us to work witih older
-                # pymavlink versions
-                res = mavutil.evaluate_expression(f, msgs, nocondition=True)
-            else:
-                res = mavutil.evaluate_expression(f, msgs)
-            if res is None:
-                expression_ok = False
-        except Exception:
-            expression_ok = False
-            break
-    return expression_ok
+    return graphdefs.expression_ok(expression, msgs)
 
 def load_graph_xml(xml, filename, load_all=False):
     '''load a graph from one xml string'''
-    ret = []
-    try:
-        root = objectify.fromstring(xml)
-    except Exception as ex:
-        print(filename, ex)
-        return []
-    if root.tag != 'graphs':
-        return []
-    if not hasattr(root, 'graph'):
-        return []
-    names = set()
-    for g in root.graph:
-        name = g.attrib['name']
-        expressions = []
-        for e in g.expression:
-            if e.text is not None:
-                expressions.append(e.text)
-        if load_all:
-            if not name in names:
-                if hasattr(g,'description'):
-                    description = g.description.text
-                else:
-                    description = ''
-                ret.append(GraphDefinition(name, expressions[0], description, expressions, filename))
-            names.add(name)
-            continue
-        if have_graph(name):
-            continue
-        for e in expressions:
-            if e is None:
-                continue
-            e = xml_unescape(e)
-            if expression_ok(e):
-                if hasattr(g,'description'):
-                    description = g.description.text
-                else:
-                    description = ''
-                ret.append(GraphDefinition(name, e, description, expressions, filename))
-                break
-    return ret
+    graphs = graphdefs.load_graph_xml(xml, filename)
+    if load_all:
+        # the first definition of each graph, for saving the file again
+        ret = []
+        names = set()
+        for g in graphs:
+            if not g.name in names:
+                ret.append(g)
+            names.add(g.name)
+        return ret
+    return graphdefs.choose_graphs(graphs, mestate.status.msgs, [g.name for g in mestate.graphs])
 
 def load_graphs():
     '''load graphs from mavgraphs.xml'''
     mestate.graphs = []
-    gfiles = ['mavgraphs.xml']
-    for dirname, dirnames, filenames in os.walk(mp_util.dot_mavproxy()):
-        # Skip XML files in the LogMessages subfolder
-        if os.path.basename(dirname) == "LogMessages":
-            continue
-        for filename in filenames:
-            if filename.lower().endswith('.xml'):
-                gfiles.append(os.path.join(dirname, filename))
-
-    for file in gfiles:
-        if not os.path.exists(file):
-            continue
-        # skip parameter files.  They specify an encoding, and under
-        # Python3 this leads to a warning from etree
-        if os.path.basename(file) in ["ArduSub.xml", "ArduPlane.xml", "APMrover2.xml", "ArduCopter.xml",
-                                      "AntennaTracker.xml", "Blimp.xml", "Rover.xml", "Heli.xml"]:
-            continue
-        graphs = load_graph_xml(open(file).read(), file)
+    for (name, filename, xml) in graphdefs.graph_xml():
+        graphs = load_graph_xml(xml, filename)
         if graphs:
             mestate.graphs.extend(graphs)
-            mestate.console.writeln("Loaded %s" % file)
-    # also load the built in graphs
-    try:
-        dlist = pkg_resources.resource_listdir("MAVProxy", "tools/graphs")
-        for f in dlist:
-            raw = pkg_resources.resource_stream("MAVProxy", "tools/graphs/%s" % f).read()
-            graphs = load_graph_xml(raw, None)
-            if graphs:
-                mestate.graphs.extend(graphs)
-                mestate.console.writeln("Loaded %s" % f)
-    except Exception:
-        #we're in a Windows exe, where pkg_resources doesn't work
-        import pkgutil
-        for f in ["ekf3Graphs.xml", "ekfGraphs.xml", "mavgraphs.xml", "mavgraphs2.xml"]:
-            raw = pkgutil.get_data( 'MAVProxy', 'tools//graphs//' + f)
-            graphs = load_graph_xml(raw, None)
-            if graphs:
-                mestate.graphs.extend(graphs)
-                mestate.console.writeln("Loaded %s" % f)
+            mestate.console.writeln("Loaded %s" % name)
     mestate.graphs = sorted(mestate.graphs, key=lambda g: g.name)
 
 def flightmode_colours():
@@ -508,7 +412,8 @@ def cmd_fft(args):
         condition = None
     global fft_tool, xlimits
     fft_tool = mav_fft.MavFFT(mlog=mestate.mlog,
-                              xlimits=xlimits)
+                              xlimits=xlimits,
+                              log_cache=mestate.logcache)
     fft_tool.start()
 
 msgstats_tool = None
@@ -569,7 +474,8 @@ def cmd_magfit(args):
     global mfit_tool, xlimits
     mfit_tool = magfit.MagFit(title="MagFit",
                               mlog=mestate.mlog,
-                              xlimits=xlimits)
+                              xlimits=xlimits,
+                              log_cache=mestate.logcache)
     mfit_tool.start()
 
 def save_graph(graphdef):
@@ -610,7 +516,7 @@ def save_graph(graphdef):
         for e in g.expressions:
             if e is None:
                 continue
-            e = xml_escape(e)
+            e = graphdefs.xml_escape(e)
             f.write("  <expression>%s</expression>\n" % e.strip())
         f.write(" </graph>\n\n")
     f.write("</graphs>\n")
@@ -1352,9 +1258,16 @@ def loadfile(args):
     '''load a log file (path given by arg)'''
     mestate.console.write("Loading %s...\n" % args)
     t0 = time.time()
-    mlog = mavutil.mavlink_connection(args, notimestamps=False,
-                                      zero_time_base=False,
+    if args.endswith('.tlog'):
+        # use the tlog index, if any, to only load the requested time range
+        mlog = mp_tlogindex.open_tlog(args,
+                                      start_time=mestate.settings.start_time,
+                                      end_time=mestate.settings.end_time,
                                       progress_callback=progress_bar)
+    else:
+        mlog = mavutil.mavlink_connection(args, notimestamps=False,
+                                          zero_time_base=False,
+                                          progress_callback=progress_bar)
     mestate.filename = args
     mestate.mlog = mlog
     # note that this is a shallow copy of the messages.
@@ -1380,6 +1293,25 @@ def loadfile(args):
 
     mestate.mav_param = mlog.params
 
+    # done last as it rewinds the log
+    multiproc_util.log_cache_users.release(mestate.logcache)
+    mestate.logcache = None
+    if mestate.settings.logcache:
+        options = ''
+        if args.endswith('.tlog'):
+            options = 'start=%s end=%s' % (mestate.settings.start_time, mestate.settings.end_time)
+        try:
+            t0 = time.time()
+            key = mp_logcache.log_key(args, options)
+            mestate.logcache = mp_logcache.load(args, options, key=key)
+            if mestate.logcache is None:
+                mestate.console.write("Building log cache...\n")
+                mestate.logcache = mp_logcache.build(mlog, args, options, key=key, progress_callback=progress_bar)
+                mp_logcache.prune(keep=[key] + multiproc_util.log_cache_users.in_use())
+                mestate.console.write("\ndone (%.1fs)\n" % (time.time()-t0))
+        except Exception as ex:
+            print("Failed to use log cache: %s" % ex)
+
     setup_menus()
 
 def print_caught_exception(e):
@@ -1554,6 +1486,10 @@ if __name__ == "__main__":
     from argparse import ArgumentParser
     parser = ArgumentParser(description=__doc__)
     parser.add_argument("--version", action='store_true', help="show version")
+    parser.add_argument("--start-time", type=float, default=None,
+                        help="start of an indexed tlog to load in seconds, negative from end of log")
+    parser.add_argument("--end-time", type=float, default=None,
+                        help="end of an indexed tlog to load in seconds, negative from end of log")
     parser.add_argument("files", metavar="<FILE>", nargs="?")
     args = parser.parse_args()
 
@@ -1569,6 +1505,8 @@ if __name__ == "__main__":
         sys.exit(1)
     
     mestate = MEState()
+    mestate.settings.start_time = args.start_time
+    mestate.settings.end_time = args.end_time
     setup_file_menu()
 
     mestate.rl = rline.rline("MAV> ", mestate)
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+'''
+benchmark the MAVProxy packet pipeline
+
+Runs mavproxy.py headless with a chosen set of modules, feeds it
+synthesised MAVLink traffic from a number of vehicles at a chosen rate
+over UDP, and receives what it forwards on an output. Reports the
+message rate, forwarding latency percentiles, memory growth, CPU use
+and per-module timing statistics as JSON.
+
+Rates and vehicle counts may be comma separated lists, in which case
+each combination is run in turn:
+
+  mavbench.py --rate 1000,5000 --vehicles 1,4 --modules param,wp,terrain,adsb --output bench.json
+
+AP_FLAKE8_CLEAN
+'''
+
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from pymavlink import mavutil
+
+# message mix sent by each vehicle, as (type, share of the rate). Each
+# has a time field which carries a message counter, used to match
+# received messages to the time they were sent
+MESSAGE_MIX = [
+    ('ATTITUDE', 0.3),
+    ('GLOBAL_POSITION_INT', 0.2),
+    ('RAW_IMU', 0.2),
+    ('SCALED_PRESSURE', 0.1),
+    ('SERVO_OUTPUT_RAW', 0.1),
+    ('SYSTEM_TIME', 0.1),
+]
+
+COUNTER_FIELDS = {
+    'ATTITUDE': 'time_boot_ms',
+    'GLOBAL_POSITION_INT': 'time_boot_ms',
+    'RAW_IMU': 'time_usec',
+    'SCALED_PRESSURE': 'time_boot_ms',
+    'SERVO_OUTPUT_RAW': 'time_usec',
+    'SYSTEM_TIME': 'time_boot_ms',
+}
+
+
+def free_port():
+    '''return a free local UDP port'''
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def encode(mav, mtype, n):
+    '''return a message of type mtype with counter n'''
+    if mtype == 'ATTITUDE':
+        return mav.attitude_encode(n, 0.1, 0.2, 0.3, 0.01, 0.02, 0.03)
+    if mtype == 'GLOBAL_POSITION_INT':
+        return mav.global_position_int_encode(n, -353632620, 1491652370, 584000, 10000, 100, 200, 0, 9000)
+    if mtype == 'RAW_IMU':
+        return mav.raw_imu_encode(n, 1, 2, 1000, 3, 4, 5, 100, 200, 300)
+    if mtype == 'SCALED_PRESSURE':
+        return mav.scaled_pressure_encode(n, 1013.2, 0.1, 2500)
+    if mtype == 'SERVO_OUTPUT_RAW':
+        return mav.servo_output_raw_encode(n, 0, 1500, 1500, 1500, 1500, 1100, 1100, 1100, 1100)
+    if mtype == 'SYSTEM_TIME':
+        return mav.system_time_encode(0, n)
+    raise ValueError("Unknown message type %s" % mtype)
+
+
+def proc_stats(pid):
+    '''return (rss_kb, cpu_seconds) of a process, or (None, None) if unknown'''
+    try:
+        with open('/proc/%u/status' % pid) as f:
+            rss = None
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])
+        with open('/proc/%u/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        return (rss, (int(fields[11]) + int(fields[12])) / float(ticks))
+    except (OSError, IndexError, ValueError):
+        return (None, None)
+
+
+def percentile(values, pct):
+    '''return the pct percentile of a sorted list'''
+    if len(values) == 0:
+        return None
+    return values[min(int(len(values) * pct * 0.01), len(values) - 1)]
+
+
+class Receiver(object):
+    '''receive and time messages forwarded by MAVProxy'''
+
+    def __init__(self, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.sock.settimeout(0.1)
+        self.mav = mavutil.mavlink.MAVLink(None)
+        self.mav.robust_parsing = True
+        self.sent_times = {}
+        self.latencies = []
+        self.received = 0
+        self.measuring = False
+        self.running = True
+        self.thread = threading.Thread(target=self.receive_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def receive_thread(self):
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            now = time.monotonic()
+            msgs = self.mav.parse_buffer(data)
+            if not msgs:
+                continue
+            for m in msgs:
+                self.received += 1
+                if not self.measuring:
+                    continue
+                field = COUNTER_FIELDS.get(m.get_type(), None)
+                if field is None:
+                    continue
+                t = self.sent_times.pop((m.get_srcSystem(), m.get_type(), getattr(m, field)), None)
+                if t is not None:
+                    self.latencies.append(now - t)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+class Sender(object):
+    '''send synthesised traffic from a number of vehicles'''
+
+    def __init__(self, port, vehicles, receiver):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.dest = ('127.0.0.1', port)
+        self.receiver = receiver
+        self.mavs = []
+        for i in range(vehicles):
+            mav = mavutil.mavlink.MAVLink(None, srcSystem=i+1, srcComponent=1)
+            self.mavs.append(mav)
+        self.counter = [0] * vehicles
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, data):
+        try:
+            self.sock.sendto(data, self.dest)
+            self.sent += 1
+        except (BlockingIOError, OSError):
+            self.dropped += 1
+
+    def heartbeats(self):
+        for mav in self.mavs:
+            m = mav.heartbeat_encode(mavutil.mavlink.MAV_TYPE_QUADROTOR,
+                                     mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                                     mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, 0,
+                                     mavutil.mavlink.MAV_STATE_STANDBY)
+            self.send(m.pack(mav))
+
+    def run(self, rate, duration):
+        '''send at rate messages per second in total for duration seconds'''
+        types = []
+        for (mtype, share) in MESSAGE_MIX:
+            types.extend([mtype] * int(share * 10))
+        start = time.monotonic()
+        next_heartbeat = start
+        i = 0
+        while True:
+            now = time.monotonic()
+            if now - start >= duration:
+                break
+            if now >= next_heartbeat:
+                self.heartbeats()
+                next_heartbeat += 1
+            # send everything due by now
+            due = int((now - start) * rate)
+            while i < due:
+                v = i % len(self.mavs)
+                mav = self.mavs[v]
+                mtype = types[(i // len(self.mavs)) % len(types)]
+                self.counter[v] += 1
+                n = self.counter[v]
+                buf = encode(mav, mtype, n).pack(mav)
+                self.receiver.sent_times[(v+1, mtype, n)] = time.monotonic()
+                self.send(buf)
+                i += 1
+            time.sleep(0.0005)
+
+
+class Benchmark(object):
+    '''one benchmark run'''
+
+    def __init__(self, args, rate, vehicles):
+        self.args = args
+        self.rate = rate
+        self.vehicles = vehicles
+
+    def mavproxy_command(self, in_port, out_port, state_dir):
+        if self.args.mavproxy is not None:
+            cmd = [sys.executable, self.args.mavproxy]
+        else:
+            # the installed package, or the source tree we are in, see mavproxy_env()
+            cmd = [sys.executable, '-m', 'MAVProxy.mavproxy']
+        master = 'udpin:127.0.0.1:%u' % in_port
+        if self.args.reader is not None:
+            master += ':{"reader":"%s"}' % self.args.reader
+        cmd.extend(['--master', master,
+                    '--out', 'udp:127.0.0.1:%u' % out_port,
+                    '--default-modules', self.args.modules,
+                    '--nowait',
+                    '--cmd', 'set perfstats 1; set fastfwd %u' % int(self.args.fastfwd)])
+        if self.args.logs:
+            cmd.extend(['--state-basedir', state_dir])
+        else:
+            cmd.append('--no-state')
+        for m in self.args.load_module:
+            cmd.extend(['--load-module', m])
+        return cmd
+
+    def mavproxy_env(self):
+        '''return the environment to run MAVProxy in, headless and able to
+        import the MAVProxy package it is run from'''
+        env = dict(os.environ)
+        env.pop('DISPLAY', None)
+        env.pop('WAYLAND_DISPLAY', None)
+        if self.args.mavproxy is not None:
+            mavproxy = os.path.abspath(self.args.mavproxy)
+        else:
+            mavproxy = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mavproxy.py')
+        root = os.path.dirname(os.path.dirname(mavproxy))
+        if os.path.exists(os.path.join(root, 'MAVProxy', 'mavproxy.py')):
+            # a source tree, which may not be on the python path
+            path = env.get('PYTHONPATH', None)
+            env['PYTHONPATH'] = root if not path else root + os.pathsep + path
+        return env
+
+    def run(self):
+        in_port = free_port()
+        out_port = free_port()
+        state_dir = tempfile.mkdtemp(prefix='mavbench')
+        stats_file = os.path.join(state_dir, 'perfstats.json')
+        env = self.mavproxy_env()
+        receiver = Receiver(out_port)
+        sender = Sender(in_port, self.vehicles, receiver)
+        proc = subprocess.Popen(self.mavproxy_command(in_port, out_port, state_dir),
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                env=env, cwd=state_dir)
+        output = []
+        reader = threading.Thread(target=lambda: output.extend(proc.stdout.readlines()))
+        reader.daemon = True
+        reader.start()
+
+        def command(c):
+            proc.stdin.write((c + '\n').encode())
+            proc.stdin.flush()
+
+        # wait for MAVProxy to start forwarding
+        t0 = time.monotonic()
+        while receiver.received == 0 and time.monotonic() - t0 < self.args.startup_timeout:
+            sender.heartbeats()
+            time.sleep(0.2)
+        if receiver.received == 0:
+            proc.kill()
+            receiver.close()
+            raise RuntimeError("MAVProxy did not start forwarding:\n%s" % b''.join(output).decode(errors='replace'))
+        sender.run(self.rate, self.args.warmup)
+
+        # measured run
+        command('module stats reset')
+        receiver.measuring = True
+        receiver.received = 0
+        receiver.sent_times.clear()
+        sender.sent = 0
+        sender.dropped = 0
+        (rss_start, cpu_start) = proc_stats(proc.pid)
+        rss_samples = []
+        sampler_running = [True]
+
+        def sampler():
+            while sampler_running[0]:
+                (rss, cpu) = proc_stats(proc.pid)
+                if rss is not None:
+                    rss_samples.append(rss)
+                time.sleep(1)
+        sampler_thread = threading.Thread(target=sampler)
+        sampler_thread.daemon = True
+        sampler_thread.start()
+
+        t_start = time.monotonic()
+        sender.run(self.rate, self.args.duration)
+        send_time = time.monotonic() - t_start
+        # let the pipeline drain
+        time.sleep(0.5)
+        elapsed = time.monotonic() - t_start
+        (rss_end, cpu_end) = proc_stats(proc.pid)
+        sampler_running[0] = False
+        receiver.measuring = False
+
+        command('module stats json %s' % stats_file)
+        command('exit')
+        try:
+            proc.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        receiver.close()
+
+        perf = None
+        try:
+            with open(stats_file) as f:
+                perf = json.loads(f.readlines()[-1])
+        except (OSError, IndexError, ValueError):
+            pass
+        shutil.rmtree(state_dir, ignore_errors=True)
+        return self.result(sender, receiver, send_time, elapsed, rss_start, rss_end, rss_samples, cpu_start, cpu_end, perf)
+
+    def result(self, sender, receiver, send_time, elapsed, rss_start, rss_end, rss_samples, cpu_start, cpu_end, perf):
+        latencies = sorted(receiver.latencies)
+        ret = {
+            'rate': self.rate,
+            'vehicles': self.vehicles,
+            'modules': self.args.modules.split(',') + self.args.load_module,
+            'fastfwd': self.args.fastfwd,
+            'reader': self.args.reader,
+            'duration': send_time,
+            'sent': sender.sent,
+            'send_errors': sender.dropped,
+            'received': receiver.received,
+            'sent_per_sec': sender.sent / send_time,
+            'received_per_sec': receiver.received / send_time,
+            'lost': len(receiver.sent_times),
+            'latency_ms': {
+                'count': len(latencies),
+                'mean': 1000 * sum(latencies) / len(latencies) if latencies else None,
+                'p50': 1000 * percentile(latencies, 50) if latencies else None,
+                'p90': 1000 * percentile(latencies, 90) if latencies else None,
+                'p99': 1000 * percentile(latencies, 99) if latencies else None,
+                'max': 1000 * latencies[-1] if latencies else None,
+            },
+            'rss_kb': {
+                'start': rss_start,
+                'end': rss_end,
+                'growth': rss_end - rss_start if rss_start is not None and rss_end is not None else None,
+                'samples': rss_samples,
+            },
+            'cpu_percent': None,
+            'per_module': {},
+            'main_loop': {},
+        }
+        if cpu_start is not None and cpu_end is not None:
+            ret['cpu_percent'] = 100 * (cpu_end - cpu_start) / elapsed
+        if perf is not None:
+            stats = perf['stats']
+            for category in ['mavlink_packet', 'idle_task', 'periodic']:
+                for (name, s) in stats.get(category, {}).items():
+                    m = ret['per_module'].setdefault(name, {})
+                    m[category] = s
+                    m['cpu_percent'] = m.get('cpu_percent', 0) + 100 * s['total'] / elapsed
+            ret['main_loop'] = stats.get('main_loop', {})
+            ret['msgtype'] = stats.get('msgtype', {})
+        return ret
+
+
+def main():
+    from argparse import ArgumentParser, RawDescriptionHelpFormatter
+    # the module docstring without the lint marker, keeping its layout
+    parser = ArgumentParser(description=__doc__.replace('AP_FLAKE8_CLEAN', '').strip(),
+                            formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", default="1000", help="total messages per second, may be a comma separated list")
+    parser.add_argument("--vehicles", default="1", help="number of vehicles, may be a comma separated list")
+    parser.add_argument("--duration", type=float, default=10, help="measured run time in seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="warm up time in seconds")
+    parser.add_argument("--modules", default="param,wp,terrain,adsb,output",
+                        help="comma separated list of modules to load, replacing the default modules")
+    parser.add_argument("--load-module", action='append', default=[], help="extra module to load")
+    parser.add_argument("--fastfwd", action='store_true', help="enable the fastfwd setting")
+    parser.add_argument("--reader", default=None, choices=['thread', 'process'], help="use a link reader worker")
+    parser.add_argument("--logs", action='store_true', help="write telemetry logs (to a temporary directory)")
+    parser.add_argument("--mavproxy", default=None,
+                        help="path to mavproxy.py, default the MAVProxy package this tool is part of")
+    parser.add_argument("--startup-timeout", type=float, default=30, help="time to wait for MAVProxy to start")
+    parser.add_argument("--output", default=None, help="JSON output file, default stdout")
+    args = parser.parse_args()
+
+    results = []
+    for vehicles in [int(v) for v in args.vehicles.split(',')]:
+        for rate in [float(r) for r in args.rate.split(',')]:
+            print("Running %u vehicles at %.0f msgs/s" % (vehicles, rate), file=sys.stderr)
+            results.append(Benchmark(args, rate, vehicles).run())
+    report = {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    try:
+        from importlib import metadata
+        report['mavproxy_version'] = metadata.version('MAVProxy')
+    except Exception:
+        report['mavproxy_version'] = None
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -19,9 +19,11 @@ from pymavlink import mavextra
 
 from MAVProxy.modules.mavproxy_map import mp_slipmap, mp_tile
 from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib import mp_expression
 from MAVProxy.modules.lib import multiproc
 from MAVProxy.modules.lib import grapher
 from MAVProxy.modules.lib import kmlread
+from MAVProxy.modules.lib import mp_tlogindex
 
 
 def create_map(title):
@@ -349,20 +351,9 @@ def pos_expressions(type_list):
     return ret
 
 
-def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
-    '''create a map for a log file'''
-    wp = mavwp.MAVWPLoader()
-    if options.mission is not None:
-        wp.load(options.mission)
-    fen = mavwp.MAVFenceLoader()
-    if options.fence is not None:
-        fen.load(options.fence)
-    all_false = True
-    for s in flightmode_selections:
-        if s:
-            all_false = False
-    idx = 0
-    path = []
+def mavflightview_types(options):
+    '''return the position expressions for options, and the set of
+    message types needed from the log to evaluate them'''
     expressions = []
 
     if options.types is not None:
@@ -397,6 +388,25 @@ def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
         caps = set(re.findall(re_caps, colour_source))
         recv_match_types.update(caps)
 
+    return (expressions, recv_match_types)
+
+
+def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
+    '''create a map for a log file'''
+    wp = mavwp.MAVWPLoader()
+    if options.mission is not None:
+        wp.load(options.mission)
+    fen = mavwp.MAVFenceLoader()
+    if options.fence is not None:
+        fen.load(options.fence)
+    all_false = True
+    for s in flightmode_selections:
+        if s:
+            all_false = False
+    idx = 0
+    path = []
+    (expressions, recv_match_types) = mavflightview_types(options)
+
     print("Looking for types %s" % str(list(recv_match_types)))
 
     last_timestamps = {}
@@ -493,7 +503,7 @@ def mavflightview_mav(mlog, options=None, flightmode_selections=[]):
                 else:
                     # we need to evaluate the expression to produce an object
                     try:
-                        v = mavutil.evaluate_expression(expression.expression, mlog.messages)
+                        v = mp_expression.evaluate_expression(expression.expression, mlog.messages)
                     except Exception:
                         continue
                 if v is None:
@@ -710,7 +720,14 @@ def load_kml(kml):
 
 def mavflightview(filename, options):
     print("Loading %s ..." % filename)
-    mlog = mavutil.mavlink_connection(filename)
+    if filename.endswith('.tlog'):
+        # only load the messages we need, if the log has an index
+        (expressions, types) = mavflightview_types(options)
+        if options.condition is not None:
+            types.update(re.findall('[A-Z_][A-Z0-9_]+', options.condition))
+        mlog = mp_tlogindex.open_tlog(filename, types=types)
+    else:
+        mlog = mavutil.mavlink_connection(filename)
     stuff = mavflightview_mav(mlog, options)
     if stuff is None:
         return
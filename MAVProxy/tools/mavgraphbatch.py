@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+'''
+render MAVExplorer graphs for many logs without a display
+
+Renders the named graphs from the MAVExplorer graph definitions (the
+built in tools/graphs files, XML files in ~/.mavproxy and any given
+with --graph-file) for every log given or found in the given
+directories, writing an image per graph for each log. Logs are rendered
+by a pool of processes, one per core by default, and graphs are drawn
+from the columnar log cache MAVExplorer uses, which is built for logs
+not already cached:
+
+  mavgraphbatch.py --graph 'Attitude/*' --graph 'Sensors/Accelerometer/*' --format svg --outdir graphs logs/
+
+As in MAVExplorer, where a graph is defined more than once the first
+definition with an expression the log has the messages for is used.
+Graphs the log has no data for are skipped.
+
+AP_FLAKE8_CLEAN
+'''
+
+import fnmatch
+import os
+import re
+import sys
+import time
+
+from MAVProxy.modules.lib import graphdefs
+
+LOG_EXTENSIONS = ['.bin', '.log', '.tlog']
+
+
+def graph_names(graphs):
+    '''return sorted list of the names of the graph definitions'''
+    return sorted(set([g.name for g in graphs]))
+
+
+def select_graphs(graphs, patterns):
+    '''return list of the definitions of the graphs with names matching
+    the patterns, in the order they were loaded'''
+    names = set()
+    for p in patterns:
+        matches = fnmatch.filter(graph_names(graphs), p)
+        if len(matches) == 0:
+            raise ValueError("No graph matching %s" % p)
+        names.update(matches)
+    return [g for g in graphs if g.name in names]
+
+
+def find_logs(paths):
+    '''return list of (log, output name) for the files and directories
+    given, the output name being the path of the log relative to the
+    directory it was found in, without its extension'''
+    ret = []
+    for path in paths:
+        if not os.path.isdir(path):
+            ret.append((path, os.path.splitext(os.path.basename(path))[0]))
+            continue
+        for dirname, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in LOG_EXTENSIONS:
+                    log = os.path.join(dirname, filename)
+                    name = os.path.splitext(os.path.relpath(log, path))[0]
+                    ret.append((log, name))
+    return ret
+
+
+def graph_filename(name):
+    '''return a file name for a graph name'''
+    return re.sub('[^A-Za-z0-9_.-]', '_', name)
+
+
+def last_messages(cache):
+    '''return a dictionary standing in for the last message of each type
+    in a log, from its cache, for choosing graph expressions'''
+    from MAVProxy.modules.lib import mp_expression
+    from MAVProxy.modules.lib import mp_logcache
+
+    class LastMessage(mp_expression.Columns):
+        '''the last values of a message type, indexable by instance'''
+
+        def __init__(self, fields, instances):
+            mp_expression.Columns.__init__(self, fields)
+            self._instances = instances
+
+        def __getitem__(self, instance):
+            return self._instances[instance]
+
+    def values(mtype, row):
+        column = cache.data(mtype)[:, row]
+        return dict([(f, column[mp_logcache.FIELD_ROW+i].item()) for (i, f) in enumerate(cache.fields(mtype))])
+
+    ret = {}
+    for mtype in cache.types():
+        if cache.count(mtype) == 0:
+            continue
+        instances = {}
+        ifield = cache.instance_field(mtype)
+        if ifield is not None:
+            ivalues = cache.column(mtype, ifield)
+            for instance in cache.instances(mtype):
+                row = len(ivalues) - 1 - int((ivalues[::-1] == instance).argmax())
+                instances[int(instance)] = mp_expression.Columns(values(mtype, row))
+        ret[mtype] = LastMessage(values(mtype, -1), instances)
+    return ret
+
+
+def render_log(log, name, graphs, options):
+    '''render the graphs for one log, returning (log, list of files
+    written, list of errors, seconds taken)'''
+    t0 = time.time()
+    written = []
+    errors = []
+    try:
+        # grapher uses the backend from MPLBACKEND when it is set
+        os.environ['MPLBACKEND'] = 'Agg'
+        import matplotlib.pyplot as plt
+        from pymavlink import mavutil
+        from MAVProxy.modules.lib import grapher
+        from MAVProxy.modules.lib import mp_logcache
+        plt.switch_backend('Agg')
+
+        mlog = mavutil.mavlink_connection(log, dialect=options.dialect)
+        cache = None
+        if not options.no_cache:
+            cache = mp_logcache.open_cache(log, mlog, cache_dir=options.cache_dir)
+            msgs = last_messages(cache)
+        else:
+            # read the log for the last message of each type
+            while mlog.recv_msg() is not None:
+                pass
+            msgs = mlog.messages
+        chosen = graphdefs.choose_graphs(graphs, msgs)
+        flightmodes = mlog.flightmode_list()
+        outdir = os.path.join(options.outdir, name)
+        for g in chosen:
+            grapher.tday_base = None
+            mg = grapher.MavGraph()
+            mg.set_title(g.name)
+            mg.set_show_flightmode(options.show_flightmode)
+            mg.set_linestyle(options.linestyle)
+            mg.set_marker(options.marker)
+            if options.max_rate > 0:
+                mg.set_max_message_rate(options.max_rate)
+            mg.add_mav(mlog)
+            mg.set_log_cache(cache)
+            for f in g.expression.split():
+                mg.add_field(f)
+            try:
+                mg.process([], flightmodes)
+                if all([len(x) == 0 for x in mg.x]):
+                    continue
+                if not os.path.isdir(outdir):
+                    os.makedirs(outdir, exist_ok=True)
+                filename = os.path.join(outdir, graph_filename(g.name) + '.' + options.format)
+                mg.show(1, output=filename)
+                written.append(filename)
+            except Exception as ex:
+                errors.append("%s: %s" % (g.name, ex))
+            finally:
+                plt.close('all')
+                mlog.rewind()
+    except Exception as ex:
+        errors.append(str(ex))
+    return (log, written, errors, time.time() - t0)
+
+
+def main():
+    from argparse import ArgumentParser, RawDescriptionHelpFormatter
+    import concurrent.futures
+    # the module docstring without the lint marker, keeping its layout
+    parser = ArgumentParser(description=__doc__.replace('AP_FLAKE8_CLEAN', '').strip(),
+                            formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("--graph", action='append', default=[],
+                        help="name of a graph to render, may contain wildcards and be given more than once")
+    parser.add_argument("--graph-file", action='append', default=[], help="extra graph XML file")
+    parser.add_argument("--list", action='store_true', help="list the graph names and exit")
+    parser.add_argument("--outdir", default='graphs', help="directory to write the images to")
+    parser.add_argument("--format", default='png', choices=['png', 'svg', 'pdf'], help="image format")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of logs rendered at once")
+    parser.add_argument("--no-cache", action='store_true', help="parse the logs rather than use the log cache")
+    parser.add_argument("--cache-dir", default=None, help="log cache directory")
+    parser.add_argument("--show-flightmode", type=int, default=1, help="show flight modes (0, 1 or 2)")
+    parser.add_argument("--marker", default=None, help="point marker")
+    parser.add_argument("--linestyle", default=None, help="line style")
+    parser.add_argument("--max-rate", type=float, default=0, help="maximum rate of messages graphed in Hz")
+    parser.add_argument("--dialect", default="ardupilotmega", help="MAVLink dialect")
+    parser.add_argument("logs", metavar="LOG", nargs="*", help="log files or directories of logs")
+    args = parser.parse_args()
+
+    graphs = graphdefs.load_graphs(args.graph_file)
+    if args.list:
+        for name in graph_names(graphs):
+            print(name)
+        return
+    if len(args.graph) == 0 or len(args.logs) == 0:
+        parser.error("graphs and logs are needed")
+    try:
+        selected = select_graphs(graphs, args.graph)
+    except ValueError as ex:
+        parser.error(str(ex))
+    logs = find_logs(args.logs)
+    if len(logs) == 0:
+        parser.error("no logs found")
+
+    t0 = time.time()
+    failed = 0
+    total = 0
+    jobs = max(1, min(args.jobs or 1, len(logs)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(render_log, log, name, selected, args) for (log, name) in logs]
+        for (i, future) in enumerate(concurrent.futures.as_completed(futures)):
+            (log, written, errors, seconds) = future.result()
+            total += len(written)
+            print("%u/%u %s: %u graphs in %.1fs" % (i+1, len(logs), log, len(written), seconds))
+            for e in errors:
+                print("  %s" % e, file=sys.stderr)
+            if len(errors) > 0:
+                failed += 1
+    print("Rendered %u graphs from %u logs in %.1fs" % (total, len(logs), time.time() - t0))
+    if failed > 0:
+        print("%u logs had errors" % failed, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()